@@ -1,18 +1,40 @@
+import asyncio
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Awaitable, Callable, Optional, Set
+import os
+import threading
+import time
 from passlib.context import CryptContext
 import jwt
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
-import database, models
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+import database, metrics, models
 
 SECRET_KEY = "supersecretkey_for_hackathon_demo_only"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7 # 7 days
+PRINCIPAL_CACHE_SIZE = int(os.getenv("PRINCIPAL_CACHE_SIZE", "10000"))
+# Cached principals are re-read from the database at least this often, so a
+# change that reaches a worker late (or not at all) is stale for a bounded time.
+# Changes are also announced over the pub/sub broker to every worker's cache.
+PRINCIPAL_CACHE_TTL_S = float(os.getenv("PRINCIPAL_CACHE_TTL_S", "60"))
+PRINCIPAL_INVALIDATION_GROUP = "principal_invalidation"
+# bcrypt runs on its own small thread pool so a login storm can't starve the
+# event loop. Hashes with a different cost factor are upgraded on next login.
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Logins queued for the pool beyond this are turned away with 503
+LOGIN_MAX_PENDING = int(os.getenv("LOGIN_MAX_PENDING", "256"))
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
+_hash_pool = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+_pending_hashes = 0
 
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
@@ -20,6 +42,34 @@ def verify_password(plain_password, hashed_password):
 def get_password_hash(password):
     return pwd_context.hash(password)
 
+async def _run_on_hash_pool(fn, *args):
+    global _pending_hashes
+    if _pending_hashes >= LOGIN_MAX_PENDING:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many logins in progress, retry shortly",
+            headers={"Retry-After": "1"},
+        )
+    _pending_hashes += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_hash_pool, fn, *args)
+    finally:
+        _pending_hashes -= 1
+
+async def verify_password_async(plain_password, hashed_password) -> tuple[bool, Optional[str]]:
+    """
+    Verifies on the hash pool. Returns (valid, new_hash); new_hash is set when
+    the stored hash uses outdated settings and should be replaced.
+    """
+    if hashed_password is None:
+        # Unknown user: spend the same time as a real check
+        await _run_on_hash_pool(pwd_context.dummy_verify)
+        return False, None
+    return await _run_on_hash_pool(pwd_context.verify_and_update, plain_password, hashed_password)
+
+async def get_password_hash_async(password) -> str:
+    return await _run_on_hash_pool(pwd_context.hash, password)
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
@@ -30,7 +80,152 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(database.get_db)):
+@dataclass(frozen=True, slots=True)
+class Principal:
+    """The authenticated user as seen by request handlers."""
+    id: int
+    email: str
+    role: str
+    hospital_id: Optional[int]
+
+    @classmethod
+    def from_user(cls, user: models.User) -> "Principal":
+        return cls(id=user.id, email=user.email, role=user.role, hospital_id=user.hospital_id)
+
+class PrincipalCache:
+    """
+    Bounded LRU of decoded tokens. An entry lives until its token's `exp` or
+    for `ttl_s`, whichever is sooner, or until the user behind it changes
+    (see the User listeners below).
+    """
+
+    def __init__(self, max_entries: int, ttl_s: float):
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self.entries: OrderedDict[str, tuple[Principal, float]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, token: str) -> Optional[Principal]:
+        with self._lock:
+            entry = self.entries.get(token)
+            if entry is not None and entry[1] > time.time():
+                self.entries.move_to_end(token)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                del self.entries[token]
+            self.misses += 1
+            return None
+
+    def put(self, token: str, principal: Principal, expires_at: float):
+        expires_at = min(expires_at, time.time() + self.ttl_s)
+        with self._lock:
+            self.entries[token] = (principal, expires_at)
+            self.entries.move_to_end(token)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def invalidate_user(self, user_id: int):
+        with self._lock:
+            for token in [t for t, (p, _) in self.entries.items() if p.id == user_id]:
+                del self.entries[token]
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "size": len(self.entries),
+            "max_entries": self.max_entries,
+            "ttl_s": self.ttl_s,
+        }
+
+principal_cache = PrincipalCache(PRINCIPAL_CACHE_SIZE, PRINCIPAL_CACHE_TTL_S)
+metrics.register_cache("principal", principal_cache.stats)
+
+# Set by announce_invalidations() once the broker is running
+_announce_loop: Optional[asyncio.AbstractEventLoop] = None
+_announce: Optional[Callable[[str, str], Awaitable[None]]] = None
+_announcing: Set[asyncio.Future] = set()
+
+def announce_invalidations(loop: asyncio.AbstractEventLoop, publish: Callable[[str, str], Awaitable[None]]):
+    """
+    Routes committed user changes to every worker: `publish(message, group_id)`
+    is ConnectionManager.broadcast_to_group, and each worker hands messages of
+    PRINCIPAL_INVALIDATION_GROUP to on_invalidation().
+    """
+    global _announce_loop, _announce
+    _announce_loop, _announce = loop, publish
+
+def on_invalidation(message: str):
+    principal_cache.invalidate_user(int(message))
+
+async def _publish_invalidation(user_id: int):
+    try:
+        await _announce(str(user_id), PRINCIPAL_INVALIDATION_GROUP)
+    except Exception as e:
+        print(f"Principal invalidation for user {user_id} failed: {str(e)}")
+
+def _schedule_invalidation(user_id: int):
+    if _announce is None:
+        return
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if running is _announce_loop:
+        future = _announce_loop.create_task(_publish_invalidation(user_id))
+    else:
+        # Sync endpoints commit on the threadpool
+        future = asyncio.run_coroutine_threadsafe(_publish_invalidation(user_id), _announce_loop)
+    _announcing.add(future)
+    future.add_done_callback(_announcing.discard)
+
+@event.listens_for(models.User, "after_update")
+@event.listens_for(models.User, "after_delete")
+def _forget_changed_user(mapper, connection, target):
+    principal_cache.invalidate_user(target.id)
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault("changed_users", set()).add(target.id)
+
+@event.listens_for(Session, "after_commit")
+def _announce_changed_users(session):
+    # Other workers hear about a change only once it is visible to them
+    for user_id in session.info.pop("changed_users", ()):
+        principal_cache.invalidate_user(user_id)
+        _schedule_invalidation(user_id)
+
+@event.listens_for(Session, "after_rollback")
+def _drop_changed_users(session):
+    session.info.pop("changed_users", None)
+
+def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(database.get_db)) -> Principal:
+    return resolve_token(token, db)
+
+def principal_for_socket(token: Optional[str]) -> Optional[Principal]:
+    """The principal behind a WebSocket's ?token=, or None if it is missing or invalid. Blocking; run it off the loop."""
+    if not token:
+        return None
+    db = database.SessionLocal()
+    try:
+        return resolve_token(token, db)
+    except HTTPException:
+        return None
+    finally:
+        db.close()
+
+def resolve_token(token: str, db: Session) -> Principal:
+    principal = principal_cache.get(token)
+    if principal is not None:
+        return principal
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -46,17 +241,20 @@ def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(
     user = db.query(models.User).filter(models.User.email == email).first()
     if user is None:
         raise credentials_exception
-    return user
+    principal = Principal.from_user(user)
+    if "exp" in payload:
+        principal_cache.put(token, principal, payload["exp"])
+    return principal
 
-def get_current_active_user(current_user: models.User = Depends(get_current_user)):
+def get_current_active_user(current_user: Principal = Depends(get_current_user)):
     return current_user
 
-def get_current_hospital_staff(current_user: models.User = Depends(get_current_user)):
+def get_current_hospital_staff(current_user: Principal = Depends(get_current_user)):
     if current_user.role != "HOSPITAL_STAFF":
         raise HTTPException(status_code=403, detail="Not enough permissions")
     return current_user
 
-def get_current_ambulance_driver(current_user: models.User = Depends(get_current_user)):
+def get_current_ambulance_driver(current_user: Principal = Depends(get_current_user)):
     if current_user.role != "AMBULANCE_DRIVER":
         raise HTTPException(status_code=403, detail="Not enough permissions")
     return current_user
@@ -0,0 +1,143 @@
+import asyncio
+import datetime
+import os
+from typing import Awaitable, Callable, List, Tuple
+
+from sqlalchemy import case, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+import dashboard, engine, models
+
+# Every dispatch holds a bed at its destination hospital until the ambulance
+# arrives (the bed is then occupied), the trip is cancelled, or the hold is
+# older than BED_HOLD_TTL_S. Holds are counted in hospitals.icu_reserved /
+# general_reserved, and matching only sees beds that are free and unheld.
+BED_HOLD_TTL_S = float(os.getenv("BED_HOLD_TTL_S", "7200"))
+BED_SWEEP_INTERVAL_S = float(os.getenv("BED_SWEEP_INTERVAL_S", "60"))
+
+# bed type -> (unoccupied beds, how many of them are held)
+_COLUMNS = {
+    "icu": (models.Hospital.icu_beds, models.Hospital.icu_reserved),
+    "general": (models.Hospital.general_beds, models.Hospital.general_reserved),
+}
+
+def bed_order(emergency_type: str) -> Tuple[str, str]:
+    # The same preference spread matching uses in engine.match_hospitals_batch
+    if emergency_type in engine.ICU_EMERGENCIES or emergency_type == "Trauma":
+        return ("icu", "general")
+    return ("general", "icu")
+
+def _hospital_update(hospital_id: int):
+    return update(models.Hospital).where(models.Hospital.id == hospital_id)
+
+def _returning_hospital(statement):
+    return statement.returning(*models.Hospital.__table__.columns).execution_options(synchronize_session=False)
+
+def _hold_statement(hospital_id: int, bed_type: str):
+    # The availability check and the increment are one UPDATE, so the database's
+    # row lock decides which of several concurrent dispatches gets the last bed
+    beds, reserved = _COLUMNS[bed_type]
+    return _returning_hospital(_hospital_update(hospital_id).where(beds - reserved > 0).values({reserved: reserved + 1}))
+
+async def reserve(db: AsyncSession, hospital_id: int, emergency_type: str) -> Tuple[object, str]:
+    """
+    Holds a bed in the caller's transaction. Returns (hospital row after the
+    hold, bed type), or (None, None) if it has no free bed of either type or
+    does not exist; callers tell those apart as they do for update_capacity().
+    Run it first, so a dispatch to a full hospital fails before writing anything else.
+    """
+    # A plain read first: a hospital that is already full is turned away without
+    # taking the write lock. The conditional UPDATE below still has the last word.
+    free = (await db.execute(
+        select(*(beds - reserved for beds, reserved in _COLUMNS.values())).where(models.Hospital.id == hospital_id)
+    )).first()
+    if free is None:
+        return None, None
+    free_by_type = dict(zip(_COLUMNS, free))
+    for bed_type in bed_order(emergency_type):
+        if free_by_type[bed_type] <= 0:
+            continue
+        hospital = (await db.execute(_hold_statement(hospital_id, bed_type))).first()
+        if hospital is not None:
+            return hospital, bed_type
+    return None, None
+
+def reservation(trip_id: int, hospital_id: int, bed_type: str) -> models.BedReservation:
+    """The row recording a hold taken by reserve(), once the trip has an id."""
+    now = datetime.datetime.utcnow()
+    return models.BedReservation(
+        trip_id=trip_id, hospital_id=hospital_id, bed_type=bed_type, status="HELD",
+        created_at=now, expires_at=now + datetime.timedelta(seconds=BED_HOLD_TTL_S),
+    )
+
+def _decrement(column):
+    return case((column > 0, column - 1), else_=0)
+
+def settle(db: Session, trip_id: int, status: str):
+    """
+    Ends the trip's bed hold in the caller's transaction: COMMITTED turns it
+    into an occupied bed, RELEASED/EXPIRED frees it. Returns the hospital row
+    after the change, or None if the trip held no bed (or it was already
+    settled), so retries and races with the sweeper are harmless.
+    """
+    held = db.execute(
+        update(models.BedReservation)
+        .where(models.BedReservation.trip_id == trip_id, models.BedReservation.status == "HELD")
+        .values(status=status, settled_at=datetime.datetime.utcnow())
+        .returning(models.BedReservation.hospital_id, models.BedReservation.bed_type)
+        .execution_options(synchronize_session=False)
+    ).first()
+    if held is None:
+        return None
+    beds, reserved = _COLUMNS[held.bed_type]
+    values = {reserved: _decrement(reserved)}
+    if status == "COMMITTED":
+        values[beds] = _decrement(beds)
+    return db.execute(_returning_hospital(_hospital_update(held.hospital_id).values(values))).first()
+
+def update_capacity(db: Session, hospital_id: int, capacity):
+    """
+    Applies a HospitalCapacityUpdate in one UPDATE: absolute counts replace
+    the unoccupied-bed column, deltas are added to whatever it holds at that
+    moment. Neither may leave fewer unoccupied beds than are held, checked in
+    the same statement. Returns the hospital row, or None if there is no such
+    hospital or the update would drop below its holds.
+    """
+    values, guards = {}, []
+    for bed_type, (beds, reserved) in _COLUMNS.items():
+        absolute, delta = getattr(capacity, f"{bed_type}_beds"), getattr(capacity, f"{bed_type}_delta")
+        if absolute is not None:
+            values[beds] = absolute
+            guards.append(reserved <= absolute)
+        elif delta:
+            values[beds] = beds + delta
+            if delta < 0:
+                guards.append(reserved <= beds + delta)
+    return db.execute(_returning_hospital(_hospital_update(hospital_id).where(*guards).values(values))).first()
+
+def expire_holds(db: Session) -> List[Tuple[object, int]]:
+    """Frees every hold past its expiry; returns (hospital row, dashboard seq) per freed bed."""
+    expired = db.scalars(
+        select(models.BedReservation.trip_id)
+        .where(models.BedReservation.status == "HELD", models.BedReservation.expires_at < datetime.datetime.utcnow())
+    ).all()
+    changed = []
+    for trip_id in expired:
+        hospital = settle(db, trip_id, "EXPIRED")
+        if hospital is not None:
+            changed.append((hospital, dashboard.next_seq(db, hospital.id)))
+    db.commit()
+    return changed
+
+async def expire_periodically(session_factory, on_change: Callable[[object, int], Awaitable[None]], interval_s: float = BED_SWEEP_INTERVAL_S):
+    while True:
+        await asyncio.sleep(interval_s)
+        db = session_factory()
+        try:
+            for hospital, seq in await asyncio.to_thread(expire_holds, db):
+                await on_change(hospital, seq)
+        except Exception as e:
+            print(f"Bed hold sweep failed: {str(e)}")
+        finally:
+            db.close()
@@ -0,0 +1,110 @@
+"""
+Bed contention: hundreds of dispatches, each with its own ambulance, race
+for the last few ICU beds of one hospital. Checks that exactly as many trips
+get a bed as there were beds, that a unit already on a trip can't be
+dispatched again, that cancelling frees beds and arriving occupies them, and
+reports dispatch latency under contention.
+
+    cd backend && python -m bench.bed_contention --dispatches 300 --beds 20
+"""
+import argparse
+import asyncio
+import sys
+import time
+
+import httpx
+
+from bench.common import print_summary, save_results, summarize
+from bench.synthetic import synthetic_server
+
+HOSPITAL_ID = 1
+
+async def scenario(base_url: str, dispatches: int, beds: int):
+    # Idle connections are dropped before uvicorn's 5 s keep-alive closes them under a request
+    limits = httpx.Limits(max_connections=dispatches + 8, keepalive_expiry=4.0)
+    async with httpx.AsyncClient(base_url=base_url, timeout=120.0, limits=limits) as client:
+        async def login(email):
+            response = await client.post("/token", data={"username": email, "password": "prana123"})
+            return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+        driver, staff = await login("driver1@prana.demo"), await login("hospital1@prana.demo")
+
+        async def hospital():
+            return next(h for h in (await client.get("/hospitals")).json() if h["id"] == HOSPITAL_ID)
+
+        response = await client.patch(f"/hospitals/{HOSPITAL_ID}/capacity", headers=staff, json={"icu_beds": beds, "general_beds": 0})
+        response.raise_for_status()
+        incidents = await asyncio.gather(*(
+            client.post("/incidents", headers=driver, json={"emergency_type": "Cardiac", "incident_lat": 12.97, "incident_lng": 77.59})
+            for _ in range(dispatches)
+        ))
+
+        latencies, statuses = [], []
+
+        def dispatch_body(incident_id, ambulance_id):
+            return {
+                "incident_id": incident_id, "ambulance_id": ambulance_id, "selected_hospital_id": HOSPITAL_ID,
+                "eta_minutes": 10.0, "distance_km": 4.0,
+            }
+
+        async def dispatch(incident_id, ambulance_id):
+            start = time.perf_counter()
+            response = await client.post("/trips", headers=driver, json=dispatch_body(incident_id, ambulance_id))
+            latencies.append(time.perf_counter() - start)
+            statuses.append(response.status_code)
+            return response.json() if response.status_code == 200 else None
+
+        started = time.perf_counter()
+        # The demo unit is 1; the synthetic ones follow it
+        trips = [t for t in await asyncio.gather(*(dispatch(r.json()["id"], n + 1) for n, r in enumerate(incidents))) if t is not None]
+        elapsed = time.perf_counter() - started
+        after_dispatch = await hospital()
+
+        # A unit already on a trip is turned away without touching the bed counts
+        await client.patch(f"/hospitals/{HOSPITAL_ID}/capacity", headers=staff, json={"icu_delta": 1})
+        spare = (await client.post("/incidents", headers=driver, json={"emergency_type": "Cardiac", "incident_lat": 12.97, "incident_lng": 77.59})).json()
+        busy_status = (await client.post("/trips", headers=driver, json=dispatch_body(spare["id"], trips[0]["ambulance_id"]))).status_code
+        await client.patch(f"/hospitals/{HOSPITAL_ID}/capacity", headers=staff, json={"icu_delta": -1})
+        after_busy = await hospital()
+
+        # Cancel half the granted trips and land the rest
+        cancelled, arrived = trips[: len(trips) // 2], trips[len(trips) // 2:]
+        await asyncio.gather(*(client.post(f"/trips/{t['id']}/cancel", headers=driver) for t in cancelled))
+        await asyncio.gather(*(client.post(f"/trips/{t['id']}/arrive", headers=driver) for t in arrived))
+        after_settle = await hospital()
+
+    granted = statuses.count(200)
+    checks = {
+        "granted_equals_beds": granted == min(beds, dispatches),
+        "rejected_are_409": all(s in (200, 409) for s in statuses),
+        "all_held_after_dispatch": after_dispatch["icu_reserved"] == granted,
+        "busy_unit_rejected": busy_status == 409 and after_busy["icu_reserved"] == granted,
+        "holds_settled": after_settle["icu_reserved"] == 0,
+        "arrivals_occupy_beds": after_settle["icu_beds"] == beds - len(arrived),
+    }
+    return {
+        "dispatch": summarize(latencies, elapsed, errors=sum(s not in (200, 409) for s in statuses)),
+        "granted": granted,
+        "rejected": statuses.count(409),
+        "oversold": max(0, granted - beds),
+        "checks": checks,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dispatches", type=int, default=300)
+    parser.add_argument("--beds", type=int, default=20)
+    args = parser.parse_args()
+
+    with synthetic_server(hospitals=0, ambulances=args.dispatches, incidents=0) as base_url:
+        results = asyncio.run(scenario(base_url, args.dispatches, args.beds))
+    print_summary("dispatch", results["dispatch"])
+    print(f"{results['granted']} granted, {results['rejected']} rejected, {results['oversold']} oversold")
+    for name, ok in results["checks"].items():
+        print(f"  {'ok  ' if ok else 'FAIL'} {name}")
+    print(f"saved {save_results('bed_contention', results)}")
+    if not all(results["checks"].values()):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import httpx
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+
+def percentile(samples: List[float], p: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(p / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+def summarize(latencies_s: List[float], elapsed_s: float, errors: int = 0) -> Dict[str, float]:
+    return {
+        "count": len(latencies_s),
+        "errors": errors,
+        "throughput_per_s": len(latencies_s) / elapsed_s if elapsed_s > 0 else 0.0,
+        "p50_ms": percentile(latencies_s, 50) * 1000,
+        "p95_ms": percentile(latencies_s, 95) * 1000,
+        "p99_ms": percentile(latencies_s, 99) * 1000,
+    }
+
+def print_summary(name: str, summary: Dict[str, float]):
+    print(
+        f"{name:<28} n={summary['count']:<6} err={summary['errors']:<4} "
+        f"{summary['throughput_per_s']:>9.1f}/s  p50={summary['p50_ms']:.1f}ms  "
+        f"p95={summary['p95_ms']:.1f}ms  p99={summary['p99_ms']:.1f}ms"
+    )
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+@contextmanager
+def run_server(env: Optional[Dict[str, str]] = None, workdir: Optional[str] = None):
+    """
+    Starts the API with uvicorn in a scratch directory (so it seeds its own
+    prana.db) and yields its base URL. The server is stopped on exit.
+    """
+    port = free_port()
+    with tempfile.TemporaryDirectory() as scratch:
+        cwd = workdir or scratch
+        server_env = {**os.environ, "PYTHONPATH": str(BACKEND_DIR), **(env or {})}
+        process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+            cwd=cwd, env=server_env,
+        )
+        base_url = f"http://127.0.0.1:{port}"
+        try:
+            deadline = time.time() + 60
+            while True:
+                try:
+                    if httpx.get(f"{base_url}/hospitals", timeout=1.0).status_code == 200:
+                        break
+                except httpx.HTTPError:
+                    pass
+                if process.poll() is not None or time.time() > deadline:
+                    raise RuntimeError("API server did not start")
+                time.sleep(0.2)
+            yield base_url
+        finally:
+            process.terminate()
+            process.wait(timeout=30)
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, text=True).strip()
+    except Exception:
+        return "unknown"
+
+def save_results(name: str, results: Dict) -> Path:
+    """Writes results to bench/results/<name>-<revision>-<timestamp>.json."""
+    RESULTS_DIR.mkdir(exist_ok=True)
+    revision = git_revision()
+    stamp = datetime.utcnow().strftime("%Y%m%dT%H%M%S")
+    path = RESULTS_DIR / f"{name}-{revision}-{stamp}.json"
+    path.write_text(json.dumps({"benchmark": name, "revision": revision, "timestamp": stamp, "results": results}, indent=2))
+    return path
@@ -0,0 +1,66 @@
+"""
+Compares two saved benchmark results, metric by metric. Pass two result
+files, or a benchmark name to compare its two most recent runs.
+
+    cd backend && python -m bench.compare micro
+    cd backend && python -m bench.compare bench/results/micro-abc1234-….json bench/results/micro-def5678-….json
+"""
+import argparse
+import json
+import sys
+from pathlib import Path
+from typing import Dict, Iterator, Tuple
+
+from bench.common import RESULTS_DIR
+
+METRICS = ("throughput_per_s", "p50_ms", "p95_ms", "p99_ms")
+# Higher is better for throughput, lower for latencies
+HIGHER_IS_BETTER = {"throughput_per_s"}
+
+def latest_two(name: str) -> Tuple[Path, Path]:
+    runs = sorted(RESULTS_DIR.glob(f"{name}-*.json"), key=lambda p: json.loads(p.read_text())["timestamp"])
+    if len(runs) < 2:
+        sys.exit(f"need two saved {name} runs in {RESULTS_DIR}, found {len(runs)}")
+    return runs[-2], runs[-1]
+
+def summaries(results: Dict, prefix: str = "") -> Iterator[Tuple[str, Dict]]:
+    """Yields (scenario, summary) for every nested dict that carries latency metrics."""
+    for key, value in results.items():
+        if not isinstance(value, dict):
+            continue
+        name = f"{prefix}{key}"
+        if "p50_ms" in value:
+            yield name, value
+        else:
+            yield from summaries(value, f"{name}/")
+
+def compare(old: Dict, new: Dict):
+    print(f"{'scenario':<36} {'metric':<17} {old['revision']:>12} {new['revision']:>12}   change")
+    new_summaries = dict(summaries(new["results"]))
+    for scenario, before in summaries(old["results"]):
+        after = new_summaries.get(scenario)
+        if after is None:
+            continue
+        for metric in METRICS:
+            a, b = before.get(metric), after.get(metric)
+            if a is None or b is None:
+                continue
+            change = (b - a) / a * 100 if a else 0.0
+            better = change > 0 if metric in HIGHER_IS_BETTER else change < 0
+            verdict = "" if abs(change) < 5 else ("better" if better else "worse")
+            print(f"{scenario:<36} {metric:<17} {a:>12.4g} {b:>12.4g}   {change:+6.1f}% {verdict}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("runs", nargs="+", help="benchmark name, or two result files (old then new)")
+    args = parser.parse_args()
+    if len(args.runs) == 1:
+        old_path, new_path = latest_two(args.runs[0])
+    elif len(args.runs) == 2:
+        old_path, new_path = map(Path, args.runs)
+    else:
+        parser.error("pass a benchmark name or exactly two result files")
+    compare(json.loads(old_path.read_text()), json.loads(new_path.read_text()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Dashboard polling: many hospital staff sessions refresh their open cases
+(and the first case's event log) on an interval while drivers keep
+dispatching new trips to the same hospitals (each to the ambulance assigned
+for it, landing their oldest trip once they have a few open), against a
+synthetic city with tens of thousands of past trips.
+
+    cd backend && python -m bench.dashboard_poll --pollers 50 --interval-ms 500 --seconds 20
+"""
+import argparse
+import asyncio
+import random
+import time
+from collections import defaultdict, deque
+
+import httpx
+
+from bench.common import print_summary, save_results, summarize
+from bench.fake_osrm import run_fake_osrm
+from bench.synthetic import synthetic_server
+
+STAFF = [("hospital1@prana.demo", 1), ("hospital2@prana.demo", 2)]
+OPEN_CASES = "?status=DISPATCHED&status=ACKNOWLEDGED&limit=50"
+# Trips each dispatcher keeps on the road before landing the oldest, freeing its unit
+OPEN_TRIPS_PER_DISPATCHER = 10
+
+async def scenario(base_url: str, pollers: int, interval_s: float, seconds: float, dispatchers: int, seed: int):
+    limits = httpx.Limits(max_connections=pollers + dispatchers + 8)
+    async with httpx.AsyncClient(base_url=base_url, timeout=60.0, limits=limits) as client:
+        async def login(email):
+            response = await client.post("/token", data={"username": email, "password": "prana123"})
+            return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+        staff_headers = {hospital_id: await login(email) for email, hospital_id in STAFF}
+        driver_headers = await login("driver1@prana.demo")
+        # Every dispatch holds a bed; synthetic hospitals may have none to begin with
+        for hospital_id, headers in staff_headers.items():
+            await client.patch(f"/hospitals/{hospital_id}/capacity", headers=headers, json={"icu_beds": 100000, "general_beds": 100000})
+        latencies = defaultdict(list)
+        errors = defaultdict(int)
+        stop_at = time.perf_counter() + seconds
+
+        async def timed(name, method, url, headers, **kwargs):
+            start = time.perf_counter()
+            response = await client.request(method, url, headers=headers, **kwargs)
+            latencies[name].append(time.perf_counter() - start)
+            if response.status_code != 200:
+                errors[name] += 1
+                return None
+            return response.json()
+
+        async def poller(i):
+            hospital_id = STAFF[i % len(STAFF)][1]
+            headers = staff_headers[hospital_id]
+            # Spread the first polls over one interval like real browsers
+            await asyncio.sleep(interval_s * i / max(1, pollers))
+            while time.perf_counter() < stop_at:
+                cases = await timed("open_cases", "GET", f"/trips/hospital/{hospital_id}{OPEN_CASES}", headers)
+                if cases:
+                    await timed("case_events", "GET", f"/trips/{cases[0]['id']}/events", headers)
+                await asyncio.sleep(interval_s)
+
+        async def dispatcher(i):
+            rng = random.Random(seed + i)
+            on_road = deque()
+            while time.perf_counter() < stop_at:
+                incident = await timed("create_incident", "POST", "/incidents", driver_headers, json={
+                    "emergency_type": "Trauma", "incident_lat": 12.97 + rng.uniform(-0.1, 0.1), "incident_lng": 77.59 + rng.uniform(-0.1, 0.1),
+                })
+                if not incident:
+                    continue
+                assignment = await timed("assign", "POST", f"/incidents/{incident['id']}/assign", driver_headers)
+                if not assignment or assignment["assigned_ambulance_id"] is None:
+                    errors["assign"] += 1
+                    continue
+                trip = await timed("create_trip", "POST", "/trips", driver_headers, json={
+                    "incident_id": incident["id"], "ambulance_id": assignment["assigned_ambulance_id"], "selected_hospital_id": rng.choice([1, 2]),
+                    "eta_minutes": 12.0, "distance_km": 6.0,
+                })
+                if trip:
+                    on_road.append(trip["id"])
+                if len(on_road) > OPEN_TRIPS_PER_DISPATCHER:
+                    await timed("mark_arrived", "POST", f"/trips/{on_road.popleft()}/arrive", driver_headers)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(poller(i) for i in range(pollers)), *(dispatcher(i) for i in range(dispatchers)))
+        elapsed = time.perf_counter() - started
+
+    return {name: summarize(samples, elapsed, errors[name]) for name, samples in latencies.items()}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pollers", type=int, default=50)
+    parser.add_argument("--interval-ms", type=float, default=500.0)
+    parser.add_argument("--seconds", type=float, default=20.0)
+    parser.add_argument("--dispatchers", type=int, default=2)
+    parser.add_argument("--trips", type=int, default=20000)
+    parser.add_argument("--latency-ms", type=float, default=10.0)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    # Assigning an ambulance routes the nearest units to the incident
+    with run_fake_osrm(args.latency_ms) as osrm_url, \
+            synthetic_server({"OSRM_BASE_URL": osrm_url}, hospitals=2000, ambulances=500, incidents=5000, trips=args.trips, random_seed=args.seed) as base_url:
+        results = asyncio.run(scenario(base_url, args.pollers, args.interval_ms / 1000.0, args.seconds, args.dispatchers, args.seed))
+
+    for name, summary in results.items():
+        print_summary(name, summary)
+    print(f"saved {save_results('dashboard_poll', results)}")
+
+if __name__ == "__main__":
+    main()
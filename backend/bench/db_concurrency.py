@@ -0,0 +1,123 @@
+"""
+Database concurrency: writer processes apply ETA updates with a trip event each
+(one commit per update, like the WebSocket and green corridor paths) while
+reader processes page through a hospital's trips, all against one scratch
+SQLite file, the way several uvicorn workers share prana.db. Runs once per
+engine profile and reports read/write throughput, latency and "database is
+locked" errors.
+
+    cd backend && python -m bench.db_concurrency --writers 4 --readers 8 --seconds 10
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+
+from sqlalchemy import update
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+from bench.common import print_summary, save_results, summarize
+
+import database
+import models
+
+HOSPITALS = 6
+TRIPS = 5000
+
+def seed(url: str):
+    engine = database.build_engine(url, profile="default")
+    models.Base.metadata.create_all(bind=engine)
+    for table in models.Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+    with sessionmaker(bind=engine)() as db:
+        db.add_all(
+            models.Trip(
+                incident_id=i, ambulance_id=i % 50, selected_hospital_id=i % HOSPITALS + 1,
+                eta_minutes=20.0, distance_km=8.0, status="DISPATCHED" if i % 4 else "ARRIVED",
+            )
+            for i in range(1, TRIPS + 1)
+        )
+        db.commit()
+    engine.dispose()
+
+def write_once(db, rng):
+    trip_id = rng.randint(1, TRIPS)
+    db.execute(update(models.Trip).where(models.Trip.id == trip_id).values(eta_minutes=rng.uniform(1, 30)))
+    db.add(models.TripEvent(trip_id=trip_id, event_type="ETA_UPDATE", message="bench"))
+    db.commit()
+
+def read_once(db, rng):
+    trips = (
+        db.query(models.Trip)
+        .filter(models.Trip.selected_hospital_id == rng.randint(1, HOSPITALS), models.Trip.status == "DISPATCHED")
+        .order_by(models.Trip.id.desc()).limit(50).all()
+    )
+    if trips:
+        db.query(models.TripEvent).filter(models.TripEvent.trip_id == trips[0].id).order_by(models.TripEvent.id).limit(50).all()
+
+def worker(kind: str, url: str, profile: str, split: bool, start_at: float, stop_at: float, seed_value: int, out):
+    read_only = kind == "read" and split
+    engine = database.build_engine(url, profile=profile, read_only=read_only)
+    Session = sessionmaker(bind=engine, autoflush=False)
+    operation = write_once if kind == "write" else read_once
+    rng = random.Random(seed_value)
+    latencies, errors = [], 0
+    time.sleep(max(0.0, start_at - time.time()))
+    while time.time() < stop_at:
+        start = time.perf_counter()
+        try:
+            with Session() as db:
+                operation(db, rng)
+            latencies.append(time.perf_counter() - start)
+        except OperationalError:
+            errors += 1
+    engine.dispose()
+    out.put((kind, latencies, errors))
+
+def run_profile(url: str, profile: str, split: bool, writers: int, readers: int, seconds: float):
+    out = multiprocessing.Queue()
+    start_at = time.time() + 1.0
+    stop_at = start_at + seconds
+    kinds = ["write"] * writers + ["read"] * readers
+    processes = [
+        multiprocessing.Process(target=worker, args=(kind, url, profile, split, start_at, stop_at, i, out))
+        for i, kind in enumerate(kinds)
+    ]
+    for process in processes:
+        process.start()
+    collected = {"write": ([], 0), "read": ([], 0)}
+    for _ in processes:
+        kind, latencies, errors = out.get()
+        previous_latencies, previous_errors = collected[kind]
+        collected[kind] = (previous_latencies + latencies, previous_errors + errors)
+    for process in processes:
+        process.join()
+    return {kind: summarize(latencies, seconds, errors) for kind, (latencies, errors) in collected.items()}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--writers", type=int, default=4)
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--profiles", nargs="+", default=["default", "tuned", "tuned+split"])
+    args = parser.parse_args()
+
+    results = {}
+    for name in args.profiles:
+        profile, _, split = name.partition("+")
+        with tempfile.TemporaryDirectory() as scratch:
+            url = f"sqlite:///{os.path.join(scratch, 'prana.db')}"
+            seed(url)
+            results[name] = run_profile(url, profile, split == "split", args.writers, args.readers, args.seconds)
+        print(f"\nprofile={name}  writers={args.writers} readers={args.readers}")
+        for kind, summary in results[name].items():
+            print_summary(kind, summary)
+
+    print(f"saved {save_results('db_concurrency', results)}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""
+Dispatch flow: create incident -> create trip -> green corridor -> arrive,
+run in-process against a scratch database. Reports throughput and latency per
+step plus the commits and SQL statements each request costs.
+
+    cd backend && python -m bench.dispatch_flow --trips 200 --concurrency 20
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+import httpx
+
+from bench.common import BACKEND_DIR, print_summary, save_results, summarize
+
+@contextmanager
+def scratch_app():
+    """Imports the app inside a scratch directory so it seeds its own prana.db."""
+    previous = os.getcwd()
+    with tempfile.TemporaryDirectory() as scratch:
+        os.chdir(scratch)
+        sys.path.insert(0, str(BACKEND_DIR))
+        try:
+            import main
+            yield main
+        finally:
+            os.chdir(previous)
+
+class StatementCounter:
+    def __init__(self, engines):
+        self.commits = 0
+        self.statements = 0
+        from sqlalchemy import event
+        for sync_engine in engines:
+            event.listen(sync_engine, "commit", self._on_commit)
+            event.listen(sync_engine, "before_cursor_execute", self._on_execute)
+
+    def _on_commit(self, conn):
+        self.commits += 1
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements += 1
+
+    def snapshot(self):
+        return self.commits, self.statements
+
+def add_ambulances(count: int):
+    """Ids of `count` ambulances for the demo driver: the seeded one plus as many new ones as needed."""
+    import database, models
+    with database.SessionLocal() as db:
+        ids = [ambulance_id for (ambulance_id,) in db.query(models.Ambulance.id).order_by(models.Ambulance.id)]
+        driver_id = db.get(models.Ambulance, ids[0]).driver_user_id
+        for _ in range(count - len(ids)):
+            ambulance = models.Ambulance(driver_user_id=driver_id, current_lat=12.95, current_lng=77.58)
+            db.add(ambulance)
+            db.flush()
+            ids.append(ambulance.id)
+        db.commit()
+    return ids[:count]
+
+async def run(main, trips: int, concurrency: int):
+    import database
+    counter = StatementCounter([database.engine, database.async_engine.sync_engine])
+    transport = httpx.ASGITransport(app=main.app)
+    async with main.app.router.lifespan_context(main.app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60.0) as client:
+            token = (await client.post("/token", data={"username": "driver1@prana.demo", "password": "prana123"})).json()["access_token"]
+            headers = {"Authorization": f"Bearer {token}"}
+            hospital_id = (await client.get("/hospitals")).json()[0]["id"]
+            # Every dispatch holds a bed and every arrival occupies one, so make room for all of them
+            staff_token = (await client.post("/token", data={"username": "hospital1@prana.demo", "password": "prana123"})).json()["access_token"]
+            await client.patch(
+                f"/hospitals/{hospital_id}/capacity", headers={"Authorization": f"Bearer {staff_token}"},
+                json={"icu_beds": trips, "general_beds": trips},
+            )
+
+            # A unit is on one trip at a time, so concurrent flows each take one from a pool
+            units = asyncio.Queue()
+            for ambulance_id in add_ambulances(concurrency):
+                units.put_nowait(ambulance_id)
+
+            latencies = defaultdict(list)
+            costs = defaultdict(lambda: [0, 0])
+            errors = 0
+            semaphore = asyncio.Semaphore(concurrency)
+
+            async def step(name, method, url, **kwargs):
+                nonlocal errors
+                before = counter.snapshot()
+                start = time.perf_counter()
+                response = await client.request(method, url, headers=headers, **kwargs)
+                latencies[name].append(time.perf_counter() - start)
+                after = counter.snapshot()
+                # Counts are exact at concurrency 1; with overlap they are shared estimates
+                costs[name][0] += after[0] - before[0]
+                costs[name][1] += after[1] - before[1]
+                if response.status_code != 200:
+                    errors += 1
+                return response.json()
+
+            async def flow(i):
+                async with semaphore:
+                    incident = await step("create_incident", "POST", "/incidents", json={
+                        "emergency_type": "Cardiac", "incident_lat": 12.95 + i * 1e-4, "incident_lng": 77.6,
+                    })
+                    ambulance_id = await units.get()
+                    try:
+                        trip = await step("create_trip", "POST", "/trips", json={
+                            "incident_id": incident["id"], "ambulance_id": ambulance_id, "selected_hospital_id": hospital_id,
+                            "eta_minutes": 10.0, "distance_km": 4.0,
+                        })
+                        await step("green_corridor", "POST", f"/trips/{trip['id']}/priority")
+                        await step("mark_arrived", "POST", f"/trips/{trip['id']}/arrive")
+                    finally:
+                        units.put_nowait(ambulance_id)
+
+            started = time.perf_counter()
+            await asyncio.gather(*(flow(i) for i in range(trips)))
+            elapsed = time.perf_counter() - started
+
+    results = {"flows_per_s": trips / elapsed, "errors": errors}
+    for name, samples in latencies.items():
+        results[name] = {
+            **summarize(samples, elapsed),
+            "commits_per_request": costs[name][0] / len(samples),
+            "statements_per_request": costs[name][1] / len(samples),
+        }
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--trips", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=1)
+    args = parser.parse_args()
+
+    with scratch_app() as app_module:
+        results = asyncio.run(run(app_module, args.trips, args.concurrency))
+    print(f"{results['flows_per_s']:.1f} dispatch flows/s, {results['errors']} errors")
+    for name in ("create_incident", "create_trip", "green_corridor", "mark_arrived"):
+        summary = results[name]
+        print_summary(name, summary)
+        print(f"{'':<28} commits/request={summary['commits_per_request']:.2f}  statements/request={summary['statements_per_request']:.2f}")
+    print(f"saved {save_results('dispatch_flow', results)}")
+
+if __name__ == "__main__":
+    main()
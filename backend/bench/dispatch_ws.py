@@ -0,0 +1,112 @@
+"""
+End-to-end dispatch under load: each flow creates an incident, matches
+hospitals, assigns the nearest ambulance, dispatches the trip, then streams
+position fixes over the trip WebSocket while the hospital's dashboard socket
+waits for each recomputed ETA, and finally marks arrival. Runs a real uvicorn
+server on a synthetic city with the fake OSRM router.
+
+    cd backend && python -m bench.dispatch_ws --flows 100 --concurrency 20 --fixes 10 --latency-ms 10
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from collections import defaultdict
+
+import httpx
+import websockets
+
+from bench.common import print_summary, save_results, summarize
+from bench.fake_osrm import run_fake_osrm
+from bench.synthetic import staff_token, synthetic_server
+
+STEPS = ("create_incident", "match", "assign", "create_trip", "eta_propagation", "mark_arrived")
+
+async def scenario(base_url: str, flows: int, concurrency: int, fixes: int, seed: int):
+    ws_url = base_url.replace("http://", "ws://", 1)
+    rng = random.Random(seed)
+    limits = httpx.Limits(max_connections=concurrency + 8)
+    async with httpx.AsyncClient(base_url=base_url, timeout=60.0, limits=limits) as client:
+        token = (await client.post("/token", data={"username": "driver1@prana.demo", "password": "prana123"})).json()["access_token"]
+        headers = {"Authorization": f"Bearer {token}"}
+        latencies = defaultdict(list)
+        errors = defaultdict(int)
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def step(name, method, url, **kwargs):
+            start = time.perf_counter()
+            response = await client.request(method, url, headers=headers, **kwargs)
+            latencies[name].append(time.perf_counter() - start)
+            if response.status_code != 200:
+                errors[name] += 1
+                return None
+            return response.json()
+
+        async def flow(lat, lng):
+            async with semaphore:
+                incident = await step("create_incident", "POST", "/incidents", json={"emergency_type": "Cardiac", "incident_lat": lat, "incident_lng": lng})
+                matches = await step("match", "GET", f"/incidents/{incident['id']}/match")
+                assignment = await step("assign", "POST", f"/incidents/{incident['id']}/assign")
+                if not matches or not assignment or assignment["assigned_ambulance_id"] is None:
+                    errors["no_candidate"] += 1
+                    return
+                best = matches[0]
+                hospital = best["hospital"]
+                trip = await step("create_trip", "POST", "/trips", json={
+                    "incident_id": incident["id"], "ambulance_id": assignment["assigned_ambulance_id"],
+                    "selected_hospital_id": hospital["id"], "eta_minutes": best["eta_min"], "distance_km": best["dist_km"],
+                })
+                if trip is None:
+                    return
+                async with websockets.connect(f"{ws_url}/ws/hospital/{hospital['id']}?token={staff_token(hospital['id'])}") as dashboard, \
+                        websockets.connect(f"{ws_url}/ws/trip/{trip['id']}") as driver:
+                    for n in range(1, fixes + 1):
+                        # Drive in a straight line from the incident towards the hospital
+                        f = n / (fixes + 1)
+                        fix = {"type": "position_update", "lat": lat + (hospital["lat"] - lat) * f, "lng": lng + (hospital["lng"] - lng) * f}
+                        start = time.perf_counter()
+                        await driver.send(json.dumps(fix))
+                        try:
+                            while True:
+                                message = json.loads(await asyncio.wait_for(dashboard.recv(), 10))
+                                if message.get("type") == "eta_update" and message.get("trip_id") == trip["id"]:
+                                    break
+                            latencies["eta_propagation"].append(time.perf_counter() - start)
+                        except asyncio.TimeoutError:
+                            errors["eta_propagation"] += 1
+                await step("mark_arrived", "POST", f"/trips/{trip['id']}/arrive")
+
+        points = [(12.97 + rng.uniform(-0.2, 0.2), 77.59 + rng.uniform(-0.2, 0.2)) for _ in range(flows)]
+        started = time.perf_counter()
+        await asyncio.gather(*(flow(lat, lng) for lat, lng in points))
+        elapsed = time.perf_counter() - started
+
+    results = {"flows_per_s": flows / elapsed, "errors": dict(errors)}
+    for name in STEPS:
+        results[name] = summarize(latencies[name], elapsed, errors[name])
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--flows", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--fixes", type=int, default=10)
+    parser.add_argument("--hospitals", type=int, default=2000)
+    parser.add_argument("--ambulances", type=int, default=500)
+    parser.add_argument("--latency-ms", type=float, default=10.0)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    with run_fake_osrm(args.latency_ms) as osrm_url:
+        env = {"OSRM_BASE_URL": osrm_url, "REROUTE_MIN_INTERVAL_S": "0"}
+        with synthetic_server(env, hospitals=args.hospitals, ambulances=args.ambulances, incidents=0, random_seed=args.seed) as base_url:
+            results = asyncio.run(scenario(base_url, args.flows, args.concurrency, args.fixes, args.seed))
+
+    print(f"{results['flows_per_s']:.1f} dispatch flows/s, errors {results['errors']}")
+    for name in STEPS:
+        print_summary(name, results[name])
+    print(f"saved {save_results('dispatch_ws', results)}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Local stand-in for OSRM's /route and /table services so benchmarks run
+offline. Distances are straight-line distance times a detour factor, durations
+assume 30 km/h, and every response waits --latency-ms (plus up to
+--jitter-ms) to mimic a real router's service time.
+
+    cd backend && python -m bench.fake_osrm --port 5055 --latency-ms 20
+"""
+import argparse
+import json
+import math
+import random
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import httpx
+
+from bench.common import BACKEND_DIR, free_port
+
+DETOUR = 1.3
+SPEED_KM_PER_MIN = 0.5
+
+def _haversine_km(a, b):
+    # Same formula as engine.haversine, kept local so the server imports nothing from the app
+    lat1, lng1, lat2, lng2 = map(math.radians, (a[1], a[0], b[1], b[0]))
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * 6371.0 * math.asin(math.sqrt(h))
+
+def make_handler(latency_s: float, jitter_s: float):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # Headers and body go out in separate writes; without this Nagle adds ~40 ms
+        disable_nagle_algorithm = True
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            time.sleep(latency_s + random.uniform(0, jitter_s))
+            url = urlsplit(self.path)
+            parts = url.path.split("/")
+            if len(parts) < 5 or parts[1] not in ("route", "table"):
+                self._send(404, {"code": "InvalidUrl"})
+                return
+            coords = [tuple(map(float, c.split(","))) for c in parts[4].split(";")]
+            if parts[1] == "route":
+                km = _haversine_km(coords[0], coords[-1]) * DETOUR
+                self._send(200, {"code": "Ok", "routes": [{"distance": km * 1000.0, "duration": km / SPEED_KM_PER_MIN * 60.0}]})
+                return
+            query = parse_qs(url.query)
+            sources = [int(i) for i in query["sources"][0].split(";")] if "sources" in query else list(range(len(coords)))
+            targets = [int(i) for i in query["destinations"][0].split(";")] if "destinations" in query else list(range(len(coords)))
+            km = [[_haversine_km(coords[s], coords[t]) * DETOUR for t in targets] for s in sources]
+            self._send(200, {
+                "code": "Ok",
+                "distances": [[d * 1000.0 for d in row] for row in km],
+                "durations": [[d / SPEED_KM_PER_MIN * 60.0 for d in row] for row in km],
+            })
+
+        def _send(self, status: int, body: dict):
+            payload = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+    return Handler
+
+@contextmanager
+def run_fake_osrm(latency_ms: float = 0.0, jitter_ms: float = 0.0):
+    """Starts the fake router in a subprocess and yields its base URL (for OSRM_BASE_URL)."""
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "bench.fake_osrm", "--port", str(port), "--latency-ms", str(latency_ms), "--jitter-ms", str(jitter_ms)],
+        cwd=BACKEND_DIR,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        deadline = time.time() + 15
+        while True:
+            try:
+                httpx.get(f"{base_url}/route/v1/driving/77.59,12.97;77.60,12.98", timeout=1.0)
+                break
+            except httpx.HTTPError:
+                if process.poll() is not None or time.time() > deadline:
+                    raise RuntimeError("fake OSRM did not start")
+                time.sleep(0.1)
+        yield base_url
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=5055)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    args = parser.parse_args()
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), make_handler(args.latency_ms / 1000.0, args.jitter_ms / 1000.0))
+    server.daemon_threads = True
+    server.serve_forever()
+
+if __name__ == "__main__":
+    main()
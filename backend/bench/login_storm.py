@@ -0,0 +1,80 @@
+"""
+Login storm: many concurrent POST /token calls while a probe keeps hitting a
+cheap endpoint. Reports logins/sec and the probe's latency during the storm.
+
+    cd backend && python -m bench.login_storm --logins 200 --concurrency 100
+"""
+import argparse
+import asyncio
+import time
+
+import httpx
+
+from bench.common import print_summary, run_server, save_results, summarize
+
+DEMO_USERS = ["driver1@prana.demo", "hospital1@prana.demo", "hospital2@prana.demo"]
+
+async def storm(base_url: str, logins: int, concurrency: int, probe_path: str):
+    limits = httpx.Limits(max_connections=concurrency + 8)
+    async with httpx.AsyncClient(base_url=base_url, timeout=120.0, limits=limits) as client:
+        # Baseline probe latency with no storm running
+        baseline = []
+        for _ in range(50):
+            start = time.perf_counter()
+            await client.get(probe_path)
+            baseline.append(time.perf_counter() - start)
+
+        semaphore = asyncio.Semaphore(concurrency)
+        login_latencies, probe_latencies = [], []
+        errors = 0
+        done = asyncio.Event()
+
+        async def login(i):
+            nonlocal errors
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.post("/token", data={"username": DEMO_USERS[i % len(DEMO_USERS)], "password": "prana123"})
+                if response.status_code == 200:
+                    login_latencies.append(time.perf_counter() - start)
+                else:
+                    errors += 1
+
+        async def probe():
+            while not done.is_set():
+                start = time.perf_counter()
+                await client.get(probe_path)
+                probe_latencies.append(time.perf_counter() - start)
+                await asyncio.sleep(0.01)
+
+        prober = asyncio.create_task(probe())
+        started = time.perf_counter()
+        await asyncio.gather(*(login(i) for i in range(logins)))
+        elapsed = time.perf_counter() - started
+        done.set()
+        await prober
+
+    return {
+        "probe_idle": summarize(baseline, sum(baseline)),
+        "logins": summarize(login_latencies, elapsed, errors),
+        "probe_during_storm": summarize(probe_latencies, elapsed),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--probe-path", default="/hospitals")
+    parser.add_argument("--url", help="benchmark an already running server instead of starting one")
+    args = parser.parse_args()
+
+    if args.url:
+        results = asyncio.run(storm(args.url, args.logins, args.concurrency, args.probe_path))
+    else:
+        with run_server() as base_url:
+            results = asyncio.run(storm(base_url, args.logins, args.concurrency, args.probe_path))
+    for name, summary in results.items():
+        print_summary(name, summary)
+    print(f"saved {save_results('login_storm', results)}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""
+Microbenchmarks of the matching hot path on synthetic hospitals:
+engine.haversine (scalar and NumPy), rank_hospitals against the reference
+loop (results must agree) and engine.match_hospitals end to end against the
+fake OSRM server, with a cold and a warm route cache.
+
+    cd backend && python -m bench.micro --hospitals 2000 --candidates 25 --latency-ms 5
+"""
+import argparse
+import asyncio
+import os
+import random
+import time
+
+import numpy as np
+
+from bench.common import print_summary, save_results, summarize
+from bench.fake_osrm import run_fake_osrm
+from bench.synthetic import EMERGENCY_TYPES, hospital_rows
+
+def time_batches(fn, batches: int, batch_size: int):
+    """Per-call latency of fn, timed in batches so fast calls stay measurable."""
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(batches):
+        start = time.perf_counter()
+        for _ in range(batch_size):
+            fn()
+        latencies.append((time.perf_counter() - start) / batch_size)
+    return summarize(latencies, (time.perf_counter() - started) / batch_size)
+
+def bench_haversine(engine, rng: random.Random, batches: int):
+    points = [(12.97 + rng.uniform(-0.2, 0.2), 77.59 + rng.uniform(-0.2, 0.2)) for _ in range(1000)]
+    i = 0
+
+    def scalar():
+        nonlocal i
+        a, b = points[i % 1000], points[(i * 7 + 3) % 1000]
+        i += 1
+        engine.haversine(a[0], a[1], b[0], b[1])
+
+    lat = np.array([p[0] for p in points])
+    lng = np.array([p[1] for p in points])
+
+    def vector():
+        engine.haversine_np(12.97, 77.59, lat, lng)
+
+    return {
+        "haversine_scalar": time_batches(scalar, batches, 1000),
+        # One call covers 1000 hospitals
+        "haversine_np_1000": time_batches(vector, batches, 10),
+    }
+
+def bench_rank(engine, hospitals, rng: random.Random, candidates: int, batches: int):
+    cases = []
+    for _ in range(200):
+        picked = rng.sample(hospitals, candidates)
+        routes = [(rng.uniform(0.5, 30), rng.uniform(1, 60), "osrm") for _ in picked]
+        cases.append((rng.choice(EMERGENCY_TYPES), rng.choice([None, 1, 2, 3]), picked, engine.HospitalColumns(picked), routes))
+
+    # The vectorized scorer must rank exactly like the reference loop
+    for emergency_type, pref, picked, cols, routes in cases:
+        fast = [(m["hospital"].id, m["score"]) for m in engine.rank_hospitals(emergency_type, pref, cols, routes)]
+        slow = [(m["hospital"].id, m["score"]) for m in engine.rank_hospitals_loop(emergency_type, pref, picked, routes)]
+        assert fast == slow, f"rank_hospitals disagrees with rank_hospitals_loop: {fast} != {slow}"
+
+    cycle = iter(range(10 ** 12))
+
+    def vectorized():
+        emergency_type, pref, _, cols, routes = cases[next(cycle) % len(cases)]
+        engine.rank_hospitals(emergency_type, pref, cols, routes)
+
+    def loop():
+        emergency_type, pref, picked, _, routes = cases[next(cycle) % len(cases)]
+        engine.rank_hospitals_loop(emergency_type, pref, picked, routes)
+
+    return {
+        f"rank_hospitals_{candidates}": time_batches(vectorized, batches, 20),
+        f"rank_hospitals_loop_{candidates}": time_batches(loop, batches, 20),
+    }
+
+async def bench_match(engine, snapshot_state, rng: random.Random, iterations: int):
+    incidents = [(12.97 + rng.uniform(-0.2, 0.2), 77.59 + rng.uniform(-0.2, 0.2), rng.choice(EMERGENCY_TYPES)) for _ in range(iterations)]
+    results = {}
+    await engine.start_router()
+    try:
+        for label, warm in (("match_hospitals_cold", False), ("match_hospitals_warm", True)):
+            if not warm:
+                engine.route_cache.clear()
+            latencies = []
+            started = time.perf_counter()
+            for lat, lng, emergency_type in incidents:
+                cols = snapshot_state.candidates(lat, lng)
+                start = time.perf_counter()
+                await engine.match_hospitals(lat, lng, emergency_type, None, cols)
+                latencies.append(time.perf_counter() - start)
+            results[label] = summarize(latencies, time.perf_counter() - started)
+    finally:
+        await engine.close_router()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--hospitals", type=int, default=2000)
+    parser.add_argument("--candidates", type=int, default=25)
+    parser.add_argument("--batches", type=int, default=200)
+    parser.add_argument("--matches", type=int, default=300)
+    parser.add_argument("--latency-ms", type=float, default=5.0)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    with run_fake_osrm(args.latency_ms) as osrm_url:
+        # engine reads its settings at import time
+        os.environ["OSRM_BASE_URL"] = osrm_url
+        os.environ["MATCH_CANDIDATES"] = str(args.candidates)
+        import engine, models, snapshot
+
+        rng = random.Random(args.seed)
+        rows = hospital_rows(args.hospitals, rng)
+        for row in rows:
+            # Some beds held for dispatched trips, sometimes all of them
+            row["icu_reserved"] = rng.randint(0, row["icu_beds"])
+            row["general_reserved"] = rng.randint(0, row["general_beds"])
+        hospitals = [models.Hospital(id=i + 1, **row) for i, row in enumerate(rows)]
+        state = snapshot.HospitalSnapshot()
+        state.replace([snapshot.HospitalRecord.from_orm(h) for h in hospitals])
+
+        results = {}
+        results.update(bench_haversine(engine, rng, args.batches))
+        results.update(bench_rank(engine, hospitals, rng, args.candidates, args.batches))
+        results.update(asyncio.run(bench_match(engine, state, rng, args.matches)))
+
+    for name, summary in results.items():
+        print_summary(name, summary)
+    print(f"saved {save_results('micro', results)}")
+
+if __name__ == "__main__":
+    main()
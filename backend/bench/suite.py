@@ -0,0 +1,41 @@
+"""
+Runs every benchmark with fixed seeds and sizes, one after another, saving
+each result under bench/results/ for bench.compare. --quick shrinks every
+scenario to a smoke-test size.
+
+    cd backend && python -m bench.suite
+    cd backend && python -m bench.suite --only micro dispatch_ws
+"""
+import argparse
+import subprocess
+import sys
+
+from bench.common import BACKEND_DIR
+
+SCENARIOS = {
+    "micro": (["--batches", "200", "--matches", "300"], ["--batches", "20", "--matches", "30"]),
+    "login_storm": (["--logins", "200", "--concurrency", "100"], ["--logins", "30", "--concurrency", "10"]),
+    "dispatch_flow": (["--trips", "200", "--concurrency", "20"], ["--trips", "20", "--concurrency", "5"]),
+    "dispatch_ws": (["--flows", "100", "--concurrency", "20", "--fixes", "10"], ["--flows", "10", "--concurrency", "5", "--fixes", "3"]),
+    "dashboard_poll": (["--pollers", "50", "--seconds", "20"], ["--pollers", "10", "--seconds", "3"]),
+    "db_concurrency": (["--seconds", "10"], ["--seconds", "2"]),
+    "bed_contention": (["--dispatches", "300", "--beds", "20"], ["--dispatches", "50", "--beds", "5"]),
+}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--quick", action="store_true")
+    parser.add_argument("--only", nargs="+", choices=sorted(SCENARIOS))
+    args = parser.parse_args()
+
+    failed = []
+    for name in args.only or SCENARIOS:
+        full, quick = SCENARIOS[name]
+        print(f"\n== {name}", flush=True)
+        if subprocess.call([sys.executable, "-m", f"bench.{name}", *(quick if args.quick else full)], cwd=BACKEND_DIR) != 0:
+            failed.append(name)
+    if failed:
+        sys.exit(f"failed: {', '.join(failed)}")
+
+if __name__ == "__main__":
+    main()
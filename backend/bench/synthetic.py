@@ -0,0 +1,150 @@
+"""
+Synthetic city: the demo seed plus thousands of hospitals, ambulances,
+incidents and (optionally) past trips scattered around Bengaluru, generated
+from a fixed random seed so every run (and every commit) benchmarks the same
+data.
+
+    cd backend && python -m bench.synthetic --db /tmp/prana.db --hospitals 2000 --ambulances 500 --incidents 5000 --trips 20000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+from contextlib import contextmanager
+from datetime import timedelta
+from typing import Dict, Optional
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+
+from bench.common import BACKEND_DIR, run_server
+
+if str(BACKEND_DIR) not in sys.path:
+    sys.path.insert(0, str(BACKEND_DIR))
+
+import auth, models, seed
+
+CENTER = (12.9716, 77.5946)
+SPREAD_DEG = 0.25
+EMERGENCY_TYPES = ["Cardiac", "Trauma", "Stroke", "Respiratory", "General"]
+
+def _point(rng: random.Random):
+    return CENTER[0] + rng.uniform(-SPREAD_DEG, SPREAD_DEG), CENTER[1] + rng.uniform(-SPREAD_DEG, SPREAD_DEG)
+
+def hospital_rows(count: int, rng: random.Random):
+    rows = []
+    for i in range(count):
+        lat, lng = _point(rng)
+        rows.append({
+            "name": f"Synthetic Hospital {i + 1}", "lat": lat, "lng": lng,
+            "icu_beds": rng.choice([0, 0, 2, 5, 10, 20, 40]), "general_beds": rng.randint(0, 200),
+            "icu_reserved": 0, "general_reserved": 0,
+            "affordability_tier": rng.randint(1, 3), "rating": round(rng.uniform(3.0, 5.0), 1),
+            "has_cardiology": rng.random() < 0.5, "has_trauma": rng.random() < 0.6,
+            "has_neurology": rng.random() < 0.35, "has_pulmonology": rng.random() < 0.45,
+        })
+    return rows
+
+def staff_email(hospital_id: int) -> str:
+    # Matches the demo seed's hospital1@/hospital2@ accounts
+    return f"hospital{hospital_id}@prana.demo"
+
+def staff_rows(hospital_ids, password_hash: str):
+    return [{"email": staff_email(hospital_id), "password_hash": password_hash, "role": "HOSPITAL_STAFF", "hospital_id": hospital_id} for hospital_id in hospital_ids]
+
+def staff_token(hospital_id: int) -> str:
+    """An access token for the synthetic staff account of `hospital_id` (minted locally, skipping bcrypt on /token)."""
+    return auth.create_access_token({"sub": staff_email(hospital_id)}, timedelta(hours=12))
+
+def ambulance_rows(count: int, driver_user_id: int, rng: random.Random):
+    rows = []
+    for _ in range(count):
+        lat, lng = _point(rng)
+        rows.append({"driver_user_id": driver_user_id, "current_lat": lat, "current_lng": lng})
+    return rows
+
+def incident_rows(count: int, rng: random.Random):
+    rows = []
+    for _ in range(count):
+        lat, lng = _point(rng)
+        rows.append({
+            "emergency_type": rng.choice(EMERGENCY_TYPES), "incident_lat": lat, "incident_lng": lng,
+            "affordability_pref": rng.choice([None, 1, 2, 3]), "status": "NEW",
+        })
+    return rows
+
+def trip_rows(count: int, hospital_ids, ambulance_ids, incident_ids, rng: random.Random):
+    rows = []
+    on_trip = set()
+    for _ in range(count):
+        # A fifth of the trips go to the demo staff's hospitals so their dashboards have data
+        hospital_id = rng.choice(hospital_ids[:2]) if rng.random() < 0.2 else rng.choice(hospital_ids)
+        row = {
+            "incident_id": rng.choice(incident_ids), "ambulance_id": rng.choice(ambulance_ids),
+            "selected_hospital_id": hospital_id, "eta_minutes": round(rng.uniform(2, 40), 1),
+            "distance_km": round(rng.uniform(1, 25), 1), "signal_priority_active": rng.random() < 0.1,
+            "status": rng.choice(["DISPATCHED", "ACKNOWLEDGED", "ARRIVED", "ARRIVED", "ARRIVED"]),
+        }
+        # A unit is on one trip at a time, and half the fleet is free to dispatch
+        if row["status"] != "ARRIVED":
+            if row["ambulance_id"] in on_trip or row["ambulance_id"] % 2 == 0:
+                row["status"] = "ARRIVED"
+            else:
+                on_trip.add(row["ambulance_id"])
+        rows.append(row)
+    return rows
+
+def seed_synthetic(db, hospitals: int = 2000, ambulances: int = 500, incidents: int = 5000, trips: int = 0, random_seed: int = 42):
+    """Runs the demo seed, then bulk-inserts the synthetic rows (skipped if already present)."""
+    seed.seed_database(db)
+    if db.query(models.Hospital).count() > 6:
+        return
+    rng = random.Random(random_seed)
+    driver = db.query(models.User).filter(models.User.email == "driver1@prana.demo").first()
+    if hospitals:
+        db.execute(insert(models.Hospital), hospital_rows(hospitals, rng))
+    # One staff account per hospital, so benches can open any hospital's dashboard socket
+    staffed = {i for (i,) in db.query(models.User.hospital_id).filter(models.User.hospital_id.isnot(None))}
+    unstaffed = [i for (i,) in db.query(models.Hospital.id).order_by(models.Hospital.id) if i not in staffed]
+    if unstaffed:
+        db.execute(insert(models.User), staff_rows(unstaffed, auth.get_password_hash("prana123")))
+    if ambulances:
+        db.execute(insert(models.Ambulance), ambulance_rows(ambulances, driver.id, rng))
+    if incidents:
+        db.execute(insert(models.Incident), incident_rows(incidents, rng))
+    if trips:
+        ids = lambda model: [i for (i,) in db.query(model.id).order_by(model.id)]
+        db.execute(insert(models.Trip), trip_rows(trips, ids(models.Hospital), ids(models.Ambulance), ids(models.Incident), rng))
+    db.commit()
+
+def build_database(path: str, hospitals: int = 2000, ambulances: int = 500, incidents: int = 5000, trips: int = 0, random_seed: int = 42):
+    """Creates a ready-to-serve prana.db at `path`."""
+    engine = create_engine(f"sqlite:///{path}")
+    models.Base.metadata.create_all(bind=engine)
+    with sessionmaker(bind=engine)() as db:
+        seed_synthetic(db, hospitals, ambulances, incidents, trips, random_seed)
+    engine.dispose()
+
+@contextmanager
+def synthetic_server(env: Optional[Dict[str, str]] = None, **sizes):
+    """run_server over a freshly generated synthetic prana.db; yields the base URL."""
+    with tempfile.TemporaryDirectory() as scratch:
+        build_database(os.path.join(scratch, "prana.db"), **sizes)
+        with run_server(env=env, workdir=scratch) as base_url:
+            yield base_url
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default=os.path.join(os.getcwd(), "prana.db"))
+    parser.add_argument("--hospitals", type=int, default=2000)
+    parser.add_argument("--ambulances", type=int, default=500)
+    parser.add_argument("--incidents", type=int, default=5000)
+    parser.add_argument("--trips", type=int, default=0)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    build_database(args.db, args.hospitals, args.ambulances, args.incidents, args.trips, args.seed)
+    print(f"wrote {args.db}")
+
+if __name__ == "__main__":
+    main()
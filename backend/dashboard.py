@@ -0,0 +1,152 @@
+import asyncio
+import json
+import os
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+import models, schemas
+
+# Hospital dashboards get one snapshot of their open cases on connect and then
+# versioned deltas. Every hospital has its own gapless sequence, bumped in the
+# transaction that makes the change, so a client can spot a missed delta and
+# resume with ?since=<last seq> from the last DASHBOARD_BACKLOG deltas held by
+# each worker. Deltas that arrive ahead of a gap wait up to
+# DASHBOARD_REORDER_WAIT_S for the missing one before going out anyway.
+DASHBOARD_BACKLOG = int(os.getenv("DASHBOARD_BACKLOG", "256"))
+DASHBOARD_REORDER_WAIT_S = float(os.getenv("DASHBOARD_REORDER_WAIT_S", "1.0"))
+OPEN_STATUSES = ("DISPATCHED", "ACKNOWLEDGED")
+
+def group_for(hospital_id: int) -> str:
+    return f"hospital_{hospital_id}"
+
+def _bump_statement(dialect_name: str, hospital_id: int):
+    insert = postgresql_insert if dialect_name == "postgresql" else sqlite_insert
+    return (
+        insert(models.HospitalFeed)
+        .values(hospital_id=hospital_id, seq=1)
+        .on_conflict_do_update(index_elements=[models.HospitalFeed.hospital_id], set_={"seq": models.HospitalFeed.seq + 1})
+        .returning(models.HospitalFeed.seq)
+    )
+
+def next_seq(db: Session, hospital_id: int) -> int:
+    """Claims the hospital's next sequence number inside the caller's transaction."""
+    return db.execute(_bump_statement(db.get_bind().dialect.name, hospital_id)).scalar_one()
+
+async def next_seq_async(db: AsyncSession, hospital_id: int) -> int:
+    return (await db.execute(_bump_statement(db.get_bind().dialect.name, hospital_id))).scalar_one()
+
+async def current_seq(db: AsyncSession, hospital_id: int) -> int:
+    seq = await db.scalar(select(models.HospitalFeed.seq).where(models.HospitalFeed.hospital_id == hospital_id))
+    return seq or 0
+
+def trip_payload(trip) -> dict:
+    """TripResponse fields of an ORM trip or a RETURNING row."""
+    if hasattr(trip, "_mapping"):
+        trip = dict(trip._mapping)
+    return schemas.TripResponse.model_validate(trip).model_dump(mode="json")
+
+def hospital_payload(hospital) -> dict:
+    return schemas.HospitalResponse.model_validate(hospital).model_dump(mode="json")
+
+def delta_message(hospital_id: int, seq: int, trip: Optional[dict] = None, hospital: Optional[dict] = None) -> str:
+    # Deltas carry the whole new state of what changed, so applying one twice is harmless
+    delta = {"type": "delta", "hospital_id": hospital_id, "seq": seq}
+    if trip is not None:
+        delta.update(kind="trip", trip=trip)
+    else:
+        delta.update(kind="hospital", hospital=hospital)
+    return json.dumps(delta)
+
+def snapshot_message(hospital_id: int, seq: int, hospital, trips) -> str:
+    return json.dumps({
+        "type": "snapshot",
+        "hospital_id": hospital_id,
+        "seq": seq,
+        "hospital": hospital_payload(hospital) if hospital is not None else None,
+        "trips": [trip_payload(trip) for trip in trips],
+    })
+
+class _HospitalLog:
+    __slots__ = ("delivered", "held", "recent", "timer")
+
+    def __init__(self, delivered: int):
+        # Highest seq handed to this worker's sockets
+        self.delivered = delivered
+        # seq -> message that arrived ahead of a gap
+        self.held: Dict[int, str] = {}
+        # (seq, message) of the latest deliveries, in seq order, for resumes
+        self.recent: Deque[Tuple[int, str]] = deque(maxlen=DASHBOARD_BACKLOG)
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+class DeltaFeed:
+    """
+    Puts dashboard deltas on the wire in sequence order on this worker and
+    remembers the latest ones. Sits in front of ConnectionManager deliveries.
+    """
+
+    def __init__(self, manager):
+        self.manager = manager
+        self.logs: Dict[int, _HospitalLog] = {}
+        manager.delivery_filter = self.filter
+
+    async def publish(self, hospital_id: int, seq: int, message: str):
+        await self.manager.broadcast_to_group(message, group_for(hospital_id), key=f"delta:{seq}")
+
+    def filter(self, group_id: str, message: str, key: Optional[str]) -> List[Tuple[str, Optional[str]]]:
+        if key is None or not key.startswith("delta:") or not group_id.startswith("hospital_"):
+            return [(message, key)]
+        hospital_id, seq = int(group_id[len("hospital_"):]), int(key[len("delta:"):])
+        log = self.logs.get(hospital_id)
+        if log is None:
+            log = self.logs[hospital_id] = _HospitalLog(seq - 1)
+        if seq <= log.delivered:
+            return []  # duplicate, or given up on after the reorder wait
+        log.held[seq] = message
+        ready = self._release(log)
+        if log.held and log.timer is None:
+            log.timer = asyncio.get_running_loop().call_later(DASHBOARD_REORDER_WAIT_S, self._give_up, hospital_id)
+        return ready
+
+    def _release(self, log: _HospitalLog) -> List[Tuple[str, Optional[str]]]:
+        ready = []
+        while log.delivered + 1 in log.held:
+            log.delivered += 1
+            message = log.held.pop(log.delivered)
+            log.recent.append((log.delivered, message))
+            ready.append((message, f"delta:{log.delivered}"))
+        if not log.held and log.timer is not None:
+            log.timer.cancel()
+            log.timer = None
+        return ready
+
+    def _give_up(self, hospital_id: int):
+        # The missing delta never came: skip the gap, clients resync when they see it
+        log = self.logs[hospital_id]
+        log.timer = None
+        if log.held:
+            log.recent.clear()
+            log.delivered = min(log.held) - 1
+            self.manager.offer_group(group_for(hospital_id), self._release(log))
+
+    def since(self, hospital_id: int, seq: int, latest: int) -> Optional[List[str]]:
+        """
+        Deltas after `seq`, or None when they are no longer all held here and
+        the client needs a fresh snapshot. `latest` is the committed sequence
+        read after the socket subscribed; anything past what this worker has
+        delivered so far reaches the socket through the normal queue.
+        """
+        if seq >= latest:
+            return []
+        log = self.logs.get(hospital_id)
+        if log is None or seq >= log.delivered:
+            return None if log is None else []
+        missed = [(s, message) for s, message in log.recent if s > seq]
+        if not missed or missed[0][0] != seq + 1:
+            return None
+        return [message for _, message in missed]
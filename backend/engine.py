@@ -1,7 +1,14 @@
+import asyncio
 import math
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
 import httpx
+import numpy as np
 from typing import List, Dict, Any
-import models
+import metrics, models
 
 # Constants for scoring weights
 W_ETA = 0.4
@@ -10,6 +17,38 @@ W_SPECIALIST = 0.2
 W_AFFORD = 0.1
 W_RATING = 0.1
 
+# Routing fan-out: at most ROUTING_CONCURRENCY router calls in flight per match,
+# and the whole match gives up waiting on the router after MATCH_DEADLINE_S.
+ROUTING_CONCURRENCY = int(os.getenv("ROUTING_CONCURRENCY", "16"))
+MATCH_DEADLINE_S = float(os.getenv("MATCH_DEADLINE_S", "3.0"))
+
+# OSRM router connection settings. Point OSRM_BASE_URL at a self-hosted router
+# or a local stub; the client is shared and pooled for the app lifetime.
+OSRM_BASE_URL = os.getenv("OSRM_BASE_URL", "http://router.project-osrm.org").rstrip("/")
+OSRM_TIMEOUT_S = float(os.getenv("OSRM_TIMEOUT_S", "5.0"))
+OSRM_CONNECT_TIMEOUT_S = float(os.getenv("OSRM_CONNECT_TIMEOUT_S", "2.0"))
+OSRM_MAX_CONNECTIONS = int(os.getenv("OSRM_MAX_CONNECTIONS", "32"))
+OSRM_MAX_KEEPALIVE = int(os.getenv("OSRM_MAX_KEEPALIVE", "16"))
+OSRM_KEEPALIVE_EXPIRY_S = float(os.getenv("OSRM_KEEPALIVE_EXPIRY_S", "30.0"))
+OSRM_HTTP2 = os.getenv("OSRM_HTTP2", "0") == "1"  # needs the optional `h2` package
+
+# "table" asks OSRM's /table service for all hospitals in one call (chunked to
+# OSRM_TABLE_MAX_COORDS coordinates per request); "route" sends one /route
+# request per hospital.
+ROUTING_BACKEND = os.getenv("ROUTING_BACKEND", "table")
+OSRM_TABLE_MAX_COORDS = int(os.getenv("OSRM_TABLE_MAX_COORDS", "100"))
+
+# Route cache: origins are snapped to a ROUTE_CACHE_GRID_DEG grid (~200 m by
+# default) and paired with the destination id. Set ROUTE_CACHE_DB to a file
+# path to keep a SQLite copy that survives restarts; it is read and written off
+# the event loop, one query and one commit per match.
+ROUTE_CACHE_GRID_DEG = float(os.getenv("ROUTE_CACHE_GRID_DEG", "0.002"))
+ROUTE_CACHE_TTL_S = float(os.getenv("ROUTE_CACHE_TTL_S", "300"))
+ROUTE_CACHE_MAX_ENTRIES = int(os.getenv("ROUTE_CACHE_MAX_ENTRIES", "50000"))
+ROUTE_CACHE_DB = os.getenv("ROUTE_CACHE_DB", "")
+
+_router_client: httpx.AsyncClient | None = None
+
 def haversine(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
     # Radius of earth in km
     R = 6371.0
@@ -20,66 +59,655 @@ def haversine(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
     distance = R * c
     return distance
 
-async def get_route(lat1: float, lng1: float, lat2: float, lng2: float) -> tuple[float, float, str]:
+class RouteCache:
+    """
+    TTL + LRU cache of router results keyed on (quantized origin, destination id).
+    Only real router results are cached, so a router outage is not remembered.
+    The optional SQLite tier is only touched from worker threads.
+    """
+
+    def __init__(self, grid_deg: float, ttl_s: float, max_entries: int, db_path: str = ""):
+        self.grid_deg = grid_deg
+        self.ttl_s = ttl_s
+        self.max_entries = max_entries
+        self.entries: OrderedDict[tuple, tuple[float, float, float]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        # Serializes the SQLite connection across worker threads
+        self._db_lock = threading.Lock()
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS route_cache ("
+                "qlat INTEGER, qlng INTEGER, dest_id INTEGER, "
+                "distance_km REAL, duration_min REAL, expires_at REAL, "
+                "PRIMARY KEY (qlat, qlng, dest_id))"
+            )
+            self._db.execute("DELETE FROM route_cache WHERE expires_at < ?", (time.time(),))
+            self._db.commit()
+
+    def key(self, lat: float, lng: float, dest_id: int) -> tuple:
+        return (round(lat / self.grid_deg), round(lng / self.grid_deg), dest_id)
+
+    async def get(self, lat: float, lng: float, dest_id: int) -> tuple[float, float, str] | None:
+        return (await self.get_many([(lat, lng, dest_id)]))[0]
+
+    async def get_many(self, pairs: List[tuple[float, float, int]]) -> List[tuple[float, float, str] | None]:
+        """Cached route per (lat, lng, dest_id), or None; memory first, then one SQLite lookup for the rest."""
+        keys = [self.key(lat, lng, dest_id) for lat, lng, dest_id in pairs]
+        now = time.time()
+        found: Dict[tuple, tuple[float, float, float]] = {}
+        with self._lock:
+            for key in keys:
+                entry = self.entries.get(key)
+                if entry is not None and entry[2] > now:
+                    self.entries.move_to_end(key)
+                    found[key] = entry
+                elif entry is not None:
+                    del self.entries[key]
+        missing = [key for key in keys if key not in found]
+        if self._db is not None and missing:
+            stored = await asyncio.to_thread(self._load, missing, now)
+            with self._lock:
+                for key, entry in stored.items():
+                    self._remember(key, entry)
+            found.update(stored)
+        routes = [(found[key][0], found[key][1], "osrm") if key in found else None for key in keys]
+        hits = sum(route is not None for route in routes)
+        with self._lock:
+            self.hits += hits
+            self.misses += len(routes) - hits
+        return routes
+
+    def _load(self, keys: List[tuple], now: float) -> Dict[tuple, tuple[float, float, float]]:
+        by_origin: Dict[tuple, List[int]] = {}
+        for qlat, qlng, dest_id in keys:
+            by_origin.setdefault((qlat, qlng), []).append(dest_id)
+        found = {}
+        with self._db_lock:
+            for (qlat, qlng), dest_ids in by_origin.items():
+                # Stay well under SQLite's bound-parameter limit
+                for start in range(0, len(dest_ids), 500):
+                    chunk = dest_ids[start:start + 500]
+                    rows = self._db.execute(
+                        "SELECT dest_id, distance_km, duration_min, expires_at FROM route_cache "
+                        f"WHERE qlat = ? AND qlng = ? AND expires_at > ? AND dest_id IN ({','.join('?' * len(chunk))})",
+                        (qlat, qlng, now, *chunk)
+                    ).fetchall()
+                    for dest_id, distance_km, duration_min, expires_at in rows:
+                        found[(qlat, qlng, dest_id)] = (distance_km, duration_min, expires_at)
+        return found
+
+    async def put_many(self, items: List[tuple[float, float, int, tuple[float, float, str]]]):
+        expires_at = time.time() + self.ttl_s
+        rows = []
+        with self._lock:
+            for lat, lng, dest_id, (distance_km, duration_min, route_type) in items:
+                if route_type != "osrm":
+                    continue
+                key = self.key(lat, lng, dest_id)
+                self._remember(key, (distance_km, duration_min, expires_at))
+                rows.append((*key, distance_km, duration_min, expires_at))
+        if self._db is not None and rows:
+            await asyncio.to_thread(self._store, rows)
+
+    def _store(self, rows: List[tuple]):
+        with self._db_lock:
+            self._db.executemany("INSERT OR REPLACE INTO route_cache VALUES (?, ?, ?, ?, ?, ?)", rows)
+            self._db.commit()
+
+    def _remember(self, key: tuple, entry: tuple[float, float, float]):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate_destination(self, dest_id: int):
+        with self._lock:
+            for key in [k for k in self.entries if k[2] == dest_id]:
+                del self.entries[key]
+        if self._db is not None:
+            with self._db_lock:
+                self._db.execute("DELETE FROM route_cache WHERE dest_id = ?", (dest_id,))
+                self._db.commit()
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+        if self._db is not None:
+            with self._db_lock:
+                self._db.execute("DELETE FROM route_cache")
+                self._db.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "size": len(self.entries),
+            "max_entries": self.max_entries,
+        }
+
+route_cache = RouteCache(ROUTE_CACHE_GRID_DEG, ROUTE_CACHE_TTL_S, ROUTE_CACHE_MAX_ENTRIES, ROUTE_CACHE_DB)
+
+MATCH_SECONDS = metrics.Histogram("prana_match_seconds", "Time to route and rank hospitals for a match request.", ("kind",))
+# source is "osrm_route", "osrm_table" (one HTTP request each) or "haversine" (one estimated pair)
+ROUTING_SECONDS = metrics.Histogram("prana_routing_seconds", "Routing time by source.", ("source", "outcome"))
+ROUTING_FAILURES = metrics.Counter("prana_routing_failures_total", "Router requests that failed or ran past the match deadline.", ("service", "reason"))
+metrics.register_cache("route", route_cache.stats)
+
+def _new_router_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        base_url=OSRM_BASE_URL,
+        http2=OSRM_HTTP2,
+        timeout=httpx.Timeout(OSRM_TIMEOUT_S, connect=OSRM_CONNECT_TIMEOUT_S),
+        limits=httpx.Limits(
+            max_connections=OSRM_MAX_CONNECTIONS,
+            max_keepalive_connections=OSRM_MAX_KEEPALIVE,
+            keepalive_expiry=OSRM_KEEPALIVE_EXPIRY_S,
+        ),
+    )
+
+async def start_router() -> httpx.AsyncClient:
+    """Opens the shared routing client. Called from the app lifespan."""
+    global _router_client
+    if _router_client is None or _router_client.is_closed:
+        _router_client = _new_router_client()
+    return _router_client
+
+async def close_router():
+    global _router_client
+    if _router_client is not None:
+        await _router_client.aclose()
+        _router_client = None
+
+def get_router_client() -> httpx.AsyncClient:
+    # Scripts that never ran the lifespan (seeding, benchmarks) get one lazily.
+    global _router_client
+    if _router_client is None or _router_client.is_closed:
+        _router_client = _new_router_client()
+    return _router_client
+
+async def get_route(lat1: float, lng1: float, lat2: float, lng2: float, dest_id: int | None = None) -> tuple[float, float, str]:
     """
     Returns (distance_km, duration_min, status)
     status: 'osrm' or 'haversine'
+    Routes to a known destination (dest_id) are served from route_cache when fresh.
     """
+    if dest_id is not None:
+        cached = await route_cache.get(lat1, lng1, dest_id)
+        if cached is not None:
+            return cached
+    start = time.perf_counter()
+    # Stays "cancelled" if the match deadline cancels us mid-request
+    outcome = "cancelled"
     try:
         # OSRM expects: longitude,latitude
-        url = f"http://router.project-osrm.org/route/v1/driving/{lng1},{lat1};{lng2},{lat2}?overview=false"
-        async with httpx.AsyncClient() as client:
-            response = await client.get(url, timeout=5.0)
-            if response.status_code == 200:
-                data = response.json()
-                if data.get("routes") and len(data["routes"]) > 0:
-                    route = data["routes"][0]
-                    distance_km = route["distance"] / 1000.0
-                    duration_min = route["duration"] / 60.0
-                    return distance_km, duration_min, "osrm"
+        url = f"/route/v1/driving/{lng1},{lat1};{lng2},{lat2}?overview=false"
+        response = await get_router_client().get(url)
+        outcome = "no_route"
+        if response.status_code == 200:
+            data = response.json()
+            if data.get("routes") and len(data["routes"]) > 0:
+                route = data["routes"][0]
+                distance_km = route["distance"] / 1000.0
+                duration_min = route["duration"] / 60.0
+                if dest_id is not None:
+                    await route_cache.put_many([(lat1, lng1, dest_id, (distance_km, duration_min, "osrm"))])
+                outcome = "ok"
+                return distance_km, duration_min, "osrm"
     except Exception as e:
+        outcome = "error"
+        ROUTING_FAILURES.inc("route", "error")
         print(f"OSRM routing failed: {str(e)}")
+    finally:
+        ROUTING_SECONDS.observe(time.perf_counter() - start, "osrm_route", outcome)
     
+    return haversine_route(lat1, lng1, lat2, lng2)
+
+def haversine_route(lat1: float, lng1: float, lat2: float, lng2: float) -> tuple[float, float, str]:
     # Fallback to Haversine
+    start = time.perf_counter()
     dist = haversine(lat1, lng1, lat2, lng2)
     # Assume 40 km/h average ambulance speed in city traffic -> 0.66 km/min
     duration = dist / 0.66 
+    ROUTING_SECONDS.observe(time.perf_counter() - start, "haversine", "ok")
     return dist, duration, "haversine"
 
+async def _route_table_chunk(
+    origins: List[tuple[float, float]],
+    destinations: List[tuple[float, float]]
+) -> List[List[tuple[float, float, str] | None]]:
+    coords = ";".join(f"{lng},{lat}" for lat, lng in origins + destinations)
+    sources = ";".join(str(i) for i in range(len(origins)))
+    targets = ";".join(str(len(origins) + j) for j in range(len(destinations)))
+    url = f"/table/v1/driving/{coords}?sources={sources}&destinations={targets}&annotations=duration,distance"
+    start = time.perf_counter()
+    outcome = "cancelled"
+    try:
+        response = await get_router_client().get(url)
+        data = response.json() if response.status_code == 200 else {}
+        durations = data.get("durations")
+        distances = data.get("distances")
+        outcome = "no_route"
+        if data.get("code") == "Ok" and durations and distances:
+            outcome = "ok"
+            matrix = []
+            for duration_row, distance_row in zip(durations, distances):
+                row = []
+                for duration, distance in zip(duration_row, distance_row):
+                    if duration is None or distance is None:
+                        row.append(None)  # no route found for this pair
+                    else:
+                        row.append((distance / 1000.0, duration / 60.0, "osrm"))
+                matrix.append(row)
+            return matrix
+    except Exception as e:
+        outcome = "error"
+        ROUTING_FAILURES.inc("table", "error")
+        print(f"OSRM table routing failed: {str(e)}")
+    finally:
+        ROUTING_SECONDS.observe(time.perf_counter() - start, "osrm_table", outcome)
+
+    # The whole request failed, so estimate every pair in the chunk
+    return [[haversine_route(olat, olng, dlat, dlng) for dlat, dlng in destinations] for olat, olng in origins]
+
+async def get_route_matrix(
+    origins: List[tuple[float, float]],
+    destinations: List[tuple[float, float]],
+    concurrency: int = ROUTING_CONCURRENCY
+) -> List[List[tuple[float, float, str] | None]]:
+    """
+    Returns matrix[i][j] = (distance_km, duration_min, status) from origins[i]
+    to destinations[j] using OSRM's /table service. Origins and destinations are
+    chunked so no request exceeds OSRM_TABLE_MAX_COORDS coordinates. Pairs OSRM
+    could not route are None; pairs in a chunk whose request failed use haversine.
+    """
+    if not origins or not destinations:
+        return [[] for _ in origins]
+    origin_size = min(len(origins), max(1, OSRM_TABLE_MAX_COORDS // 2))
+    dest_size = max(1, OSRM_TABLE_MAX_COORDS - origin_size)
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def bounded_chunk(oi, dj):
+        async with semaphore:
+            return oi, await _route_table_chunk(origins[oi:oi + origin_size], destinations[dj:dj + dest_size])
+
+    parts = await asyncio.gather(*(
+        bounded_chunk(oi, dj)
+        for oi in range(0, len(origins), origin_size)
+        for dj in range(0, len(destinations), dest_size)
+    ))
+    # gather keeps order, so each row's destination chunks arrive left to right
+    matrix = [[] for _ in origins]
+    for oi, part in parts:
+        for offset, part_row in enumerate(part):
+            matrix[oi + offset].extend(part_row)
+    return matrix
+
+async def route_incidents_to_hospitals(
+    origins: List[tuple[float, float]],
+    hospitals: List[models.Hospital],
+    concurrency: int = ROUTING_CONCURRENCY,
+    deadline_s: float = MATCH_DEADLINE_S
+) -> List[List[tuple[float, float, str]]]:
+    """
+    Routing matrix for several incidents at once: cached pairs first, then one
+    (chunked) /table call for the incidents that still miss any hospital.
+    Pairs the table could not route, or everything after `deadline_s`, use haversine.
+    """
+    cached = await route_cache.get_many([(lat, lng, h.id) for lat, lng in origins for h in hospitals])
+    matrix = [cached[i * len(hospitals):(i + 1) * len(hospitals)] for i in range(len(origins))]
+    missing = [i for i, row in enumerate(matrix) if any(route is None for route in row)]
+    if missing and hospitals:
+        try:
+            table = await asyncio.wait_for(
+                get_route_matrix([origins[i] for i in missing], [(h.lat, h.lng) for h in hospitals], concurrency),
+                timeout=deadline_s
+            )
+            fresh = []
+            for i, table_row in zip(missing, table):
+                for j, route in enumerate(table_row):
+                    if matrix[i][j] is None and route is not None:
+                        matrix[i][j] = route
+                        fresh.append((origins[i][0], origins[i][1], hospitals[j].id, route))
+            await route_cache.put_many(fresh)
+        except asyncio.TimeoutError:
+            ROUTING_FAILURES.inc("table", "timeout")
+            print("OSRM table routing timed out")
+    return [
+        [
+            route if route is not None else haversine_route(lat, lng, h.lat, h.lng)
+            for h, route in zip(hospitals, row)
+        ]
+        for (lat, lng), row in zip(origins, matrix)
+    ]
+
+async def route_to_hospitals(
+    incident_lat: float,
+    incident_lng: float,
+    hospitals: List[models.Hospital],
+    concurrency: int = ROUTING_CONCURRENCY,
+    deadline_s: float = MATCH_DEADLINE_S,
+    backend: str = ROUTING_BACKEND
+) -> List[tuple[float, float, str]]:
+    """
+    Routes the incident to every hospital, serving fresh routes from
+    route_cache first. With the "table" backend the remaining hospitals go
+    in one (chunked) /table call and only pairs it could not route are
+    retried one by one; otherwise every hospital gets its own /route call.
+    At most `concurrency` requests are in flight, and hospitals whose route
+    is not back within `deadline_s` get the haversine estimate.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + deadline_s
+    routes: List[tuple[float, float, str] | None] = await route_cache.get_many([(incident_lat, incident_lng, h.id) for h in hospitals])
+    uncached = [i for i, route in enumerate(routes) if route is None]
+    table_timed_out = False
+
+    if backend == "table" and uncached:
+        destinations = [(hospitals[i].lat, hospitals[i].lng) for i in uncached]
+        try:
+            matrix = await asyncio.wait_for(
+                get_route_matrix([(incident_lat, incident_lng)], destinations, concurrency),
+                timeout=deadline_s
+            )
+            for i, route in zip(uncached, matrix[0]):
+                routes[i] = route
+        except asyncio.TimeoutError:
+            ROUTING_FAILURES.inc("table", "timeout")
+            print("OSRM table routing timed out")
+            table_timed_out = True
+
+    # Don't spend an exhausted budget again pair by pair
+    pending = [] if table_timed_out else [i for i, route in enumerate(routes) if route is None]
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def bounded_route(hospital):
+        async with semaphore:
+            return await get_route(incident_lat, incident_lng, hospital.lat, hospital.lng)
+
+    tasks = {i: asyncio.create_task(bounded_route(hospitals[i])) for i in pending}
+    if tasks:
+        await asyncio.wait(tasks.values(), timeout=max(0.0, deadline - loop.time()))
+
+    for i, task in tasks.items():
+        if task.done() and not task.cancelled() and task.exception() is None:
+            routes[i] = task.result()
+        else:
+            ROUTING_FAILURES.inc("route", "timeout")
+            task.cancel()
+    # One write for everything routed by this match
+    await route_cache.put_many([
+        (incident_lat, incident_lng, hospitals[i].id, routes[i])
+        for i in uncached if routes[i] is not None
+    ])
+
+    return [
+        route if route is not None else haversine_route(incident_lat, incident_lng, h.lat, h.lng)
+        for h, route in zip(hospitals, routes)
+    ]
+
+SPECIALTY_FOR_EMERGENCY = {
+    "Cardiac": "has_cardiology",
+    "Trauma": "has_trauma",
+    "Stroke": "has_neurology",
+    "Respiratory": "has_pulmonology",
+}
+ICU_EMERGENCIES = ("Cardiac", "Stroke", "Respiratory")
+TOP_K = 3
+
+def haversine_np(lat1, lon1, lat2, lon2) -> np.ndarray:
+    # Same formula as haversine, over arrays
+    R = 6371.0
+    dlat = np.radians(lat2 - lat1)
+    dlon = np.radians(lon2 - lon1)
+    a = np.sin(dlat / 2)**2 + np.cos(np.radians(lat1)) * np.cos(np.radians(lat2)) * np.sin(dlon / 2)**2
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+    return R * c
+
+class HospitalColumns:
+    """Hospital attributes laid out as NumPy arrays for vectorized scoring."""
+
+    __slots__ = (
+        "hospitals", "ids", "lat", "lng", "icu_beds", "general_beds", "affordability_tier", "rating",
+        "has_cardiology", "has_trauma", "has_neurology", "has_pulmonology",
+    )
+
+    def __init__(self, hospitals: List[models.Hospital]):
+        self.hospitals = list(hospitals)
+        n = len(self.hospitals)
+
+        def column(attr, dtype):
+            return np.fromiter((getattr(h, attr) for h in self.hospitals), dtype=dtype, count=n)
+
+        self.ids = column("id", np.int64)
+        self.lat = column("lat", np.float64)
+        self.lng = column("lng", np.float64)
+        # Beds held for ambulances already on their way are not free to match
+        self.icu_beds = np.maximum(column("icu_beds", np.int64) - column("icu_reserved", np.int64), 0)
+        self.general_beds = np.maximum(column("general_beds", np.int64) - column("general_reserved", np.int64), 0)
+        self.affordability_tier = column("affordability_tier", np.int64)
+        self.rating = column("rating", np.float64)
+        self.has_cardiology = column("has_cardiology", np.bool_)
+        self.has_trauma = column("has_trauma", np.bool_)
+        self.has_neurology = column("has_neurology", np.bool_)
+        self.has_pulmonology = column("has_pulmonology", np.bool_)
+
+    def __len__(self):
+        return len(self.hospitals)
+
+    def take(self, indices) -> "HospitalColumns":
+        """A new HospitalColumns holding only the rows at `indices`."""
+        subset = HospitalColumns.__new__(HospitalColumns)
+        subset.hospitals = [self.hospitals[i] for i in indices]
+        for attr in HospitalColumns.__slots__[1:]:
+            setattr(subset, attr, getattr(self, attr)[indices])
+        return subset
+
+    def replace_rows(self, indices: List[int], hospitals: List[models.Hospital]) -> "HospitalColumns":
+        """A copy with the rows at `indices` taken from `hospitals`; arrays none of them change are shared, not copied."""
+        rows = HospitalColumns(hospitals)
+        updated = HospitalColumns.__new__(HospitalColumns)
+        updated.hospitals = list(self.hospitals)
+        for i, hospital in zip(indices, hospitals):
+            updated.hospitals[i] = hospital
+        for attr in HospitalColumns.__slots__[1:]:
+            array, values = getattr(self, attr), getattr(rows, attr)
+            if not np.array_equal(array[indices], values):
+                array = array.copy()
+                array[indices] = values
+            setattr(updated, attr, array)
+        return updated
+
+def score_columns(
+    cols: HospitalColumns,
+    eta_min: np.ndarray,
+    emergency_type: str,
+    affordability_pref: int,
+    icu_beds: np.ndarray | None = None,
+    general_beds: np.ndarray | None = None
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Scores every hospital in one pass. Returns (score, bed_score, specialist_score).
+    icu_beds/general_beds override the columns, e.g. with projected capacity.
+    """
+    icu = cols.icu_beds if icu_beds is None else icu_beds
+    general = cols.general_beds if general_beds is None else general_beds
+
+    eta_score = np.maximum(0, 100 - (eta_min * 100 / 60.0))
+
+    if emergency_type in ICU_EMERGENCIES:
+        bed_score = np.where(icu > 0, 100.0, 20.0)
+    elif emergency_type == "Trauma":
+        bed_score = np.where(cols.has_trauma & (icu > 0), 100.0, np.where(icu > 0, 80.0, 20.0))
+    else:
+        bed_score = np.where(general > 0, 100.0, 50.0)
+    bed_score = np.where(icu + general == 0, 0.0, bed_score)
+
+    if emergency_type in SPECIALTY_FOR_EMERGENCY:
+        specialist_score = np.where(getattr(cols, SPECIALTY_FOR_EMERGENCY[emergency_type]), 100.0, 0.0)
+    elif emergency_type == "General":
+        specialist_score = np.full(len(cols), 100.0)
+    else:
+        specialist_score = np.zeros(len(cols))
+
+    if affordability_pref is None:
+        afford_score = np.full(len(cols), 100.0)
+    else:
+        diff = np.abs(cols.affordability_tier - affordability_pref)
+        afford_score = np.where(diff == 0, 100.0, np.where(diff == 1, 50.0, 0.0))
+
+    rating_score = (cols.rating / 5.0) * 100
+
+    score = (W_ETA * eta_score) + (W_BEDS * bed_score) + (W_SPECIALIST * specialist_score) + (W_AFFORD * afford_score) + (W_RATING * rating_score)
+    return score, bed_score, specialist_score
+
+def top_k_indices(score: np.ndarray, k: int = TOP_K) -> np.ndarray:
+    """Indices of the k best scores, best first; ties keep input order like a stable sort."""
+    if len(score) > k:
+        kth_best = score[np.argpartition(-score, k - 1)[k - 1]]
+        candidates = np.flatnonzero(score >= kth_best)
+    else:
+        candidates = np.arange(len(score))
+    return candidates[np.argsort(-score[candidates], kind="stable")][:k]
+
+def rank_hospitals(
+    emergency_type: str,
+    affordability_pref: int,
+    hospitals: List[models.Hospital] | HospitalColumns,
+    routes: List[tuple[float, float, str]],
+    k: int = TOP_K,
+    icu_beds: np.ndarray | None = None,
+    general_beds: np.ndarray | None = None
+) -> List[Dict[str, Any]]:
+    cols = hospitals if isinstance(hospitals, HospitalColumns) else HospitalColumns(hospitals)
+    if not len(cols):
+        return []
+    dist_km = np.fromiter((r[0] for r in routes), dtype=np.float64, count=len(routes))
+    eta_min = np.fromiter((r[1] for r in routes), dtype=np.float64, count=len(routes))
+    score, bed_score, specialist_score = score_columns(
+        cols, eta_min, emergency_type, affordability_pref, icu_beds, general_beds
+    )
+
+    results = []
+    for i in top_k_indices(score, k):
+        hospital = cols.hospitals[i]
+        # Explanation logic
+        explanation = f"ETA: {eta_min[i]:.1f}m ({dist_km[i]:.1f}km)."
+        if max(bed_score[i], specialist_score[i]) > 80:
+            explanation += f" High readiness for {emergency_type}."
+        if affordability_pref and hospital.affordability_tier == affordability_pref:
+            explanation += " Meets affordability preference."
+        results.append({
+            "hospital": hospital,
+            "eta_min": routes[i][1],
+            "dist_km": routes[i][0],
+            "route_type": routes[i][2],
+            "score": float(score[i]),
+            "explanation": explanation
+        })
+    return results
+
 async def match_hospitals(
     incident_lat: float, 
     incident_lng: float, 
     emergency_type: str, 
     affordability_pref: int, 
-    hospitals: List[models.Hospital]
+    hospitals: List[models.Hospital] | HospitalColumns
 ) -> List[Dict[str, Any]]:
-    
+    with MATCH_SECONDS.time("single"):
+        cols = hospitals if isinstance(hospitals, HospitalColumns) else HospitalColumns(hospitals)
+        routes = await route_to_hospitals(incident_lat, incident_lng, cols.hospitals)
+        return rank_hospitals(emergency_type, affordability_pref, cols, routes)
+
+async def match_hospitals_batch(
+    incidents: List[models.Incident],
+    hospitals: List[models.Hospital] | HospitalColumns,
+    spread: bool = True,
+    k: int = TOP_K
+) -> List[Dict[str, Any]]:
+    """
+    Matches many incidents against one shared hospital set and routing matrix.
+    With `spread`, incidents are assigned in the given order and each
+    assignment takes a bed off the hospital's projected ICU (for ICU and trauma
+    cases) or general count, so later incidents see the reduced capacity.
+    """
+    start = time.perf_counter()
+    cols = hospitals if isinstance(hospitals, HospitalColumns) else HospitalColumns(hospitals)
+    matrix = await route_incidents_to_hospitals(
+        [(incident.incident_lat, incident.incident_lng) for incident in incidents], cols.hospitals
+    )
+    icu_beds = cols.icu_beds.copy()
+    general_beds = cols.general_beds.copy()
+    positions = {hospital_id: i for i, hospital_id in enumerate(cols.ids.tolist())}
+
+    results = []
+    for incident, routes in zip(incidents, matrix):
+        matches = rank_hospitals(
+            incident.emergency_type, incident.affordability_pref, cols, routes, k, icu_beds, general_beds
+        )
+        assigned = matches[0]["hospital"] if matches else None
+        if spread and assigned is not None:
+            i = positions[assigned.id]
+            needs_icu = incident.emergency_type in ICU_EMERGENCIES or incident.emergency_type == "Trauma"
+            if needs_icu and icu_beds[i] > 0:
+                icu_beds[i] -= 1
+            elif general_beds[i] > 0:
+                general_beds[i] -= 1
+            elif icu_beds[i] > 0:
+                icu_beds[i] -= 1
+        results.append({
+            "incident_id": incident.id,
+            "assigned_hospital_id": assigned.id if assigned is not None else None,
+            "matches": matches
+        })
+    MATCH_SECONDS.observe(time.perf_counter() - start, "batch")
+    return results
+
+def rank_hospitals_loop(
+    emergency_type: str, 
+    affordability_pref: int, 
+    hospitals: List[models.Hospital],
+    routes: List[tuple[float, float, str]]
+) -> List[Dict[str, Any]]:
+    """
+    Reference scorer: one hospital at a time. rank_hospitals must give the
+    same results; keep the two in step when changing the scoring rules.
+    """
     results = []
     
-    for hospital in hospitals:
-        dist_km, eta_min, route_type = await get_route(incident_lat, incident_lng, hospital.lat, hospital.lng)
+    for hospital, (dist_km, eta_min, route_type) in zip(hospitals, routes):
         
         # Calculate Eta Score (Inverse of ETA, max 100 for 0 min, min 0 for >60min)
         eta_score = max(0, 100 - (eta_min * 100 / 60.0))
         
-        # Calculate Bed Score
-        total_beds = hospital.icu_beds + hospital.general_beds
+        # Calculate Bed Score (beds held for dispatched trips are not free)
+        icu_beds = max(hospital.icu_beds - hospital.icu_reserved, 0)
+        general_beds = max(hospital.general_beds - hospital.general_reserved, 0)
+        total_beds = icu_beds + general_beds
         if total_beds == 0:
             bed_score = 0
         elif emergency_type in ["Cardiac", "Stroke", "Respiratory"]:
-            if hospital.icu_beds > 0:
+            if icu_beds > 0:
                 bed_score = 100
             else:
                 bed_score = 20 # Penalty for no ICU
         elif emergency_type == "Trauma":
-            if hospital.has_trauma and hospital.icu_beds > 0:
+            if hospital.has_trauma and icu_beds > 0:
                 bed_score = 100
-            elif hospital.icu_beds > 0:
+            elif icu_beds > 0:
                 bed_score = 80
             else:
                 bed_score = 20
         else: # General
-            bed_score = 100 if hospital.general_beds > 0 else 50
+            bed_score = 100 if general_beds > 0 else 50
             
         # Calculate Specialist Score
         specialist_score = 0
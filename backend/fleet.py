@@ -0,0 +1,244 @@
+import asyncio
+import datetime
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+import engine, live, models, spatial
+
+# Ambulances routed (nearest first by straight line) per incident
+ASSIGN_CANDIDATES = int(os.getenv("ASSIGN_CANDIDATES", "8"))
+# An assigned unit is held for its incident this long for POST /trips to confirm it
+AMBULANCE_HOLD_TTL_S = float(os.getenv("AMBULANCE_HOLD_TTL_S", "60"))
+FLEET_CELL_DEG = float(os.getenv("FLEET_CELL_DEG", "0.02"))
+FLEET_REFRESH_S = float(os.getenv("FLEET_REFRESH_S", "30"))
+ACTIVE_TRIP_STATUSES = ("DISPATCHED", "ACKNOWLEDGED")
+# Positions fixed in memory more recently than this win over the database copy
+_FRESH_FIX_S = live.ETA_FLUSH_INTERVAL_S * 2 + 1
+
+def _claim(ambulance_id: int, incident_id: int, now: datetime.datetime):
+    # Whether the unit is free and the write are one UPDATE, so the database
+    # decides between workers assigning or dispatching the same unit at once
+    ambulance = models.Ambulance
+    on_trip = select(models.Trip.id).where(
+        models.Trip.ambulance_id == ambulance.id, models.Trip.status.in_(ACTIVE_TRIP_STATUSES)
+    ).exists()
+    return (
+        update(ambulance)
+        .where(
+            ambulance.id == ambulance_id,
+            or_(ambulance.held_for_incident_id.is_(None), ambulance.held_until <= now, ambulance.held_for_incident_id == incident_id),
+            ~on_trip,
+        )
+        .returning(ambulance.id)
+        .execution_options(synchronize_session=False)
+    )
+
+def _release(incident_id: int):
+    ambulance = models.Ambulance
+    return (
+        update(ambulance)
+        .where(ambulance.held_for_incident_id == incident_id)
+        .values(held_for_incident_id=None, held_until=None)
+        .execution_options(synchronize_session=False)
+    )
+
+class Fleet:
+    """
+    Live ambulance positions in a grid index, plus which units are busy on a
+    trip or held for an incident. Holds live in the ambulances table and are
+    taken with conditional UPDATEs, so no two workers hand out the same unit;
+    `holds` is this worker's copy, used to skip units when picking candidates.
+    """
+
+    def __init__(self):
+        self.index = spatial.GridIndex(cell_deg=FLEET_CELL_DEG)
+        self.busy: Set[int] = set()
+        # ambulance_id -> (incident_id, expires_at)
+        self.holds: Dict[int, Tuple[int, float]] = {}
+        self._fixed_at: Dict[int, float] = {}
+        self._confirmed_at: Dict[int, float] = {}
+        self._lock = threading.Lock()
+
+    def load(self, db: Session):
+        ambulances = db.query(
+            models.Ambulance.id, models.Ambulance.current_lat, models.Ambulance.current_lng,
+            models.Ambulance.held_for_incident_id, models.Ambulance.held_until,
+        ).all()
+        busy = {
+            ambulance_id for (ambulance_id,) in
+            db.query(models.Trip.ambulance_id).filter(models.Trip.status.in_(ACTIVE_TRIP_STATUSES)).distinct()
+        }
+        now = time.monotonic()
+        utcnow = datetime.datetime.utcnow()
+        # Picks up holds taken by other workers; the database still decides every claim
+        holds = {
+            ambulance_id: (incident_id, now + (held_until - utcnow).total_seconds())
+            for ambulance_id, _, _, incident_id, held_until in ambulances
+            if incident_id is not None and held_until is not None and held_until > utcnow
+        }
+        with self._lock:
+            self.holds = holds
+            for ambulance_id, lat, lng, _, _ in ambulances:
+                if lat is None or lng is None:
+                    continue
+                if now - self._fixed_at.get(ambulance_id, -_FRESH_FIX_S) < _FRESH_FIX_S:
+                    continue
+                self.index.upsert(ambulance_id, lat, lng)
+            # Dispatches confirmed just now may not be visible to this read yet
+            recent = {a for a, at in self._confirmed_at.items() if now - at < _FRESH_FIX_S}
+            self.busy = busy | (self.busy & recent)
+            self._confirmed_at = {a: self._confirmed_at[a] for a in recent}
+
+    def move(self, ambulance_id: int, lat: float, lng: float):
+        with self._lock:
+            self.index.upsert(ambulance_id, lat, lng)
+            self._fixed_at[ambulance_id] = time.monotonic()
+
+    def _is_free(self, ambulance_id: int, incident_id: Optional[int], now: float) -> bool:
+        if ambulance_id in self.busy:
+            return False
+        hold = self.holds.get(ambulance_id)
+        return hold is None or hold[1] <= now or hold[0] == incident_id
+
+    def nearest_free(self, lat: float, lng: float, k: int = ASSIGN_CANDIDATES, incident_id: Optional[int] = None, exclude: Set[int] = frozenset()) -> List[Tuple[float, int]]:
+        now = time.monotonic()
+        with self._lock:
+            return self.index.nearest(lat, lng, k, predicate=lambda a: a not in exclude and self._is_free(a, incident_id, now))
+
+    def _forget_holds(self, incident_id: int):
+        for ambulance_id in [a for a, (i, _) in self.holds.items() if i == incident_id]:
+            del self.holds[ambulance_id]
+
+    def release(self, db: Session, incident_id: int):
+        db.execute(_release(incident_id))
+        db.commit()
+        with self._lock:
+            self._forget_holds(incident_id)
+
+    async def claim(self, db: AsyncSession, ambulance_id: int, incident_id: int) -> bool:
+        """
+        Takes the unit for a dispatch in the caller's transaction, clearing its
+        hold and whatever else the incident held. False if it is on an active
+        trip or held for another incident. Call confirm() once the transaction
+        has committed; nothing is recorded here if it rolls back.
+        """
+        claimed = (await db.execute(
+            _claim(ambulance_id, incident_id, datetime.datetime.utcnow()).values(held_for_incident_id=None, held_until=None)
+        )).first()
+        if claimed is None:
+            return False
+        await db.execute(_release(incident_id))
+        return True
+
+    def confirm(self, ambulance_id: int, incident_id: int):
+        """Records a committed dispatch of a unit taken with claim()."""
+        with self._lock:
+            self.holds.pop(ambulance_id, None)
+            self._forget_holds(incident_id)
+            self.busy.add(ambulance_id)
+            self._confirmed_at[ambulance_id] = time.monotonic()
+
+    def finish(self, ambulance_id: int):
+        with self._lock:
+            self.busy.discard(ambulance_id)
+
+    async def assign(self, db: AsyncSession, incidents: List[models.Incident], k: int = ASSIGN_CANDIDATES, hold_s: float = AMBULANCE_HOLD_TTL_S) -> List[Dict[str, Any]]:
+        """
+        Holds the free ambulance with the shortest road ETA for each incident.
+        All candidate units are routed to all incidents in one matrix, then
+        pairs are taken shortest ETA first, so a unit goes to the incident it
+        reaches soonest. Units claimed by a concurrent assignment (in any
+        worker) while routing are skipped and the incident retries with fresh
+        candidates.
+        """
+        results: Dict[int, Dict[str, Any]] = {}
+        pending = list(incidents)
+        # Units whose claim failed: held elsewhere, whatever this worker's copy says
+        taken: Set[int] = set()
+        for _ in range(3):
+            if not pending:
+                break
+            candidates = {i.id: self.nearest_free(i.incident_lat, i.incident_lng, k, i.id, taken) for i in pending}
+            units = sorted({ambulance_id for found in candidates.values() for _, ambulance_id in found})
+            if not units:
+                break
+            with self._lock:
+                positions = {ambulance_id: self.index.points[ambulance_id] for ambulance_id in units if ambulance_id in self.index}
+            units = [u for u in units if u in positions]
+            matrix = await _route_units(
+                [positions[u] for u in units], [(i.incident_lat, i.incident_lng) for i in pending]
+            )
+            column = {unit: row for unit, row in zip(units, matrix)}
+
+            pairs = []
+            for j, incident in enumerate(pending):
+                ranked = []
+                for _, ambulance_id in candidates[incident.id]:
+                    if ambulance_id not in column:
+                        continue
+                    dist_km, eta_min, source = column[ambulance_id][j]
+                    ranked.append({"ambulance_id": ambulance_id, "eta_min": round(eta_min, 2), "dist_km": round(dist_km, 2), "route_type": source})
+                    pairs.append((eta_min, j, ambulance_id))
+                ranked.sort(key=lambda c: (c["eta_min"], c["ambulance_id"]))
+                results[incident.id] = {"incident_id": incident.id, "assigned_ambulance_id": None, "candidates": ranked}
+            pairs.sort()
+
+            now = time.monotonic()
+            utcnow = datetime.datetime.utcnow()
+            held_until = utcnow + datetime.timedelta(seconds=hold_s)
+            assigned: Dict[int, int] = {}
+            for eta_min, j, ambulance_id in pairs:
+                incident_id = pending[j].id
+                if incident_id in assigned or ambulance_id in taken:
+                    continue
+                with self._lock:
+                    free = self._is_free(ambulance_id, incident_id, now)
+                if not free:
+                    continue
+                held = (await db.execute(
+                    _claim(ambulance_id, incident_id, utcnow).values(held_for_incident_id=incident_id, held_until=held_until)
+                )).first()
+                taken.add(ambulance_id)
+                if held is None:
+                    continue
+                # Drop whatever this incident held before
+                await db.execute(_release(incident_id).where(models.Ambulance.id != ambulance_id))
+                assigned[incident_id] = ambulance_id
+                results[incident_id].update(assigned_ambulance_id=ambulance_id, eta_min=round(eta_min, 2), hold_expires_in_s=hold_s)
+            await db.commit()
+            with self._lock:
+                for incident_id, ambulance_id in assigned.items():
+                    self._forget_holds(incident_id)
+                    self.holds[ambulance_id] = (incident_id, now + hold_s)
+            pending = [i for i in pending if i.id not in assigned]
+        return [results.get(i.id, {"incident_id": i.id, "assigned_ambulance_id": None, "candidates": []}) for i in incidents]
+
+async def _route_units(origins: List[Tuple[float, float]], destinations: List[Tuple[float, float]]) -> List[List[tuple]]:
+    """Road ETAs from units to incidents; straight-line estimates where routing fails or runs out of time."""
+    try:
+        matrix = await asyncio.wait_for(engine.get_route_matrix(origins, destinations), engine.MATCH_DEADLINE_S)
+    except asyncio.TimeoutError:
+        matrix = [[None] * len(destinations) for _ in origins]
+    return [
+        [route if route is not None else engine.haversine_route(olat, olng, dlat, dlng) for route, (dlat, dlng) in zip(row, destinations)]
+        for (olat, olng), row in zip(origins, matrix)
+    ]
+
+ambulances = Fleet()
+
+async def refresh_periodically(session_factory, interval_s: float = FLEET_REFRESH_S):
+    while True:
+        await asyncio.sleep(interval_s)
+        db = session_factory()
+        try:
+            await asyncio.to_thread(ambulances.load, db)
+        except Exception as e:
+            print(f"Fleet refresh failed: {str(e)}")
+        finally:
+            db.close()
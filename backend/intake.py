@@ -0,0 +1,135 @@
+import asyncio
+import datetime
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+import metrics, models
+
+# Drivers on a bad connection retry. POST /incidents and POST /trips take an
+# Idempotency-Key header: the first request's response is stored with the key
+# in the same transaction as the rows it created, and a retry with the same
+# key gets that response back instead of a duplicate. Keys are scoped to the
+# user and endpoint and forgotten after IDEMPOTENCY_TTL_S.
+IDEMPOTENCY_TTL_S = float(os.getenv("IDEMPOTENCY_TTL_S", str(24 * 3600)))
+# Match results per incident are reused for this long while the hospital
+# snapshot is unchanged, apart from bed counts at hospitals the result doesn't
+# list; concurrent identical matches share one computation.
+MATCH_CACHE_TTL_S = float(os.getenv("MATCH_CACHE_TTL_S", "15"))
+MATCH_CACHE_MAX_ENTRIES = int(os.getenv("MATCH_CACHE_MAX_ENTRIES", "5000"))
+_PURGE_INTERVAL_S = min(IDEMPOTENCY_TTL_S, 3600.0)
+
+class IdempotencyConflict(Exception):
+    """The key was already used for a different request body."""
+
+def request_hash(body: Dict[str, Any]) -> str:
+    return hashlib.sha256(json.dumps(body, sort_keys=True, default=str).encode()).hexdigest()
+
+def _key_filter(user_id: int, scope: str, key: str):
+    return (
+        (models.IdempotencyKey.user_id == user_id)
+        & (models.IdempotencyKey.scope == scope)
+        & (models.IdempotencyKey.key == key)
+    )
+
+async def replay(db: AsyncSession, user_id: int, scope: str, key: str, body_hash: str) -> Optional[Dict[str, Any]]:
+    """
+    The stored response for the key, or None if it is new (an expired entry
+    is deleted in the caller's transaction so the key can be used again).
+    """
+    stored = await db.scalar(select(models.IdempotencyKey).where(_key_filter(user_id, scope, key)))
+    if stored is None:
+        return None
+    if stored.created_at < datetime.datetime.utcnow() - datetime.timedelta(seconds=IDEMPOTENCY_TTL_S):
+        await db.execute(delete(models.IdempotencyKey).where(models.IdempotencyKey.id == stored.id))
+        return None
+    if stored.request_hash != body_hash:
+        raise IdempotencyConflict(key)
+    return json.loads(stored.response)
+
+def remember(user_id: int, scope: str, key: str, body_hash: str, response: Dict[str, Any]) -> models.IdempotencyKey:
+    """Row to add in the transaction that produced `response`; a concurrent duplicate fails its unique index."""
+    return models.IdempotencyKey(user_id=user_id, scope=scope, key=key, request_hash=body_hash, response=json.dumps(response))
+
+def purge_expired(db: Session) -> int:
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(seconds=IDEMPOTENCY_TTL_S)
+    deleted = db.execute(delete(models.IdempotencyKey).where(models.IdempotencyKey.created_at < cutoff)).rowcount
+    db.commit()
+    return deleted
+
+async def purge_periodically(session_factory, interval_s: float = _PURGE_INTERVAL_S):
+    while True:
+        await asyncio.sleep(interval_s)
+        db = session_factory()
+        try:
+            await asyncio.to_thread(purge_expired, db)
+        except Exception as e:
+            print(f"Idempotency key purge failed: {str(e)}")
+        finally:
+            db.close()
+
+class MatchCache:
+    """
+    Recent match results per incident, valid for one hospital snapshot version
+    and capacity version, and at most `ttl_s`. Any bed-count change drops every
+    entry: a hospital that was full when the result was built may now qualify.
+    Callers asking for a result that is being computed wait for that
+    computation instead of starting another.
+    """
+
+    def __init__(self, ttl_s: float, max_entries: int):
+        self.ttl_s = ttl_s
+        self.max_entries = max_entries
+        # incident_id -> (snapshot version, snapshot capacity_version, expires_at, results)
+        self.entries: OrderedDict[int, Tuple[int, int, float, List[Dict[str, Any]]]] = OrderedDict()
+        self.inflight: Dict[Tuple[int, int], asyncio.Task] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    @staticmethod
+    def _fresh(entry, hospitals, version: int) -> bool:
+        return entry[0] == version and entry[1] == hospitals.capacity_version and entry[2] > time.monotonic()
+
+    async def get(self, incident_id: int, hospitals, compute: Callable[[], Awaitable[List[Dict[str, Any]]]]) -> List[Dict[str, Any]]:
+        """`hospitals` is the snapshot.HospitalSnapshot the results are computed from."""
+        version = hospitals.version
+        entry = self.entries.get(incident_id)
+        if entry is not None and self._fresh(entry, hospitals, version):
+            self.entries.move_to_end(incident_id)
+            self.hits += 1
+            return entry[3]
+        task = self.inflight.get((incident_id, version))
+        if task is None:
+            self.misses += 1
+            capacity_version = hospitals.capacity_version
+            task = self.inflight[(incident_id, version)] = asyncio.create_task(compute())
+            task.add_done_callback(lambda done: self._finish(incident_id, version, capacity_version, done))
+        else:
+            # Served without computing, so a hit as far as the router is concerned
+            self.hits += 1
+            self.coalesced += 1
+        # A waiter that goes away (client disconnect) must not cancel the shared computation
+        return await asyncio.shield(task)
+
+    def _finish(self, incident_id: int, version: int, capacity_version: int, task: asyncio.Task):
+        self.inflight.pop((incident_id, version), None)
+        if task.cancelled() or task.exception() is not None:
+            return
+        self.entries[incident_id] = (version, capacity_version, time.monotonic() + self.ttl_s, task.result())
+        self.entries.move_to_end(incident_id)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"hits": self.hits, "misses": self.misses, "coalesced": self.coalesced, "size": len(self.entries), "inflight": len(self.inflight)}
+
+match_cache = MatchCache(MATCH_CACHE_TTL_S, MATCH_CACHE_MAX_ENTRIES)
+metrics.register_cache("match", match_cache.stats)
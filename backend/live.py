@@ -0,0 +1,125 @@
+import asyncio
+import os
+import threading
+from typing import Dict, Iterable, Optional, Set
+
+from sqlalchemy import update
+
+import models
+
+# Live ETA/position updates are applied in memory at once and written to the
+# database in one batched transaction every ETA_FLUSH_INTERVAL_S.
+ETA_FLUSH_INTERVAL_S = float(os.getenv("ETA_FLUSH_INTERVAL_S", "2.0"))
+
+class LiveTrip:
+    __slots__ = ("trip_id", "hospital_id", "ambulance_id", "eta_minutes", "lat", "lng", "signal_priority", "route", "closed")
+
+    def __init__(self, trip: models.Trip):
+        self.trip_id = trip.id
+        self.hospital_id = trip.selected_hospital_id
+        self.ambulance_id = trip.ambulance_id
+        self.eta_minutes = trip.eta_minutes
+        self.lat = None
+        self.lng = None
+        self.signal_priority = bool(trip.signal_priority_active)
+        # Last router answer for server-side ETA recomputation (tracking.RouteFix)
+        self.route = None
+        self.closed = False
+
+class LiveTripStore:
+    """
+    Write-behind store for high-frequency trip updates. Readers see the latest
+    value immediately; the database only gets the last value per trip per flush.
+    """
+
+    def __init__(self, session_factory):
+        self.session_factory = session_factory
+        self.trips: Dict[int, LiveTrip] = {}
+        self._dirty_eta: Set[int] = set()
+        self._dirty_position: Set[int] = set()
+        self._lock = threading.Lock()
+        self.flushes = 0
+        self.rows_written = 0
+
+    async def load(self, trip_id: int) -> Optional[LiveTrip]:
+        live = self.trips.get(trip_id)
+        if live is None:
+            async with self.session_factory() as db:
+                trip = await db.get(models.Trip, trip_id)
+            if trip is None:
+                return None
+            live = self.trips.setdefault(trip_id, LiveTrip(trip))
+        return live
+
+    def track(self, trip: models.Trip) -> LiveTrip:
+        return self.trips.setdefault(trip.id, LiveTrip(trip))
+
+    def update(self, live: LiveTrip, eta_minutes: Optional[float] = None, lat: Optional[float] = None, lng: Optional[float] = None):
+        with self._lock:
+            if eta_minutes is not None:
+                live.eta_minutes = eta_minutes
+                self._dirty_eta.add(live.trip_id)
+            if lat is not None and lng is not None:
+                live.lat, live.lng = lat, lng
+                self._dirty_position.add(live.trip_id)
+
+    def eta_for(self, trip_id: int) -> Optional[float]:
+        live = self.trips.get(trip_id)
+        return live.eta_minutes if live is not None else None
+
+    def overlay(self, trips: Iterable[models.Trip]):
+        """Copy unflushed ETAs onto trips read from the database."""
+        for trip in trips:
+            live = self.trips.get(trip.id)
+            if live is not None:
+                trip.eta_minutes = live.eta_minutes
+
+    def close(self, trip_id: int):
+        """Stop tracking a finished trip once its pending state has been flushed."""
+        live = self.trips.get(trip_id)
+        if live is not None:
+            live.closed = True
+
+    async def flush(self):
+        with self._lock:
+            dirty_eta, self._dirty_eta = self._dirty_eta, set()
+            dirty_position, self._dirty_position = self._dirty_position, set()
+            eta_rows = [
+                {"id": trip_id, "eta_minutes": self.trips[trip_id].eta_minutes}
+                for trip_id in dirty_eta if trip_id in self.trips
+            ]
+            position_rows = {}
+            for trip_id in dirty_position:
+                live = self.trips.get(trip_id)
+                if live is not None and live.ambulance_id is not None:
+                    position_rows[live.ambulance_id] = {"id": live.ambulance_id, "current_lat": live.lat, "current_lng": live.lng}
+
+        if eta_rows or position_rows:
+            try:
+                async with self.session_factory() as db:
+                    if eta_rows:
+                        await db.execute(update(models.Trip), eta_rows)
+                    if position_rows:
+                        await db.execute(update(models.Ambulance), list(position_rows.values()))
+                    await db.commit()
+                self.flushes += 1
+                self.rows_written += len(eta_rows) + len(position_rows)
+            except BaseException as e:
+                # Put the batch back for the next flush, also when cancelled mid-write
+                with self._lock:
+                    self._dirty_eta |= dirty_eta
+                    self._dirty_position |= dirty_position
+                if not isinstance(e, Exception):
+                    raise
+                print(f"Live trip flush failed: {str(e)}")
+                return
+
+        with self._lock:
+            for trip_id in [t for t, live in self.trips.items() if live.closed]:
+                if trip_id not in self._dirty_eta and trip_id not in self._dirty_position:
+                    del self.trips[trip_id]
+
+    async def run(self, interval_s: float = ETA_FLUSH_INTERVAL_S):
+        while True:
+            await asyncio.sleep(interval_s)
+            await self.flush()
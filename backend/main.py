@@ -1,15 +1,71 @@
-from fastapi import FastAPI, Depends, HTTPException, status, WebSocket, WebSocketDisconnect
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Depends, Header, HTTPException, Query, Response, status, WebSocket, WebSocketDisconnect
 from fastapi.security import OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
+from datetime import datetime
+import asyncio
 
-import models, schemas, auth, database, seed
-from database import engine, get_db
+import anyio
+
+import models, schemas, auth, database, seed, snapshot, live, realtime, pubsub, tracking, fleet, metrics, dashboard, zones, intake, beds, engine as routing
+from database import engine, get_db, get_read_db, get_async_db
 
 models.Base.metadata.create_all(bind=engine)
+database.ensure_columns()
+database.ensure_indexes()
+
+MATCH_BATCH_MAX = 200
+PAGE_SIZE_DEFAULT = 50
+PAGE_SIZE_MAX = 500
+live_trips = live.LiveTripStore(database.AsyncSessionLocal)
+eta_tracker = tracking.EtaTracker(snapshot.hospitals)
 
-app = FastAPI(title="PRANA API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    db = database.SessionLocal()
+    seed.seed_database(db)
+    snapshot.hospitals.load(db)
+    fleet.ambulances.load(db)
+    db.close()
+    await routing.start_router()
+    refresher = asyncio.create_task(snapshot.refresh_periodically(database.SessionLocal))
+    fleet_refresher = asyncio.create_task(fleet.refresh_periodically(database.SessionLocal))
+    flusher = asyncio.create_task(live_trips.run())
+    loop_monitor = asyncio.create_task(metrics.monitor_event_loop())
+    key_purger = asyncio.create_task(intake.purge_periodically(database.SessionLocal))
+    bed_sweeper = asyncio.create_task(beds.expire_periodically(database.SessionLocal, publish_hospital))
+    zone_refresher = asyncio.create_task(zones.refresh_periodically(snapshot.hospitals)) if zones.ZONE_MATRIX_PATH else None
+    manager.group_handlers[auth.PRINCIPAL_INVALIDATION_GROUP] = auth.on_invalidation
+    await manager.start()
+    auth.announce_invalidations(asyncio.get_running_loop(), manager.broadcast_to_group)
+    try:
+        yield
+    finally:
+        refresher.cancel()
+        fleet_refresher.cancel()
+        flusher.cancel()
+        loop_monitor.cancel()
+        key_purger.cancel()
+        bed_sweeper.cancel()
+        if zone_refresher is not None:
+            zone_refresher.cancel()
+        metrics.profiler.stop()
+        await manager.stop()
+        # Let a cancelled in-flight flush hand its batch back, then write out
+        # every pending ETA/position before the process exits
+        await asyncio.gather(flusher, return_exceptions=True)
+        await live_trips.flush()
+        await routing.close_router()
+        await database.async_engine.dispose()
+        database.dispose_engines()
+
+app = FastAPI(title="PRANA API", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -18,22 +74,45 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(metrics.MetricsMiddleware)
 
-@app.on_event("startup")
-def on_startup():
-    db = database.SessionLocal()
-    seed.seed_database(db)
-    db.close()
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+def require_profiler():
+    if not metrics.PROFILER_ENABLED:
+        raise HTTPException(status_code=404, detail="Profiler is disabled (set PROFILER_ENABLED=1)")
+
+@app.post("/debug/profiler/start", dependencies=[Depends(require_profiler)])
+def start_profiler(seconds: float = Query(30.0, gt=0), interval_ms: float = Query(metrics.PROFILER_INTERVAL_MS, ge=1)):
+    if not metrics.profiler.start(seconds, interval_ms):
+        raise HTTPException(status_code=409, detail="Profiler is already running")
+    return {"status": "Profiling", "seconds": min(seconds, metrics.PROFILER_MAX_SECONDS)}
+
+@app.post("/debug/profiler/stop", dependencies=[Depends(require_profiler)])
+def stop_profiler():
+    metrics.profiler.stop()
+    return {"status": "Stopped", "samples": metrics.profiler.samples}
+
+@app.get("/debug/profiler", response_class=PlainTextResponse, dependencies=[Depends(require_profiler)])
+def get_profile():
+    # Collapsed stacks of the last (or current) run, for flamegraph.pl or speedscope
+    return metrics.profiler.collapsed()
 
 @app.post("/token", response_model=schemas.AuthResponse)
-def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = db.query(models.User).filter(models.User.email == form_data.username).first()
-    if not user or not auth.verify_password(form_data.password, user.password_hash):
+async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_async_db)):
+    user = await db.scalar(select(models.User).where(models.User.email == form_data.username))
+    valid, new_hash = await auth.verify_password_async(form_data.password, user.password_hash if user else None)
+    if not valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
+    if new_hash:
+        user.password_hash = new_hash
+        await db.commit()
     access_token_expires = auth.timedelta(minutes=auth.ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = auth.create_access_token(
         data={"sub": user.email}, expires_delta=access_token_expires
@@ -41,18 +120,18 @@ def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db:
     return {"access_token": access_token, "token_type": "bearer", "user": user}
 
 @app.get("/users/me", response_model=schemas.UserResponse)
-def read_users_me(current_user: models.User = Depends(auth.get_current_active_user)):
+def read_users_me(current_user: auth.Principal = Depends(auth.get_current_active_user)):
     return current_user
 
 @app.get("/hospitals", response_model=List[schemas.HospitalResponse])
-def get_hospitals(db: Session = Depends(get_db)):
-    return db.query(models.Hospital).all()
+def get_hospitals():
+    return snapshot.hospitals.all()
 
 @app.put("/hospitals/{hospital_id}", response_model=schemas.HospitalResponse)
 def update_hospital(
     hospital_id: int, 
-    hospital_update: schemas.HospitalBase, 
-    current_user: models.User = Depends(auth.get_current_hospital_staff), 
+    hospital_update: schemas.HospitalDetailsUpdate, 
+    current_user: auth.Principal = Depends(auth.get_current_hospital_staff), 
     db: Session = Depends(get_db)
 ):
     if current_user.hospital_id != hospital_id:
@@ -64,83 +143,277 @@ def update_hospital(
         
     for key, value in hospital_update.model_dump().items():
         setattr(db_hospital, key, value)
+    seq = dashboard.next_seq(db, hospital_id)
         
     db.commit()
     db.refresh(db_hospital)
+    snapshot.hospitals.upsert(db_hospital)
+    publish_delta_from_thread(hospital_id, seq, dashboard.delta_message(hospital_id, seq, hospital=dashboard.hospital_payload(db_hospital)))
     return db_hospital
 
+@app.patch("/hospitals/{hospital_id}/capacity", response_model=schemas.HospitalResponse)
+def update_hospital_capacity(
+    hospital_id: int,
+    capacity: schemas.HospitalCapacityUpdate,
+    current_user: auth.Principal = Depends(auth.get_current_hospital_staff),
+    db: Session = Depends(get_db)
+):
+    # Bed counts only, applied in place, so concurrent updates and bed holds are never overwritten
+    if current_user.hospital_id != hospital_id:
+        raise HTTPException(status_code=403, detail="Not authorized to update this hospital")
+    changes = 0
+    for bed_type in ("icu", "general"):
+        absolute, delta = getattr(capacity, f"{bed_type}_beds"), getattr(capacity, f"{bed_type}_delta")
+        if absolute is not None and delta is not None:
+            raise HTTPException(status_code=422, detail=f"Give either {bed_type}_beds or {bed_type}_delta, not both")
+        if absolute is not None and absolute < 0:
+            raise HTTPException(status_code=422, detail=f"{bed_type}_beds must not be negative")
+        changes += absolute is not None or bool(delta)
+    if not changes:
+        # Omitted fields and zero deltas change nothing
+        raise HTTPException(status_code=422, detail="Nothing to update")
+
+    hospital = beds.update_capacity(db, hospital_id, capacity)
+    if hospital is None:
+        current = db.get(models.Hospital, hospital_id)
+        if current is None:
+            raise HTTPException(status_code=404, detail="Hospital not found")
+        raise HTTPException(
+            status_code=409,
+            detail=f"Beds held for dispatched trips can't be removed (ICU: {current.icu_reserved}, general: {current.general_reserved})",
+        )
+    seq = dashboard.next_seq(db, hospital_id)
+    db.commit()
+    publish_hospital_from_thread(hospital, seq)
+    return dashboard.hospital_payload(hospital)
+
+async def replay_idempotent(db: AsyncSession, user_id: int, scope: str, key: str, body_hash: str, response: Response) -> Optional[dict]:
+    """The stored response to an earlier request with this Idempotency-Key, if any."""
+    try:
+        stored = await intake.replay(db, user_id, scope, key, body_hash)
+    except intake.IdempotencyConflict:
+        raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different request")
+    if stored is not None:
+        response.headers["Idempotent-Replayed"] = "true"
+    return stored
+
 @app.post("/incidents", response_model=schemas.IncidentResponse)
 async def create_incident(
     incident: schemas.IncidentCreate,
-    current_user: models.User = Depends(auth.get_current_ambulance_driver),
-    db: Session = Depends(get_db)
+    response: Response,
+    idempotency_key: Optional[str] = Header(None, max_length=255),
+    current_user: auth.Principal = Depends(auth.get_current_ambulance_driver),
+    db: AsyncSession = Depends(get_async_db)
 ):
+    scope = "POST /incidents"
+    body_hash = intake.request_hash(incident.model_dump(mode="json"))
+    if idempotency_key:
+        stored = await replay_idempotent(db, current_user.id, scope, idempotency_key, body_hash, response)
+        if stored is not None:
+            return stored
     db_incident = models.Incident(**incident.model_dump())
-    db.add(db_incident)
-    db.commit()
-    db.refresh(db_incident)
+    try:
+        db.add(db_incident)
+        await db.flush()
+        if idempotency_key:
+            payload = schemas.IncidentResponse.model_validate(db_incident).model_dump(mode="json")
+            db.add(intake.remember(current_user.id, scope, idempotency_key, body_hash, payload))
+        await db.commit()
+    except IntegrityError:
+        # A concurrent retry with the same key committed first; this request's incident was rolled back
+        await db.rollback()
+        stored = await replay_idempotent(db, current_user.id, scope, idempotency_key, body_hash, response) if idempotency_key else None
+        if stored is None:
+            raise
+        return stored
+    await db.refresh(db_incident)
     return db_incident
 
+@app.post("/incidents/match:batch")
+async def match_hospitals_for_incidents(
+    request: schemas.BatchMatchRequest,
+    current_user: auth.Principal = Depends(auth.get_current_ambulance_driver),
+    db: AsyncSession = Depends(get_async_db)
+):
+    incident_ids = list(dict.fromkeys(request.incident_ids))
+    if not incident_ids or len(incident_ids) > MATCH_BATCH_MAX:
+        raise HTTPException(status_code=422, detail=f"Provide between 1 and {MATCH_BATCH_MAX} incident ids")
+    rows = await db.scalars(select(models.Incident).where(models.Incident.id.in_(incident_ids)))
+    found = {i.id: i for i in rows}
+    missing = [i for i in incident_ids if i not in found]
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Incidents not found: {missing}")
+
+    incidents = [found[i] for i in incident_ids]
+    hospitals = snapshot.hospitals.candidates_near([(i.incident_lat, i.incident_lng) for i in incidents])
+    return await routing.match_hospitals_batch(incidents, hospitals, spread=request.spread, k=request.top_k)
+
 @app.get("/incidents/{incident_id}/match")
 async def match_hospitals_for_incident(
     incident_id: int,
-    current_user: models.User = Depends(auth.get_current_ambulance_driver),
-    db: Session = Depends(get_db)
+    current_user: auth.Principal = Depends(auth.get_current_ambulance_driver),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    incident = db.query(models.Incident).filter(models.Incident.id == incident_id).first()
+    incident = await db.get(models.Incident, incident_id)
     if not incident:
         raise HTTPException(status_code=404, detail="Incident not found")
-        
-    hospitals = db.query(models.Hospital).all()
-    from engine import match_hospitals
-    results = await match_hospitals(
-        incident.incident_lat, 
-        incident.incident_lng,
-        incident.emergency_type,
-        incident.affordability_pref,
-        hospitals
-    )
-    return results
+
+    async def compute():
+        # The zone matrix scores every hospital without the router; without one, route the nearest candidates
+        results = await zones.match_hospitals(
+            incident.incident_lat,
+            incident.incident_lng,
+            incident.emergency_type,
+            incident.affordability_pref,
+            snapshot.hospitals.columns()
+        )
+        if results is not None:
+            return results
+        hospitals = snapshot.hospitals.candidates(incident.incident_lat, incident.incident_lng)
+        return await routing.match_hospitals(
+            incident.incident_lat,
+            incident.incident_lng,
+            incident.emergency_type,
+            incident.affordability_pref,
+            hospitals
+        )
+
+    # Retries and concurrent identical requests share one computation; hospital changes start afresh
+    return await intake.match_cache.get(incident_id, snapshot.hospitals, compute)
+
+@app.post("/incidents/assign:batch")
+async def assign_ambulances_for_incidents(
+    request: schemas.BatchAssignRequest,
+    current_user: auth.Principal = Depends(auth.get_current_ambulance_driver),
+    db: AsyncSession = Depends(get_async_db)
+):
+    incident_ids = list(dict.fromkeys(request.incident_ids))
+    if not incident_ids or len(incident_ids) > MATCH_BATCH_MAX:
+        raise HTTPException(status_code=422, detail=f"Provide between 1 and {MATCH_BATCH_MAX} incident ids")
+    rows = await db.scalars(select(models.Incident).where(models.Incident.id.in_(incident_ids)))
+    found = {i.id: i for i in rows}
+    missing = [i for i in incident_ids if i not in found]
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Incidents not found: {missing}")
+    return await fleet.ambulances.assign(db, [found[i] for i in incident_ids])
+
+@app.post("/incidents/{incident_id}/assign")
+async def assign_ambulance_for_incident(
+    incident_id: int,
+    current_user: auth.Principal = Depends(auth.get_current_ambulance_driver),
+    db: AsyncSession = Depends(get_async_db)
+):
+    # Holds the free ambulance with the shortest road ETA until POST /trips confirms it
+    incident = await db.get(models.Incident, incident_id)
+    if not incident:
+        raise HTTPException(status_code=404, detail="Incident not found")
+    return (await fleet.ambulances.assign(db, [incident]))[0]
+
+@app.delete("/incidents/{incident_id}/assign")
+def release_ambulance_for_incident(incident_id: int, current_user: auth.Principal = Depends(auth.get_current_ambulance_driver), db: Session = Depends(get_db)):
+    fleet.ambulances.release(db, incident_id)
+    return {"status": "Released"}
 
 @app.post("/trips", response_model=schemas.TripResponse)
 async def create_trip(
     trip: schemas.TripCreate,
-    current_user: models.User = Depends(auth.get_current_ambulance_driver),
-    db: Session = Depends(get_db)
+    response: Response,
+    idempotency_key: Optional[str] = Header(None, max_length=255),
+    current_user: auth.Principal = Depends(auth.get_current_ambulance_driver),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    db_trip = models.Trip(**trip.model_dump())
-    db.add(db_trip)
-    db.commit()
-    db.refresh(db_trip)
-    
-    # Also update incident status
-    incident = db.query(models.Incident).filter(models.Incident.id == trip.incident_id).first()
-    if incident:
-        incident.status = "ACTIVE"
-        db.commit()
-        
-    # Log event
-    event = models.TripEvent(trip_id=db_trip.id, event_type="DISPATCHED", message="Ambulance dispatched to incident.")
-    db.add(event)
-    db.commit()
-    
+    scope = "POST /trips"
+    body_hash = intake.request_hash(trip.model_dump(mode="json"))
+    if idempotency_key:
+        stored = await replay_idempotent(db, current_user.id, scope, idempotency_key, body_hash, response)
+        if stored is not None:
+            return stored
+    # Trip, incident status, bed hold, ambulance claim, dispatch event and idempotency key go out in one transaction
+    db_trip = models.Trip(**trip.model_dump(), signal_priority_active=False, status="DISPATCHED")
+    try:
+        incident = (await db.execute(select(models.Incident.emergency_type).where(models.Incident.id == trip.incident_id))).first()
+        if incident is None:
+            raise HTTPException(status_code=404, detail="Incident not found")
+        hospital, bed_type = await beds.reserve(db, trip.selected_hospital_id, incident.emergency_type)
+        if hospital is None:
+            if await db.get(models.Hospital, trip.selected_hospital_id) is None:
+                raise HTTPException(status_code=404, detail="Hospital not found")
+            raise HTTPException(status_code=409, detail="No free bed at the selected hospital")
+        if not await fleet.ambulances.claim(db, trip.ambulance_id, trip.incident_id):
+            raise HTTPException(status_code=409, detail="Ambulance is on another trip or held for another incident")
+        db.add(db_trip)
+        await db.flush()
+        await db.execute(
+            update(models.Incident).where(models.Incident.id == trip.incident_id).values(status="ACTIVE")
+        )
+        db.add(beds.reservation(db_trip.id, trip.selected_hospital_id, bed_type))
+        db.add(models.TripEvent(trip_id=db_trip.id, event_type="DISPATCHED", message="Ambulance dispatched to incident."))
+        if idempotency_key:
+            db.add(intake.remember(current_user.id, scope, idempotency_key, body_hash, dashboard.trip_payload(db_trip)))
+        seq = await dashboard.next_seq_async(db, trip.selected_hospital_id)
+        hospital_seq = await dashboard.next_seq_async(db, trip.selected_hospital_id)
+        await db.commit()
+    except (IntegrityError, HTTPException):
+        await db.rollback()
+        stored = await replay_idempotent(db, current_user.id, scope, idempotency_key, body_hash, response) if idempotency_key else None
+        if stored is None:
+            raise
+        # A concurrent retry with the same key dispatched the trip, taking the bed and unit first
+        return stored
+    fleet.ambulances.confirm(trip.ambulance_id, trip.incident_id)
+    await feed.publish(trip.selected_hospital_id, seq, trip_delta(trip.selected_hospital_id, seq, db_trip))
+    await publish_hospital(hospital, hospital_seq)
     return db_trip
 
+def paginate_trips(query, statuses: Optional[List[str]], after_id: Optional[int], before_id: Optional[int], limit: int):
+    """
+    Keyset pagination over trips. With after_id, rows newer than it come back
+    oldest first (incremental sync); otherwise newest first, older than before_id.
+    """
+    if statuses:
+        query = query.filter(models.Trip.status.in_(statuses))
+    if after_id is not None:
+        return query.filter(models.Trip.id > after_id).order_by(models.Trip.id).limit(limit).all()
+    if before_id is not None:
+        query = query.filter(models.Trip.id < before_id)
+    return query.order_by(models.Trip.id.desc()).limit(limit).all()
+
 @app.get("/trips/driver", response_model=List[schemas.TripResponse])
-def get_driver_trips(current_user: models.User = Depends(auth.get_current_ambulance_driver), db: Session = Depends(get_db)):
+def get_driver_trips(
+    status_filter: Optional[List[str]] = Query(None, alias="status"),
+    after_id: Optional[int] = None,
+    before_id: Optional[int] = None,
+    limit: int = Query(PAGE_SIZE_DEFAULT, ge=1, le=PAGE_SIZE_MAX),
+    current_user: auth.Principal = Depends(auth.get_current_ambulance_driver),
+    db: Session = Depends(get_read_db)
+):
     ambulance = db.query(models.Ambulance).filter(models.Ambulance.driver_user_id == current_user.id).first()
     if not ambulance:
         return []
-    return db.query(models.Trip).filter(models.Trip.ambulance_id == ambulance.id).all()
+    query = db.query(models.Trip).filter(models.Trip.ambulance_id == ambulance.id)
+    trips = paginate_trips(query, status_filter, after_id, before_id, limit)
+    live_trips.overlay(trips)
+    return trips
 
 @app.get("/trips/hospital/{hospital_id}", response_model=List[schemas.TripResponse])
-def get_hospital_cases(hospital_id: int, current_user: models.User = Depends(auth.get_current_hospital_staff), db: Session = Depends(get_db)):
+def get_hospital_cases(
+    hospital_id: int,
+    status_filter: Optional[List[str]] = Query(None, alias="status"),
+    after_id: Optional[int] = None,
+    before_id: Optional[int] = None,
+    limit: int = Query(PAGE_SIZE_DEFAULT, ge=1, le=PAGE_SIZE_MAX),
+    current_user: auth.Principal = Depends(auth.get_current_hospital_staff),
+    db: Session = Depends(get_read_db)
+):
     if current_user.hospital_id != hospital_id:
         raise HTTPException(status_code=403, detail="Can only view cases for your assigned hospital")
-    return db.query(models.Trip).filter(models.Trip.selected_hospital_id == hospital_id).all()
+    query = db.query(models.Trip).filter(models.Trip.selected_hospital_id == hospital_id)
+    trips = paginate_trips(query, status_filter, after_id, before_id, limit)
+    live_trips.overlay(trips)
+    return trips
 
 @app.post("/trips/{trip_id}/action")
-def hospital_action(trip_id: int, action: str, message: str, current_user: models.User = Depends(auth.get_current_hospital_staff), db: Session = Depends(get_db)):
+def hospital_action(trip_id: int, action: str, message: str, current_user: auth.Principal = Depends(auth.get_current_hospital_staff), db: Session = Depends(get_db)):
     trip = db.query(models.Trip).filter(models.Trip.id == trip_id).first()
     if not trip:
         raise HTTPException(status_code=404, detail="Trip not found")
@@ -150,88 +423,193 @@ def hospital_action(trip_id: int, action: str, message: str, current_user: model
     db_action = models.HospitalAction(trip_id=trip_id, action_type=action, message=message, by_user_id=current_user.id)
     db.add(db_action)
     
+    delta = None
     if action == "ACKNOWLEDGE":
         trip.status = "ACKNOWLEDGED"
         event = models.TripEvent(trip_id=trip_id, event_type="HOSPITAL_ACK", message=message)
         db.add(event)
+        seq = dashboard.next_seq(db, trip.selected_hospital_id)
+        delta = trip_delta(trip.selected_hospital_id, seq, trip)
         
     db.commit()
+    if delta is not None:
+        publish_delta_from_thread(trip.selected_hospital_id, seq, delta)
     return {"status": "Action recorded"}
 
 @app.post("/trips/{trip_id}/priority")
-def request_green_corridor(trip_id: int, current_user: models.User = Depends(auth.get_current_ambulance_driver), db: Session = Depends(get_db)):
-    trip = db.query(models.Trip).filter(models.Trip.id == trip_id).first()
-    if not trip:
+def request_green_corridor(trip_id: int, current_user: auth.Principal = Depends(auth.get_current_ambulance_driver), db: Session = Depends(get_db)):
+    # Simulate ETA reduction, starting from the latest live ETA if one is pending
+    live_eta = live_trips.eta_for(trip_id)
+    reduced_eta = (models.Trip.eta_minutes if live_eta is None else live_eta) * tracking.GREEN_CORRIDOR_ETA_FACTOR
+    row = db.execute(
+        update(models.Trip)
+        .where(models.Trip.id == trip_id)
+        .values(signal_priority_active=True, eta_minutes=reduced_eta)
+        .returning(*models.Trip.__table__.columns)
+        .execution_options(synchronize_session=False)
+    ).first()
+    if row is None:
         raise HTTPException(status_code=404, detail="Trip not found")
-        
-    trip.signal_priority_active = True
-    # Simulate ETA reduction
-    trip.eta_minutes = trip.eta_minutes * 0.8 
     
     event = models.TripEvent(trip_id=trip_id, event_type="PRIORITY_ACTIVE", message="Green corridor activated. ETA updated.")
     db.add(event)
+    seq = dashboard.next_seq(db, row.selected_hospital_id)
     db.commit()
-    db.refresh(trip)
-    return {"status": "Green corridor requested", "new_eta": trip.eta_minutes}
+    publish_delta_from_thread(row.selected_hospital_id, seq, dashboard.delta_message(row.selected_hospital_id, seq, trip=dashboard.trip_payload(row)))
+    new_eta = row.eta_minutes
+    if trip_id in live_trips.trips:
+        live_trip = live_trips.trips[trip_id]
+        live_trip.signal_priority = True
+        live_trips.update(live_trip, eta_minutes=new_eta)
+    return {"status": "Green corridor requested", "new_eta": new_eta}
 
 @app.post("/trips/{trip_id}/arrive")
-def mark_arrived(trip_id: int, current_user: models.User = Depends(auth.get_current_ambulance_driver), db: Session = Depends(get_db)):
-    trip = db.query(models.Trip).filter(models.Trip.id == trip_id).first()
-    if not trip:
-        raise HTTPException(status_code=404, detail="Trip not found")
-    
-    trip.status = "ARRIVED"
-    incident = db.query(models.Incident).filter(models.Incident.id == trip.incident_id).first()
-    if incident:
-        incident.status = "ARRIVED"
-        
+def mark_arrived(trip_id: int, current_user: auth.Principal = Depends(auth.get_current_ambulance_driver), db: Session = Depends(get_db)):
+    row = db.execute(
+        update(models.Trip)
+        .where(models.Trip.id == trip_id, models.Trip.status.in_(dashboard.OPEN_STATUSES))
+        .values(status="ARRIVED")
+        .returning(*models.Trip.__table__.columns)
+        .execution_options(synchronize_session=False)
+    ).first()
+    if row is None:
+        if db.get(models.Trip, trip_id) is None:
+            raise HTTPException(status_code=404, detail="Trip not found")
+        raise HTTPException(status_code=409, detail="Trip is no longer active")
+
+    db.execute(
+        update(models.Incident)
+        .where(models.Incident.id == row.incident_id)
+        .values(status="ARRIVED")
+        .execution_options(synchronize_session=False)
+    )
     event = models.TripEvent(trip_id=trip_id, event_type="ARRIVED", message="Ambulance arrived at hospital.")
     db.add(event)
+    # The held bed is now occupied
+    hospital = beds.settle(db, trip_id, "COMMITTED")
+    seq = dashboard.next_seq(db, row.selected_hospital_id)
+    hospital_seq = dashboard.next_seq(db, row.selected_hospital_id) if hospital is not None else None
     db.commit()
+    publish_delta_from_thread(row.selected_hospital_id, seq, trip_delta(row.selected_hospital_id, seq, row))
+    if hospital is not None:
+        publish_hospital_from_thread(hospital, hospital_seq)
+    live_trips.close(trip_id)
+    fleet.ambulances.finish(row.ambulance_id)
     return {"status": "Arrived"}
 
-@app.get("/trips/{trip_id}/events")
-def get_trip_events(trip_id: int, current_user: models.User = Depends(auth.get_current_user), db: Session = Depends(get_db)):
-    return db.query(models.TripEvent).filter(models.TripEvent.trip_id == trip_id).order_by(models.TripEvent.ts).all()
+@app.post("/trips/{trip_id}/cancel")
+def cancel_trip(trip_id: int, current_user: auth.Principal = Depends(auth.get_current_ambulance_driver), db: Session = Depends(get_db)):
+    row = db.execute(
+        update(models.Trip)
+        .where(models.Trip.id == trip_id, models.Trip.status.in_(dashboard.OPEN_STATUSES))
+        .values(status="CANCELLED")
+        .returning(*models.Trip.__table__.columns)
+        .execution_options(synchronize_session=False)
+    ).first()
+    if row is None:
+        if db.get(models.Trip, trip_id) is None:
+            raise HTTPException(status_code=404, detail="Trip not found")
+        raise HTTPException(status_code=409, detail="Trip is no longer active")
+
+    db.execute(
+        update(models.Incident)
+        .where(models.Incident.id == row.incident_id)
+        .values(status="CANCELLED")
+        .execution_options(synchronize_session=False)
+    )
+    db.add(models.TripEvent(trip_id=trip_id, event_type="CANCELLED", message="Trip cancelled."))
+    hospital = beds.settle(db, trip_id, "RELEASED")
+    seq = dashboard.next_seq(db, row.selected_hospital_id)
+    hospital_seq = dashboard.next_seq(db, row.selected_hospital_id) if hospital is not None else None
+    db.commit()
+    publish_delta_from_thread(row.selected_hospital_id, seq, trip_delta(row.selected_hospital_id, seq, row))
+    if hospital is not None:
+        publish_hospital_from_thread(hospital, hospital_seq)
+    live_trips.close(trip_id)
+    fleet.ambulances.finish(row.ambulance_id)
+    return {"status": "Cancelled"}
+
+@app.get("/trips/{trip_id}/events", response_model=List[schemas.TripEventResponse])
+def get_trip_events(
+    trip_id: int,
+    after_id: Optional[int] = None,
+    since: Optional[datetime] = None,
+    limit: int = Query(PAGE_SIZE_DEFAULT * 4, ge=1, le=PAGE_SIZE_MAX),
+    current_user: auth.Principal = Depends(auth.get_current_user),
+    db: Session = Depends(get_read_db)
+):
+    # Events are append-only, so id order is time order; pass the last seen id to get only newer ones
+    query = db.query(models.TripEvent).filter(models.TripEvent.trip_id == trip_id)
+    if after_id is not None:
+        query = query.filter(models.TripEvent.id > after_id)
+    if since is not None:
+        query = query.filter(models.TripEvent.ts > since)
+    return query.order_by(models.TripEvent.id).limit(limit).all()
 
 # WebSocket Manager
-class ConnectionManager:
-    def __init__(self):
-        # group_id -> list of websockets (group_id can be "hospital_1" or "trip_1")
-        self.active_connections: dict[str, List[WebSocket]] = {}
+manager = realtime.ConnectionManager(pubsub.create_broker())
+metrics.Gauge("prana_ws_connections", "Open WebSockets on this worker.", ("kind",), manager.connections_by_kind)
+feed = dashboard.DeltaFeed(manager)
 
-    async def connect(self, websocket: WebSocket, group_id: str):
-        await websocket.accept()
-        if group_id not in self.active_connections:
-            self.active_connections[group_id] = []
-        self.active_connections[group_id].append(websocket)
-
-    def disconnect(self, websocket: WebSocket, group_id: str):
-        if group_id in self.active_connections:
-            self.active_connections[group_id].remove(websocket)
-            if not self.active_connections[group_id]:
-                del self.active_connections[group_id]
-
-    async def broadcast_to_group(self, message: str, group_id: str):
-        if group_id in self.active_connections:
-            for connection in self.active_connections[group_id]:
-                try:
-                    await connection.send_text(message)
-                except Exception:
-                    # Handle disconnected cliens silently
-                    pass
-
-manager = ConnectionManager()
+def trip_delta(hospital_id: int, seq: int, trip) -> str:
+    payload = dashboard.trip_payload(trip)
+    live_eta = live_trips.eta_for(payload["id"])
+    if live_eta is not None:
+        payload["eta_minutes"] = live_eta
+    return dashboard.delta_message(hospital_id, seq, trip=payload)
+
+def publish_delta_from_thread(hospital_id: int, seq: int, message: str):
+    # Sync endpoints run in the threadpool; publishing happens on the event loop
+    anyio.from_thread.run(feed.publish, hospital_id, seq, message)
+
+async def publish_hospital(hospital, seq: int):
+    """Puts a changed hospital row (bed counts or holds) into the snapshot and onto its dashboard."""
+    snapshot.hospitals.upsert(hospital)
+    await feed.publish(hospital.id, seq, dashboard.delta_message(hospital.id, seq, hospital=dashboard.hospital_payload(hospital)))
+
+def publish_hospital_from_thread(hospital, seq: int):
+    anyio.from_thread.run(publish_hospital, hospital, seq)
+
+async def hospital_catch_up(hospital_id: int, since: Optional[int]) -> List[str]:
+    """What a (re)connecting dashboard needs first: the deltas it missed, or a snapshot."""
+    async with database.AsyncSessionLocal() as db:
+        seq = await dashboard.current_seq(db, hospital_id)
+        if since is not None:
+            missed = feed.since(hospital_id, since, seq)
+            if missed is not None:
+                return missed
+        # Read after the sequence number: deltas past it may already show in the
+        # rows, and replaying them is harmless since each carries full state
+        hospital = await db.get(models.Hospital, hospital_id)
+        trips = (await db.scalars(
+            select(models.Trip)
+            .where(models.Trip.selected_hospital_id == hospital_id, models.Trip.status.in_(dashboard.OPEN_STATUSES))
+            .order_by(models.Trip.id)
+            .limit(PAGE_SIZE_MAX)
+        )).all()
+        live_trips.overlay(trips)
+        return [dashboard.snapshot_message(hospital_id, seq, hospital, trips)]
 
 @app.websocket("/ws/hospital/{hospital_id}")
-async def websocket_hospital_endpoint(websocket: WebSocket, hospital_id: int):
-    group_id = f"hospital_{hospital_id}"
-    await manager.connect(websocket, group_id)
+async def websocket_hospital_endpoint(websocket: WebSocket, hospital_id: int, since: Optional[int] = None, token: Optional[str] = None):
+    # Same audience as GET /trips/hospital/{id}: that hospital's staff, with their access token as ?token=
+    principal = await asyncio.to_thread(auth.principal_for_socket, token)
+    if principal is None or principal.role != "HOSPITAL_STAFF" or principal.hospital_id != hospital_id:
+        await websocket.accept()
+        await websocket.close(code=4401 if principal is None else 4403)
+        return
+    # Subscribe (held) before reading state, so no delta falls between the two
+    group_id = dashboard.group_for(hospital_id)
+    await manager.connect(websocket, group_id, hold=True)
     try:
+        manager.release(websocket, group_id, await hospital_catch_up(hospital_id, since))
         while True:
             data = await websocket.receive_text()
-            # In a real app, hospitals might send ping/pong. Here we just keep connection open.
+            # Any frame (normally the pong to our heartbeat ping) proves the socket is alive
+            manager.touch(websocket, group_id)
     except WebSocketDisconnect:
+        pass
+    finally:
         manager.disconnect(websocket, group_id)
 
 @app.websocket("/ws/trip/{trip_id}")
@@ -241,19 +619,35 @@ async def websocket_trip_endpoint(websocket: WebSocket, trip_id: int):
     try:
         while True:
             data = await websocket.receive_text()
+            manager.touch(websocket, group_id)
             # Could receive real-time location updates from driver here
             import json
             try:
                 msg = json.loads(data)
                 if msg.get("type") == "eta_update":
-                    # Broadcast to hospital channel too
-                    db = database.SessionLocal()
-                    trip = db.query(models.Trip).filter(models.Trip.id == trip_id).first()
+                    # Applied in memory now, written to the DB by the next batched flush
+                    trip = await live_trips.load(trip_id)
+                    if trip:
+                        live_trips.update(trip, eta_minutes=float(msg["eta"]), lat=msg.get("lat"), lng=msg.get("lng"))
+                        if msg.get("lat") is not None and msg.get("lng") is not None and trip.ambulance_id is not None:
+                            fleet.ambulances.move(trip.ambulance_id, float(msg["lat"]), float(msg["lng"]))
+                        # Broadcast to hospital channel too, tagged so the dashboard knows which case it is
+                        await manager.broadcast_to_group(json.dumps({**msg, "trip_id": trip_id}), f"hospital_{trip.hospital_id}", key=f"eta_update:{trip_id}")
+                elif msg.get("type") == "position_update":
+                    # The server works out the ETA; the position reaches the DB with the next flush
+                    trip = await live_trips.load(trip_id)
                     if trip:
-                        trip.eta_minutes = msg.get("eta")
-                        db.commit()
-                        await manager.broadcast_to_group(data, f"hospital_{trip.selected_hospital_id}")
-                    db.close()
+                        lat, lng = float(msg["lat"]), float(msg["lng"])
+                        estimate = await eta_tracker.on_position(trip, lat, lng)
+                        if estimate is None:
+                            continue
+                        eta, source = estimate
+                        live_trips.update(trip, eta_minutes=eta, lat=lat, lng=lng)
+                        if trip.ambulance_id is not None:
+                            fleet.ambulances.move(trip.ambulance_id, lat, lng)
+                        update_msg = json.dumps({"type": "eta_update", "trip_id": trip_id, "eta": eta, "lat": lat, "lng": lng, "source": source})
+                        await manager.broadcast_to_group(update_msg, f"hospital_{trip.hospital_id}", key=f"eta_update:{trip_id}")
+                        await manager.broadcast_to_group(update_msg, group_id, key=f"eta_update:{trip_id}")
             except Exception as e:
                 pass
     except WebSocketDisconnect:
@@ -0,0 +1,277 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter as StackCounter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import event
+
+# In-process metrics in the Prometheus text format, served at GET /metrics.
+# Each metric is a dict of label values -> number behind one lock, so an
+# observation costs about a microsecond. METRICS_ENABLED=0 turns every
+# observation into a no-op.
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+EVENT_LOOP_LAG_INTERVAL_S = float(os.getenv("EVENT_LOOP_LAG_INTERVAL_S", "0.5"))
+# The sampling profiler endpoints only exist with PROFILER_ENABLED=1; sampling
+# itself still has to be started at runtime (POST /debug/profiler/start).
+PROFILER_ENABLED = os.getenv("PROFILER_ENABLED", "0") == "1"
+PROFILER_INTERVAL_MS = float(os.getenv("PROFILER_INTERVAL_MS", "10"))
+PROFILER_MAX_SECONDS = float(os.getenv("PROFILER_MAX_SECONDS", "300"))
+
+LATENCY_BUCKETS_S = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64, 128)
+
+Labels = Tuple[str, ...]
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (), source: Optional[Callable[[], Dict[Labels, float]]] = None):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        # Metrics with a source are read from another object at scrape time
+        self.source = source
+        self.values: Dict[Labels, float] = {}
+        self._lock = threading.Lock()
+        registry.append(self)
+
+    def samples(self) -> Iterator[Tuple[str, Labels, Tuple[str, ...], float]]:
+        values = self.source() if self.source is not None else dict(self.values)
+        for label_values, value in values.items():
+            yield self.name, self.labels, label_values, value
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *label_values: str, amount: float = 1.0):
+        if not METRICS_ENABLED:
+            return
+        with self._lock:
+            self.values[label_values] = self.values.get(label_values, 0.0) + amount
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value: float, *label_values: str):
+        if not METRICS_ENABLED:
+            return
+        with self._lock:
+            self.values[label_values] = value
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = LATENCY_BUCKETS_S):
+        super().__init__(name, help, labels)
+        self.buckets = buckets
+        # label values -> [count per bucket..., count above the last bucket, sum]
+        self.series: Dict[Labels, List[float]] = {}
+
+    def observe(self, value: float, *label_values: str):
+        if not METRICS_ENABLED:
+            return
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[i] += 1
+            series[-1] += value
+
+    @contextmanager
+    def time(self, *label_values: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *label_values)
+
+    def samples(self):
+        with self._lock:
+            snapshot = {label_values: list(series) for label_values, series in self.series.items()}
+        labels = self.labels + ("le",)
+        for label_values, series in snapshot.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                yield f"{self.name}_bucket", labels, label_values + (_format(bound),), cumulative
+            cumulative += series[-2]
+            yield f"{self.name}_bucket", labels, label_values + ("+Inf",), cumulative
+            yield f"{self.name}_sum", self.labels, label_values, series[-1]
+            yield f"{self.name}_count", self.labels, label_values, cumulative
+
+registry: List[Metric] = []
+
+def _format(value: float) -> str:
+    return repr(float(value)) if value != int(value) else f"{int(value)}.0"
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def render() -> str:
+    """Every registered metric in the Prometheus text exposition format."""
+    lines = []
+    for metric in registry:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for name, labels, label_values, value in metric.samples():
+            if labels:
+                pairs = ",".join(f'{label}="{_escape(v)}"' for label, v in zip(labels, label_values))
+                name = f"{name}{{{pairs}}}"
+            lines.append(f"{name} {value:.17g}")
+    return "\n".join(lines) + "\n"
+
+# cache name -> its stats() (hits, misses, size), read at scrape time
+_caches: Dict[str, Callable[[], dict]] = {}
+
+def register_cache(cache: str, stats: Callable[[], dict]):
+    _caches[cache] = stats
+
+def _cache_field(field: str) -> Callable[[], Dict[Labels, float]]:
+    return lambda: {(cache,): stats()[field] for cache, stats in _caches.items()}
+
+def group_kind(group_id: str) -> str:
+    # "hospital_3" -> "hospital"; one series per kind rather than per socket group
+    return group_id.split("_", 1)[0]
+
+HTTP_REQUEST_SECONDS = Histogram("prana_http_request_seconds", "HTTP request latency by route template.", ("method", "route", "status"))
+DB_QUERY_SECONDS = Histogram("prana_db_query_seconds", "Time per SQL statement.", ("engine",))
+DB_QUERIES_PER_REQUEST = Histogram("prana_db_queries_per_request", "SQL statements issued per HTTP request.", ("route",), COUNT_BUCKETS)
+DB_SECONDS_PER_REQUEST = Histogram("prana_db_seconds_per_request", "Time spent in SQL per HTTP request.", ("route",))
+EVENT_LOOP_LAG_SECONDS = Histogram("prana_event_loop_lag_seconds", "How late the event loop woke a sleeping task.")
+CACHE_HITS = Counter("prana_cache_hits_total", "Cache lookups served from the cache.", ("cache",), _cache_field("hits"))
+CACHE_MISSES = Counter("prana_cache_misses_total", "Cache lookups that missed.", ("cache",), _cache_field("misses"))
+CACHE_ENTRIES = Gauge("prana_cache_entries", "Entries held by a cache.", ("cache",), _cache_field("size"))
+
+class _DbUsage:
+    __slots__ = ("queries", "seconds")
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+
+# Set per HTTP request by MetricsMiddleware; threadpool endpoints inherit it
+_db_usage: ContextVar[Optional[_DbUsage]] = ContextVar("prana_db_usage", default=None)
+
+def instrument_engine(sync_engine, name: str):
+    """Times every statement on the engine and charges it to the current request."""
+    if not METRICS_ENABLED:
+        return
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info["prana_query_start"] = time.perf_counter()
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["prana_query_start"]
+        DB_QUERY_SECONDS.observe(elapsed, name)
+        usage = _db_usage.get()
+        if usage is not None:
+            usage.queries += 1
+            usage.seconds += elapsed
+
+class MetricsMiddleware:
+    """ASGI middleware recording latency and SQL cost per route template."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        usage = _DbUsage()
+        token = _db_usage.set(usage)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - start
+            _db_usage.reset(token)
+            # The router stores the matched route in the scope; unmatched paths share one series
+            route = getattr(scope.get("route"), "path", "unmatched")
+            HTTP_REQUEST_SECONDS.observe(elapsed, scope["method"], route, str(status))
+            DB_QUERIES_PER_REQUEST.observe(usage.queries, route)
+            DB_SECONDS_PER_REQUEST.observe(usage.seconds, route)
+
+async def monitor_event_loop(interval_s: float = EVENT_LOOP_LAG_INTERVAL_S):
+    """Sleeps in a loop and records how much later than asked each wakeup came."""
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval_s)
+        EVENT_LOOP_LAG_SECONDS.observe(max(0.0, loop.time() - start - interval_s))
+
+class SamplingProfiler:
+    """
+    Samples every thread's Python stack from a background thread while
+    running. Results are collapsed stacks ("outer;inner count" lines), the
+    input format of flamegraph.pl and speedscope.
+    """
+
+    def __init__(self):
+        self.stacks: StackCounter = StackCounter()
+        self.samples = 0
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, seconds: float, interval_ms: float = PROFILER_INTERVAL_MS) -> bool:
+        """Starts a fresh profile that stops by itself after `seconds`; False if one is running."""
+        with self._lock:
+            if self.running:
+                return False
+            self.stacks = StackCounter()
+            self.samples = 0
+            self._stop.clear()
+            deadline = time.monotonic() + min(seconds, PROFILER_MAX_SECONDS)
+            self._thread = threading.Thread(target=self._run, args=(interval_ms / 1000.0, deadline), name="prana-profiler", daemon=True)
+            self._thread.start()
+            return True
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self, interval_s: float, deadline: float):
+        me = threading.get_ident()
+        names = {}
+        while not self._stop.wait(interval_s) and time.monotonic() < deadline:
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+profiler = SamplingProfiler()
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, Boolean, ForeignKey, DateTime
+from sqlalchemy import Column, Integer, String, Float, Boolean, ForeignKey, DateTime, Index
 from sqlalchemy.orm import relationship
 import datetime
 from database import Base
@@ -21,6 +21,9 @@ class Hospital(Base):
     lng = Column(Float)
     icu_beds = Column(Integer, default=0)
     general_beds = Column(Integer, default=0)
+    # Beds held for ambulances on their way (see beds.py); free = beds - reserved
+    icu_reserved = Column(Integer, default=0, server_default="0", nullable=False)
+    general_reserved = Column(Integer, default=0, server_default="0", nullable=False)
     affordability_tier = Column(Integer, default=2) # 1, 2, 3
     rating = Column(Float, default=3.0) # 1.0 - 5.0
     has_cardiology = Column(Boolean, default=False)
@@ -32,9 +35,12 @@ class Ambulance(Base):
     __tablename__ = "ambulances"
 
     id = Column(Integer, primary_key=True, index=True)
-    driver_user_id = Column(Integer, ForeignKey("users.id"))
+    driver_user_id = Column(Integer, ForeignKey("users.id"), index=True)
     current_lat = Column(Float)
     current_lng = Column(Float)
+    # Set by POST /incidents/{id}/assign until POST /trips confirms the unit or the hold lapses
+    held_for_incident_id = Column(Integer, nullable=True)
+    held_until = Column(DateTime, nullable=True)
 
 class Incident(Base):
     __tablename__ = "incidents"
@@ -61,7 +67,14 @@ class Trip(Base):
     eta_minutes = Column(Float)
     distance_km = Column(Float)
     signal_priority_active = Column(Boolean, default=False)
-    status = Column(String, default="DISPATCHED") # DISPATCHED, ACKNOWLEDGED, ARRIVED
+    status = Column(String, default="DISPATCHED") # DISPATCHED, ACKNOWLEDGED, ARRIVED, CANCELLED
+
+    # Dashboard listings filter on hospital/ambulance (optionally status) and page by id
+    __table_args__ = (
+        Index("ix_trips_hospital_id", "selected_hospital_id", "id"),
+        Index("ix_trips_hospital_status_id", "selected_hospital_id", "status", "id"),
+        Index("ix_trips_ambulance_id", "ambulance_id", "id"),
+    )
 
 class TripEvent(Base):
     __tablename__ = "trip_events"
@@ -72,12 +85,58 @@ class TripEvent(Base):
     event_type = Column(String)
     message = Column(String)
 
+    __table_args__ = (
+        Index("ix_trip_events_trip_id", "trip_id", "id"),
+    )
+
 class HospitalAction(Base):
     __tablename__ = "hospital_actions"
 
     id = Column(Integer, primary_key=True, index=True)
-    trip_id = Column(Integer, ForeignKey("trips.id"))
+    trip_id = Column(Integer, ForeignKey("trips.id"), index=True)
     ts = Column(DateTime, default=datetime.datetime.utcnow)
     action_type = Column(String)
     message = Column(String)
     by_user_id = Column(Integer, ForeignKey("users.id"))
+
+class HospitalFeed(Base):
+    __tablename__ = "hospital_feed"
+
+    # Last dashboard delta sequence number of the hospital; bumped in the same
+    # transaction as every change its dashboard is told about
+    hospital_id = Column(Integer, ForeignKey("hospitals.id"), primary_key=True)
+    seq = Column(Integer, default=0)
+
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_keys"
+
+    # Response of the first request sent with an Idempotency-Key, replayed to retries
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"))
+    scope = Column(String)  # endpoint, e.g. "POST /incidents"
+    key = Column(String)
+    request_hash = Column(String)
+    response = Column(String)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow, index=True)
+
+    __table_args__ = (
+        Index("ix_idempotency_keys_user_scope_key", "user_id", "scope", "key", unique=True),
+    )
+
+class BedReservation(Base):
+    __tablename__ = "bed_reservations"
+
+    id = Column(Integer, primary_key=True, index=True)
+    trip_id = Column(Integer, ForeignKey("trips.id"))
+    hospital_id = Column(Integer, ForeignKey("hospitals.id"))
+    bed_type = Column(String)  # icu, general
+    status = Column(String, default="HELD")  # HELD, COMMITTED, RELEASED, EXPIRED
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    expires_at = Column(DateTime)
+    settled_at = Column(DateTime, nullable=True)
+
+    # One reservation per trip; the sweeper scans held reservations by expiry
+    __table_args__ = (
+        Index("ix_bed_reservations_trip_id", "trip_id", unique=True),
+        Index("ix_bed_reservations_status_expires_at", "status", "expires_at"),
+    )
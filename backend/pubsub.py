@@ -0,0 +1,217 @@
+import asyncio
+import json
+import os
+from abc import ABC, abstractmethod
+from typing import Awaitable, Callable, Optional, Set
+from urllib.parse import urlparse
+
+# Where WebSocket group messages travel between workers:
+#   memory://               single process (default)
+#   redis://host:6379/0     Redis pub/sub (needs the optional `redis` package)
+#   tcp://127.0.0.1:7788    line-based relay hub; the first worker to bind the
+#                           port hosts it, so it works offline with no extra service
+PUBSUB_URL = os.getenv("PUBSUB_URL", "memory://")
+PUBSUB_CHANNEL = os.getenv("PUBSUB_CHANNEL", "prana:ws")
+PUBSUB_RECONNECT_S = float(os.getenv("PUBSUB_RECONNECT_S", "1.0"))
+# Reconnect delays double after each failure up to this cap
+PUBSUB_MAX_BACKOFF_S = float(os.getenv("PUBSUB_MAX_BACKOFF_S", "30"))
+# A publish whose bytes the hub doesn't take within this long drops the connection
+PUBSUB_SEND_TIMEOUT_S = float(os.getenv("PUBSUB_SEND_TIMEOUT_S", "5.0"))
+MAX_LINE_BYTES = 16 * 1024 * 1024
+
+Deliver = Callable[[str, str, Optional[str]], Awaitable[None]]
+
+def _encode(group_id: str, message: str, key: Optional[str]) -> str:
+    return json.dumps({"group": group_id, "message": message, "key": key})
+
+def _decode(raw) -> tuple:
+    envelope = json.loads(raw)
+    return envelope["group"], envelope["message"], envelope.get("key")
+
+class Broker(ABC):
+    """Carries group messages to every worker; each worker delivers to its own sockets."""
+
+    @abstractmethod
+    async def start(self, deliver: Deliver):
+        # Subclasses call this first to keep the delivery callback
+        self.deliver = deliver
+
+    @abstractmethod
+    async def publish(self, group_id: str, message: str, key: Optional[str] = None):
+        ...
+
+    @abstractmethod
+    async def stop(self):
+        ...
+
+class InProcessBroker(Broker):
+    async def start(self, deliver: Deliver):
+        await super().start(deliver)
+
+    async def publish(self, group_id: str, message: str, key: Optional[str] = None):
+        await self.deliver(group_id, message, key)
+
+    async def stop(self):
+        pass
+
+class RedisBroker(Broker):
+    def __init__(self, url: str, channel: str = PUBSUB_CHANNEL):
+        self.url = url
+        self.channel = channel
+        self._redis = None
+        self._listener: Optional[asyncio.Task] = None
+
+    async def start(self, deliver: Deliver):
+        await super().start(deliver)
+        try:
+            import redis.asyncio as redis
+        except ImportError:
+            raise RuntimeError("PUBSUB_URL uses redis:// but the `redis` package is not installed")
+        self._redis = redis.from_url(self.url)
+        pubsub = self._redis.pubsub()
+        await pubsub.subscribe(self.channel)
+        self._listener = asyncio.create_task(self._listen(pubsub))
+
+    async def _listen(self, pubsub):
+        delay = PUBSUB_RECONNECT_S
+        while True:
+            try:
+                if pubsub is None:
+                    pubsub = self._redis.pubsub()
+                    await pubsub.subscribe(self.channel)
+                    print("Redis pub/sub resubscribed")
+                    delay = PUBSUB_RECONNECT_S
+                async for item in pubsub.listen():
+                    if item.get("type") != "message":
+                        continue
+                    try:
+                        await self.deliver(*_decode(item["data"]))
+                    except Exception as e:
+                        print(f"Pub/sub delivery failed: {str(e)}")
+                raise ConnectionError("subscription ended")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Messages published meanwhile are lost; dashboards resync from their sequence gap
+                print(f"Redis pub/sub listener failed, resubscribing in {delay:.1f}s: {str(e)}")
+            if pubsub is not None:
+                try:
+                    await pubsub.aclose()
+                except Exception:
+                    pass
+                pubsub = None
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, PUBSUB_MAX_BACKOFF_S)
+
+    async def publish(self, group_id: str, message: str, key: Optional[str] = None):
+        await self._redis.publish(self.channel, _encode(group_id, message, key))
+
+    async def stop(self):
+        if self._listener is not None:
+            self._listener.cancel()
+        if self._redis is not None:
+            await self._redis.aclose()
+
+class SocketBroker(Broker):
+    """
+    Relays newline-delimited envelopes through a hub on a local TCP port. Every
+    worker tries to bind the port at startup; the one that wins hosts the hub
+    and all of them (itself included) connect to it as clients. If the hub's
+    worker goes away the others reconnect and one of them takes over.
+    """
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self._hub: Optional[asyncio.AbstractServer] = None
+        self._peers: Set[asyncio.StreamWriter] = set()
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._client: Optional[asyncio.Task] = None
+        self._connected = asyncio.Event()
+
+    async def start(self, deliver: Deliver):
+        await super().start(deliver)
+        await self._try_host_hub()
+        self._client = asyncio.create_task(self._client_loop())
+        try:
+            await asyncio.wait_for(self._connected.wait(), timeout=PUBSUB_RECONNECT_S * 5)
+        except asyncio.TimeoutError:
+            print(f"Pub/sub hub at {self.host}:{self.port} not reachable yet; delivering locally")
+
+    async def _try_host_hub(self):
+        try:
+            self._hub = await asyncio.start_server(self._serve_peer, self.host, self.port, limit=MAX_LINE_BYTES)
+        except OSError:
+            self._hub = None  # another worker hosts it
+
+    async def _serve_peer(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._peers.add(writer)
+        try:
+            while line := await reader.readline():
+                for peer in list(self._peers):
+                    try:
+                        # A peer that stopped reading is dropped rather than buffered for without bound
+                        if peer.transport.get_write_buffer_size() > MAX_LINE_BYTES:
+                            raise ConnectionError("peer is not reading")
+                        peer.write(line)
+                    except Exception:
+                        self._peers.discard(peer)
+                        peer.close()
+        except (asyncio.CancelledError, ConnectionError, ValueError):
+            pass
+        finally:
+            self._peers.discard(writer)
+            writer.close()
+
+    async def _client_loop(self):
+        while True:
+            try:
+                reader, writer = await asyncio.open_connection(self.host, self.port, limit=MAX_LINE_BYTES)
+                self._writer = writer
+                self._connected.set()
+                while line := await reader.readline():
+                    try:
+                        await self.deliver(*_decode(line))
+                    except Exception as e:
+                        print(f"Pub/sub delivery failed: {str(e)}")
+            except (OSError, ValueError):
+                pass
+            self._writer = None
+            self._connected.clear()
+            await asyncio.sleep(PUBSUB_RECONNECT_S)
+            if self._hub is None:
+                await self._try_host_hub()
+
+    async def publish(self, group_id: str, message: str, key: Optional[str] = None):
+        writer = self._writer
+        if writer is None:
+            # Hub unreachable: local sockets still get the message
+            await self.deliver(group_id, message, key)
+            return
+        writer.write((_encode(group_id, message, key) + "\n").encode())
+        try:
+            await asyncio.wait_for(writer.drain(), timeout=PUBSUB_SEND_TIMEOUT_S)
+        except (asyncio.TimeoutError, ConnectionError) as e:
+            # The client loop notices the closed connection and reconnects
+            print(f"Pub/sub publish to hub failed: {str(e) or type(e).__name__}")
+            writer.close()
+
+    async def stop(self):
+        if self._client is not None:
+            self._client.cancel()
+        if self._writer is not None:
+            self._writer.close()
+        if self._hub is not None:
+            self._hub.close()
+            for peer in list(self._peers):
+                peer.close()
+
+def create_broker(url: str = PUBSUB_URL) -> Broker:
+    parsed = urlparse(url)
+    if parsed.scheme in ("redis", "rediss"):
+        return RedisBroker(url)
+    if parsed.scheme == "tcp":
+        return SocketBroker(parsed.hostname or "127.0.0.1", parsed.port or 7788)
+    if parsed.scheme == "memory":
+        return InProcessBroker()
+    raise ValueError(f"Unsupported PUBSUB_URL: {url}")
@@ -0,0 +1,207 @@
+import asyncio
+import itertools
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from fastapi import WebSocket
+
+import metrics, pubsub
+
+# Each socket gets its own outbound buffer and sender task, so one slow
+# browser never delays the rest of its group.
+WS_SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "64"))
+WS_SEND_TIMEOUT_S = float(os.getenv("WS_SEND_TIMEOUT_S", "5.0"))
+# "drop_oldest" discards the oldest buffered message when a buffer is full;
+# "disconnect" closes the slow socket instead.
+WS_SLOW_CONSUMER_POLICY = os.getenv("WS_SLOW_CONSUMER_POLICY", "drop_oldest")
+WS_HEARTBEAT_INTERVAL_S = float(os.getenv("WS_HEARTBEAT_INTERVAL_S", "20"))
+# A socket that has sent nothing (not even a pong) for this long is half-open
+WS_HEARTBEAT_TIMEOUT_S = float(os.getenv("WS_HEARTBEAT_TIMEOUT_S", "60"))
+
+PING_MESSAGE = json.dumps({"type": "ping"})
+
+# Labelled by group kind ("hospital", "trip"), not by group, to keep the series count fixed
+WS_FANOUT_SECONDS = metrics.Histogram("prana_ws_fanout_seconds", "Time to queue one broadcast on every local socket of its group.", ("kind",))
+WS_DELIVERY_SECONDS = metrics.Histogram("prana_ws_delivery_seconds", "Time from queueing a message to finishing its send.", ("kind",))
+WS_DROPPED = metrics.Counter("prana_ws_dropped_total", "Messages discarded from a full per-socket buffer.", ("kind",))
+
+class Subscriber:
+    __slots__ = ("websocket", "group_id", "kind", "pending", "wakeup", "task", "last_seen", "dropped")
+
+    def __init__(self, websocket: WebSocket, group_id: str):
+        self.websocket = websocket
+        self.group_id = group_id
+        self.kind = metrics.group_kind(group_id)
+        # key -> (message, queued at); messages sharing a key are coalesced to the latest one
+        self.pending: OrderedDict = OrderedDict()
+        self.wakeup = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+        self.last_seen = time.monotonic()
+        self.dropped = 0
+
+class ConnectionManager:
+    def __init__(self, broker: Optional[pubsub.Broker] = None):
+        # group_id -> {websocket: subscriber} (group_id can be "hospital_1" or "trip_1")
+        self.active_connections: Dict[str, Dict[WebSocket, Subscriber]] = {}
+        # Carries broadcasts to the sockets held by every worker, this one included
+        self.broker = broker or pubsub.InProcessBroker()
+        self._sequence = itertools.count()
+        self._heartbeat: Optional[asyncio.Task] = None
+        # Every live sender task, including ones cancelled but not yet finished
+        self._senders: Set[asyncio.Task] = set()
+        # Optional hook over every broker delivery, returning the (message, key)
+        # pairs to queue now; dashboard.DeltaFeed uses it to order deltas
+        self.delivery_filter: Optional[Callable[[str, str, Optional[str]], List[Tuple[str, Optional[str]]]]] = None
+        # group_id -> callback for groups that carry messages between workers
+        # rather than to sockets (e.g. auth's principal cache invalidations)
+        self.group_handlers: Dict[str, Callable[[str], None]] = {}
+
+    async def connect(self, websocket: WebSocket, group_id: str, hold: bool = False):
+        """
+        Accepts and subscribes the socket. With `hold`, broadcasts queue up but
+        nothing is sent until release(), so the caller can put a snapshot first.
+        """
+        await websocket.accept()
+        subscriber = Subscriber(websocket, group_id)
+        self.active_connections.setdefault(group_id, {})[websocket] = subscriber
+        if not hold:
+            self._start_sender(subscriber)
+
+    def release(self, websocket: WebSocket, group_id: str, first: List[str] = ()):
+        """Starts sending to a held socket, `first` ahead of everything queued meanwhile."""
+        subscriber = self.active_connections.get(group_id, {}).get(websocket)
+        if subscriber is None or subscriber.task is not None:
+            return
+        now = time.perf_counter()
+        for message in reversed(first):
+            key = next(self._sequence)
+            subscriber.pending[key] = (message, now)
+            subscriber.pending.move_to_end(key, last=False)
+        self._start_sender(subscriber)
+        subscriber.wakeup.set()
+
+    def _start_sender(self, subscriber: Subscriber):
+        subscriber.task = asyncio.create_task(self._send_loop(subscriber))
+        self._senders.add(subscriber.task)
+        subscriber.task.add_done_callback(self._senders.discard)
+
+    def disconnect(self, websocket: WebSocket, group_id: str):
+        group = self.active_connections.get(group_id)
+        if group is None:
+            return
+        subscriber = group.pop(websocket, None)
+        if subscriber is not None and subscriber.task is not None and subscriber.task is not asyncio.current_task():
+            subscriber.task.cancel()
+        if not group:
+            del self.active_connections[group_id]
+
+    def touch(self, websocket: WebSocket, group_id: str):
+        """Records inbound traffic; call it for every frame a socket sends."""
+        subscriber = self.active_connections.get(group_id, {}).get(websocket)
+        if subscriber is not None:
+            subscriber.last_seen = time.monotonic()
+
+    async def broadcast_to_group(self, message: str, group_id: str, key: Optional[str] = None):
+        """
+        Publishes `message` to the group on every worker. Sockets get it queued
+        without anyone waiting on them. Messages with the same `key` replace
+        each other while still queued (e.g. only the latest ETA of a trip is kept).
+        """
+        await self.broker.publish(group_id, message, key)
+
+    async def deliver_local(self, group_id: str, message: str, key: Optional[str] = None):
+        handler = self.group_handlers.get(group_id)
+        if handler is not None:
+            handler(message)
+        elif self.delivery_filter is not None:
+            self.offer_group(group_id, self.delivery_filter(group_id, message, key))
+        else:
+            self.offer_group(group_id, [(message, key)])
+
+    def offer_group(self, group_id: str, messages: List[Tuple[str, Optional[str]]]):
+        if not messages:
+            return
+        start = time.perf_counter()
+        for subscriber in list(self.active_connections.get(group_id, {}).values()):
+            for message, key in messages:
+                self._offer(subscriber, message, key)
+        WS_FANOUT_SECONDS.observe(time.perf_counter() - start, metrics.group_kind(group_id))
+
+    def connection_count(self) -> int:
+        return sum(len(group) for group in self.active_connections.values())
+
+    def connections_by_kind(self) -> Dict[tuple, float]:
+        counts: Dict[tuple, float] = {}
+        for group_id, group in list(self.active_connections.items()):
+            kind = (metrics.group_kind(group_id),)
+            counts[kind] = counts.get(kind, 0) + len(group)
+        return counts
+
+    def _offer(self, subscriber: Subscriber, message: str, key: Optional[str]):
+        entry = (message, time.perf_counter())
+        if key is not None and key in subscriber.pending:
+            subscriber.pending[key] = entry
+            return
+        if len(subscriber.pending) >= WS_SEND_QUEUE_SIZE:
+            if WS_SLOW_CONSUMER_POLICY == "disconnect":
+                asyncio.create_task(self._drop(subscriber))
+                return
+            subscriber.pending.popitem(last=False)
+            subscriber.dropped += 1
+            WS_DROPPED.inc(subscriber.kind)
+        subscriber.pending[key if key is not None else next(self._sequence)] = entry
+        subscriber.wakeup.set()
+
+    async def _send_loop(self, subscriber: Subscriber):
+        try:
+            while True:
+                await subscriber.wakeup.wait()
+                subscriber.wakeup.clear()
+                while subscriber.pending:
+                    _, (message, queued_at) = subscriber.pending.popitem(last=False)
+                    await asyncio.wait_for(subscriber.websocket.send_text(message), WS_SEND_TIMEOUT_S)
+                    WS_DELIVERY_SECONDS.observe(time.perf_counter() - queued_at, subscriber.kind)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # Send failed or timed out: the socket is dead or hopelessly slow
+            await self._drop(subscriber)
+
+    async def _drop(self, subscriber: Subscriber):
+        self.disconnect(subscriber.websocket, subscriber.group_id)
+        try:
+            await subscriber.websocket.close()
+        except Exception:
+            pass
+
+    async def _heartbeat_loop(self):
+        while True:
+            await asyncio.sleep(WS_HEARTBEAT_INTERVAL_S)
+            now = time.monotonic()
+            for group in list(self.active_connections.values()):
+                for subscriber in list(group.values()):
+                    if now - subscriber.last_seen > WS_HEARTBEAT_TIMEOUT_S:
+                        await self._drop(subscriber)
+                    else:
+                        self._offer(subscriber, PING_MESSAGE, "ping")
+
+    async def start(self):
+        await self.broker.start(self.deliver_local)
+        if self._heartbeat is None:
+            self._heartbeat = asyncio.create_task(self._heartbeat_loop())
+
+    async def stop(self):
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+            self._heartbeat = None
+        await self.broker.stop()
+        for group in list(self.active_connections.values()):
+            for subscriber in list(group.values()):
+                await self._drop(subscriber)
+        # Let the cancelled sender tasks finish before the loop goes away. A send
+        # to a closing socket can sit in the close handshake, so don't wait forever.
+        if self._senders:
+            await asyncio.wait(list(self._senders), timeout=WS_SEND_TIMEOUT_S)
@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import Optional, List
 from datetime import datetime
 
@@ -31,11 +31,36 @@ class HospitalBase(BaseModel):
 class HospitalCreate(HospitalBase):
     pass
 
+class HospitalDetailsUpdate(BaseModel):
+    # Everything but bed counts, which only change through PATCH /hospitals/{id}/capacity
+    name: str
+    lat: float
+    lng: float
+    affordability_tier: int
+    rating: float
+    has_cardiology: bool
+    has_trauma: bool
+    has_neurology: bool
+    has_pulmonology: bool
+    class Config:
+        extra = "forbid"
+
 class HospitalResponse(HospitalBase):
     id: int
+    icu_reserved: int = 0
+    general_reserved: int = 0
     class Config:
         from_attributes = True
 
+class HospitalCapacityUpdate(BaseModel):
+    # Unoccupied beds, counting the ones held for dispatched trips (*_reserved in
+    # HospitalResponse), so never fewer than are held. Either absolute counts or
+    # deltas applied atomically (e.g. -1 on admission, +1 on discharge).
+    icu_beds: Optional[int] = None
+    general_beds: Optional[int] = None
+    icu_delta: Optional[int] = None
+    general_delta: Optional[int] = None
+
 class AmbulanceBase(BaseModel):
     driver_user_id: int
     current_lat: float
@@ -63,6 +88,14 @@ class IncidentResponse(IncidentCreate):
     class Config:
         from_attributes = True
 
+class BatchMatchRequest(BaseModel):
+    incident_ids: List[int]
+    spread: bool = True
+    top_k: int = Field(3, ge=1, le=10)
+
+class BatchAssignRequest(BaseModel):
+    incident_ids: List[int]
+
 class TripCreate(BaseModel):
     incident_id: int
     ambulance_id: int
@@ -82,6 +115,15 @@ class TripResponse(BaseModel):
     class Config:
         from_attributes = True
 
+class TripEventResponse(BaseModel):
+    id: int
+    trip_id: int
+    ts: datetime
+    event_type: str
+    message: Optional[str] = None
+    class Config:
+        from_attributes = True
+
 class AuthResponse(BaseModel):
     access_token: str
     token_type: str
@@ -0,0 +1,194 @@
+import asyncio
+import os
+import threading
+from dataclasses import dataclass, fields
+from typing import Dict, List, Optional
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+import models, spatial
+from engine import HospitalColumns, route_cache
+
+# Matching only routes and scores the MATCH_CANDIDATES hospitals nearest the
+# incident, widening the search until that many have free beds.
+MATCH_CANDIDATES = int(os.getenv("MATCH_CANDIDATES", "25"))
+SPATIAL_CELL_DEG = float(os.getenv("SPATIAL_CELL_DEG", "0.05"))
+# Other workers' hospital edits are picked up by a periodic reload.
+SNAPSHOT_REFRESH_S = float(os.getenv("SNAPSHOT_REFRESH_S", "30"))
+
+@dataclass(frozen=True, slots=True)
+class HospitalRecord:
+    id: int
+    name: str
+    lat: float
+    lng: float
+    icu_beds: int
+    general_beds: int
+    icu_reserved: int
+    general_reserved: int
+    affordability_tier: int
+    rating: float
+    has_cardiology: bool
+    has_trauma: bool
+    has_neurology: bool
+    has_pulmonology: bool
+
+    @classmethod
+    def from_orm(cls, hospital: models.Hospital) -> "HospitalRecord":
+        return cls(**{field: getattr(hospital, field) for field in cls.__dataclass_fields__})
+
+# Every dispatch, arrival and sweep changes these; anything else about a hospital rarely changes
+BED_FIELDS = ("icu_beds", "general_beds", "icu_reserved", "general_reserved")
+_LAYOUT_FIELDS = tuple(f.name for f in fields(HospitalRecord) if f.name not in BED_FIELDS)
+
+def _layout(record: HospitalRecord) -> tuple:
+    return tuple(getattr(record, field) for field in _LAYOUT_FIELDS)
+
+class _SnapshotState:
+    """
+    Immutable view of every hospital. Bed-count changes get a copy with just
+    those rows patched (see with_beds); anything else rebuilds it wholesale.
+    """
+
+    __slots__ = ("version", "capacity_version", "records", "by_id", "positions", "columns", "index")
+
+    def __init__(self, version: int, records: List[HospitalRecord], capacity_version: int = 0):
+        self.version = version
+        self.capacity_version = capacity_version
+        self.records = sorted(records, key=lambda r: r.id)
+        self.by_id = {r.id: r for r in self.records}
+        self.positions = {r.id: i for i, r in enumerate(self.records)}
+        self.columns = HospitalColumns(self.records)
+        self.index = spatial.GridIndex(cell_deg=SPATIAL_CELL_DEG)
+        self.index.rebuild((r.id, r.lat, r.lng) for r in self.records)
+
+    def with_beds(self, records: List[HospitalRecord], capacity_version: int) -> "_SnapshotState":
+        """A copy with `records` (hospitals already here, differing only in bed counts) swapped in."""
+        positions = [self.positions[r.id] for r in records]
+        state = _SnapshotState.__new__(_SnapshotState)
+        state.version = self.version
+        state.capacity_version = capacity_version
+        state.records = list(self.records)
+        for i, record in zip(positions, records):
+            state.records[i] = record
+        state.by_id = {**self.by_id, **{r.id: r for r in records}}
+        # Nobody moved, so the positions and the spatial index carry over
+        state.positions = self.positions
+        state.columns = self.columns.replace_rows(positions, records)
+        state.index = self.index
+        return state
+
+class HospitalSnapshot:
+    """
+    Process-wide, read-optimized copy of the hospitals table. Readers grab the
+    current state without locking; writers build a new state and swap it in.
+
+    `version` moves when hospitals are added or change anything but their bed
+    counts; bed counts move `capacity_version`.
+    """
+
+    def __init__(self):
+        self._state = _SnapshotState(0, [])
+        self._write_lock = threading.Lock()
+
+    @property
+    def version(self) -> int:
+        return self._state.version
+
+    @property
+    def capacity_version(self) -> int:
+        return self._state.capacity_version
+
+    def load(self, db: Session):
+        self.replace([HospitalRecord.from_orm(h) for h in db.query(models.Hospital).order_by(models.Hospital.id).all()])
+
+    def replace(self, records: List[HospitalRecord]):
+        records = sorted(records, key=lambda r: r.id)
+        with self._write_lock:
+            state = self._state
+            if records == state.records:
+                return
+            if len(records) == len(state.records) and all(_layout(new) == _layout(old) for new, old in zip(records, state.records)):
+                self._patch_beds(state, [new for new, old in zip(records, state.records) if new != old])
+                return
+            self._forget_moved_routes(records)
+            self._state = _SnapshotState(state.version + 1, records, state.capacity_version)
+
+    def upsert(self, hospital: models.Hospital) -> HospitalRecord:
+        record = HospitalRecord.from_orm(hospital)
+        with self._write_lock:
+            state = self._state
+            old = state.by_id.get(record.id)
+            if old == record:
+                return record
+            if old is not None and _layout(old) == _layout(record):
+                self._patch_beds(state, [record])
+                return record
+            records = [r for r in state.records if r.id != record.id]
+            records.append(record)
+            self._forget_moved_routes([record])
+            self._state = _SnapshotState(state.version + 1, records, state.capacity_version)
+        return record
+
+    def _patch_beds(self, state: _SnapshotState, records: List[HospitalRecord]):
+        self._state = state.with_beds(records, state.capacity_version + 1)
+
+    def _forget_moved_routes(self, records: List[HospitalRecord]):
+        by_id = self._state.by_id
+        for record in records:
+            old = by_id.get(record.id)
+            if old is not None and (old.lat, old.lng) != (record.lat, record.lng):
+                route_cache.invalidate_destination(record.id)
+
+    def all(self) -> List[HospitalRecord]:
+        return self._state.records
+
+    def get(self, hospital_id: int) -> Optional[HospitalRecord]:
+        return self._state.by_id.get(hospital_id)
+
+    def columns(self) -> HospitalColumns:
+        """Every hospital as columns; the same object until the snapshot changes."""
+        return self._state.columns
+
+    def candidates(self, lat: float, lng: float, k: int = MATCH_CANDIDATES) -> HospitalColumns:
+        """The k nearest hospitals with free beds, topped up with the nearest others if too few have any."""
+        return self.candidates_near([(lat, lng)], k)
+
+    def candidates_near(self, points: List[tuple], k: int = MATCH_CANDIDATES) -> HospitalColumns:
+        """Union of the candidate hospitals for every (lat, lng) in `points`."""
+        state = self._state
+        chosen: Dict[int, None] = {}
+        for lat, lng in points:
+            for hospital_id in self._candidate_ids(state, lat, lng, k):
+                chosen[hospital_id] = None
+        return state.columns.take(np.array([state.positions[i] for i in chosen], dtype=np.int64))
+
+    @staticmethod
+    def _candidate_ids(state: _SnapshotState, lat: float, lng: float, k: int) -> List[int]:
+        def with_beds(hospital_id):
+            record = state.by_id[hospital_id]
+            return record.icu_beds - record.icu_reserved + record.general_beds - record.general_reserved > 0
+
+        ids = [hospital_id for _, hospital_id in state.index.nearest(lat, lng, k, predicate=with_beds)]
+        if len(ids) < k:
+            chosen = set(ids)
+            for _, hospital_id in state.index.nearest(lat, lng, k):
+                if len(ids) >= k:
+                    break
+                if hospital_id not in chosen:
+                    ids.append(hospital_id)
+        return ids
+
+hospitals = HospitalSnapshot()
+
+async def refresh_periodically(session_factory, interval_s: float = SNAPSHOT_REFRESH_S):
+    while True:
+        await asyncio.sleep(interval_s)
+        db = session_factory()
+        try:
+            await asyncio.to_thread(hospitals.load, db)
+        except Exception as e:
+            print(f"Hospital snapshot refresh failed: {str(e)}")
+        finally:
+            db.close()
@@ -0,0 +1,127 @@
+import math
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from engine import haversine
+
+KM_PER_DEG_LAT = 111.2
+
+class GridIndex:
+    """
+    Uniform lat/lng grid over point items (hospitals, ambulances).
+    Inserting or moving an item is O(1); nearest-neighbour queries scan rings
+    of cells outwards from the query point until the k closest are settled.
+    """
+
+    def __init__(self, cell_deg: float = 0.05):
+        self.cell_deg = cell_deg
+        self.cells: Dict[Tuple[int, int], Set[int]] = {}
+        self.points: Dict[int, Tuple[float, float]] = {}
+
+    def __len__(self):
+        return len(self.points)
+
+    def __contains__(self, item_id: int):
+        return item_id in self.points
+
+    def _cell(self, lat: float, lng: float) -> Tuple[int, int]:
+        return (math.floor(lat / self.cell_deg), math.floor(lng / self.cell_deg))
+
+    def upsert(self, item_id: int, lat: float, lng: float):
+        old = self.points.get(item_id)
+        new_cell = self._cell(lat, lng)
+        if old is not None:
+            old_cell = self._cell(*old)
+            if old_cell != new_cell:
+                self._discard(item_id, old_cell)
+                self.cells.setdefault(new_cell, set()).add(item_id)
+        else:
+            self.cells.setdefault(new_cell, set()).add(item_id)
+        self.points[item_id] = (lat, lng)
+
+    def remove(self, item_id: int):
+        old = self.points.pop(item_id, None)
+        if old is not None:
+            self._discard(item_id, self._cell(*old))
+
+    def _discard(self, item_id: int, cell: Tuple[int, int]):
+        members = self.cells.get(cell)
+        if members is not None:
+            members.discard(item_id)
+            if not members:
+                del self.cells[cell]
+
+    def rebuild(self, items: Iterable[Tuple[int, float, float]]):
+        self.cells = {}
+        self.points = {}
+        for item_id, lat, lng in items:
+            self.upsert(item_id, lat, lng)
+
+    def nearest(
+        self,
+        lat: float,
+        lng: float,
+        k: int,
+        max_radius_km: Optional[float] = None,
+        predicate: Optional[Callable[[int], bool]] = None
+    ) -> List[Tuple[float, int]]:
+        """
+        Returns up to k (distance_km, item_id) pairs ordered by straight-line
+        distance. Items rejected by `predicate` are skipped, so the search keeps
+        widening until k items qualify, `max_radius_km` is reached or every
+        item has been seen. Once the rings would cover more cells than are
+        occupied, the remaining occupied cells are scanned directly instead,
+        so a query far from every item (or with few qualifying ones) costs
+        O(occupied cells) rather than a ring walk out to the farthest item.
+        """
+        if k <= 0 or not self.points:
+            return []
+        center = self._cell(lat, lng)
+        # Every ring fully searched guarantees this much coverage around the point
+        ring_km = self.cell_deg * KM_PER_DEG_LAT * max(0.01, math.cos(math.radians(lat)))
+        found: List[Tuple[float, int]] = []
+        seen = 0
+        ring = 0
+
+        def visit(members):
+            nonlocal seen
+            for item_id in members:
+                seen += 1
+                if predicate is not None and not predicate(item_id):
+                    continue
+                ilat, ilng = self.points[item_id]
+                found.append((haversine(lat, lng, ilat, ilng), item_id))
+
+        while True:
+            for cell in self._ring_cells(center, ring):
+                visit(self.cells.get(cell, ()))
+            covered_km = ring * ring_km
+            found.sort()
+            if len(found) >= k and found[k - 1][0] <= covered_km:
+                break
+            if seen >= len(self.points):
+                break
+            if max_radius_km is not None and covered_km >= max_radius_km:
+                break
+            ring += 1
+            if (2 * ring + 1) ** 2 > len(self.cells):
+                for (ci, cj), members in self.cells.items():
+                    if max(abs(ci - center[0]), abs(cj - center[1])) >= ring:
+                        visit(members)
+                found.sort()
+                break
+        if max_radius_km is not None:
+            found = [f for f in found if f[0] <= max_radius_km]
+        return found[:k]
+
+    @staticmethod
+    def _ring_cells(center: Tuple[int, int], ring: int):
+        ci, cj = center
+        if ring == 0:
+            yield center
+            return
+        for dj in range(-ring, ring + 1):
+            yield (ci - ring, cj + dj)
+            yield (ci + ring, cj + dj)
+        for di in range(-ring + 1, ring):
+            yield (ci + di, cj - ring)
+            yield (ci + di, cj + ring)
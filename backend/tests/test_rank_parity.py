@@ -0,0 +1,77 @@
+"""rank_hospitals (vectorized) must rank exactly like rank_hospitals_loop."""
+import random
+
+import pytest
+
+import engine, models
+
+EMERGENCY_TYPES = ["Cardiac", "Trauma", "Stroke", "Respiratory", "General"]
+PREFERENCES = [None, 1, 2, 3]
+
+def make_hospital(hospital_id: int, rng: random.Random, **overrides) -> models.Hospital:
+    icu_beds = rng.choice([0, 0, 1, 2, 5, 20])
+    general_beds = rng.choice([0, 0, 1, 3, 50])
+    fields = dict(
+        name=f"Hospital {hospital_id}", lat=12.97, lng=77.59,
+        icu_beds=icu_beds, general_beds=general_beds,
+        # Anything from no beds held to all of them
+        icu_reserved=rng.randint(0, icu_beds), general_reserved=rng.randint(0, general_beds),
+        affordability_tier=rng.randint(1, 3), rating=rng.choice([3.0, 3.5, 4.2, 5.0]),
+        has_cardiology=rng.random() < 0.5, has_trauma=rng.random() < 0.5,
+        has_neurology=rng.random() < 0.5, has_pulmonology=rng.random() < 0.5,
+    )
+    fields.update(overrides)
+    return models.Hospital(id=hospital_id, **fields)
+
+def make_routes(count: int, rng: random.Random):
+    # Whole minutes and kilometres so equal ETAs (and so tied scores) come up often
+    return [(float(rng.randint(1, 30)), float(rng.randint(1, 70)), "osrm") for _ in range(count)]
+
+def assert_same_ranking(emergency_type, pref, hospitals, routes):
+    fast = engine.rank_hospitals(emergency_type, pref, engine.HospitalColumns(hospitals), routes)
+    slow = engine.rank_hospitals_loop(emergency_type, pref, hospitals, routes)
+    assert [m["hospital"].id for m in fast] == [m["hospital"].id for m in slow]
+    assert [m["score"] for m in fast] == pytest.approx([m["score"] for m in slow], abs=1e-9)
+    assert [m["explanation"] for m in fast] == [m["explanation"] for m in slow]
+    assert [(m["eta_min"], m["dist_km"], m["route_type"]) for m in fast] == [(m["eta_min"], m["dist_km"], m["route_type"]) for m in slow]
+
+@pytest.mark.parametrize("emergency_type", EMERGENCY_TYPES)
+@pytest.mark.parametrize("pref", PREFERENCES)
+@pytest.mark.parametrize("seed", range(20))
+def test_random_hospitals(emergency_type, pref, seed):
+    rng = random.Random(seed)
+    hospitals = [make_hospital(i + 1, rng) for i in range(rng.randint(1, 30))]
+    assert_same_ranking(emergency_type, pref, hospitals, make_routes(len(hospitals), rng))
+
+@pytest.mark.parametrize("emergency_type", EMERGENCY_TYPES)
+@pytest.mark.parametrize("pref", PREFERENCES)
+def test_ties_keep_input_order(emergency_type, pref):
+    rng = random.Random(7)
+    template = make_hospital(1, rng, icu_beds=4, general_beds=4, icu_reserved=1, general_reserved=1)
+    same = {c.name: getattr(template, c.name) for c in models.Hospital.__table__.columns if c.name != "id"}
+    hospitals = [models.Hospital(id=i, **same) for i in (5, 2, 9, 1, 7)]
+    assert_same_ranking(emergency_type, pref, hospitals, [(3.0, 12.0, "osrm")] * len(hospitals))
+
+@pytest.mark.parametrize("emergency_type", EMERGENCY_TYPES)
+@pytest.mark.parametrize("pref", PREFERENCES)
+def test_zero_and_fully_held_beds(emergency_type, pref):
+    rng = random.Random(11)
+    hospitals = [
+        make_hospital(1, rng, icu_beds=0, general_beds=0, icu_reserved=0, general_reserved=0),
+        make_hospital(2, rng, icu_beds=3, general_beds=5, icu_reserved=3, general_reserved=5),
+        make_hospital(3, rng, icu_beds=1, general_beds=0, icu_reserved=1, general_reserved=0),
+        make_hospital(4, rng, icu_beds=2, general_beds=2, icu_reserved=1, general_reserved=2),
+        make_hospital(5, rng, icu_beds=0, general_beds=6, icu_reserved=0, general_reserved=2),
+        # More held than listed, e.g. right after staff lowered the count
+        make_hospital(6, rng, icu_beds=1, general_beds=1, icu_reserved=3, general_reserved=2),
+    ]
+    assert_same_ranking(emergency_type, pref, hospitals, make_routes(len(hospitals), rng))
+
+def test_held_beds_are_not_free():
+    rng = random.Random(3)
+    held = make_hospital(1, rng, icu_beds=1, general_beds=0, icu_reserved=1, general_reserved=0)
+    free = models.Hospital(id=2, **{c.name: getattr(held, c.name) for c in models.Hospital.__table__.columns if c.name not in ("id", "icu_reserved")}, icu_reserved=0)
+    routes = [(1.0, 5.0, "osrm")] * 2
+    for ranked in (engine.rank_hospitals("Cardiac", None, engine.HospitalColumns([held, free]), routes), engine.rank_hospitals_loop("Cardiac", None, [held, free], routes)):
+        assert [m["hospital"].id for m in ranked] == [2, 1]
+        assert ranked[0]["score"] > ranked[1]["score"]
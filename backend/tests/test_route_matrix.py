@@ -0,0 +1,81 @@
+"""get_route_matrix must split /table requests into chunks and stitch them back per pair."""
+import asyncio
+import math
+from urllib.parse import parse_qs, urlsplit
+
+import httpx
+
+import engine
+
+# Origin i sits at (i, 0) and destination j at (0, j), so a request's
+# coordinates say exactly which slice of the matrix it covers.
+ORIGINS = [(float(i), 0.0) for i in range(7)]
+DESTINATIONS = [(0.0, float(j)) for j in range(12)]
+
+def fake_table(requests, failing):
+    """A /table stub answering origin i -> destination j with i * 1000 + j km, failing chunks whose first (origin, destination) is in `failing`."""
+    def handler(request: httpx.Request):
+        url = urlsplit(str(request.url))
+        coords = [tuple(map(float, c.split(","))) for c in url.path.split("/")[4].split(";")]
+        query = parse_qs(url.query)
+        sources = [coords[int(i)] for i in query["sources"][0].split(";")]
+        targets = [coords[int(i)] for i in query["destinations"][0].split(";")]
+        # OSRM coordinates are lng,lat
+        origin_ids = [int(lat) for _, lat in sources]
+        dest_ids = [int(lng) for lng, _ in targets]
+        requests.append((origin_ids, dest_ids, len(coords)))
+        if (origin_ids[0], dest_ids[0]) in failing:
+            return httpx.Response(500)
+        km = [[i * 1000 + j for j in dest_ids] for i in origin_ids]
+        return httpx.Response(200, json={
+            "code": "Ok",
+            "distances": [[d * 1000.0 for d in row] for row in km],
+            "durations": [[d * 60.0 for d in row] for row in km],
+        })
+    return handler
+
+def route_matrix(monkeypatch, failing=()):
+    requests = []
+    client = httpx.AsyncClient(base_url="http://osrm.test", transport=httpx.MockTransport(fake_table(requests, set(failing))))
+    monkeypatch.setattr(engine, "_router_client", client)
+    monkeypatch.setattr(engine, "OSRM_TABLE_MAX_COORDS", 10)
+
+    async def run():
+        try:
+            return await engine.get_route_matrix(ORIGINS, DESTINATIONS, concurrency=2)
+        finally:
+            await client.aclose()
+
+    return asyncio.run(run()), requests
+
+def test_chunks_stay_under_the_coordinate_limit(monkeypatch):
+    matrix, requests = route_matrix(monkeypatch)
+    # 10 coordinates: 5 origins and 5 destinations per request
+    assert sorted((o, d) for o, d, _ in requests) == [
+        (o, d)
+        for o in ([0, 1, 2, 3, 4], [5, 6])
+        for d in ([0, 1, 2, 3, 4], [5, 6, 7, 8, 9], [10, 11])
+    ]
+    assert all(n <= 10 for _, _, n in requests)
+    assert len(matrix) == len(ORIGINS)
+    assert all(len(row) == len(DESTINATIONS) for row in matrix)
+
+def test_pairs_map_back_to_their_origin_and_destination(monkeypatch):
+    matrix, _ = route_matrix(monkeypatch)
+    for i, row in enumerate(matrix):
+        for j, (distance_km, duration_min, route_type) in enumerate(row):
+            assert route_type == "osrm"
+            assert distance_km == i * 1000 + j
+            assert duration_min == i * 1000 + j
+
+def test_failed_chunk_falls_back_to_haversine(monkeypatch):
+    # Origins 5-6 to destinations 5-9 is one chunk
+    matrix, requests = route_matrix(monkeypatch, failing={(5, 5)})
+    assert len(requests) == 6
+    for i, row in enumerate(matrix):
+        for j, route in enumerate(row):
+            if i in (5, 6) and 5 <= j <= 9:
+                assert route[2] == "haversine"
+                assert math.isclose(route[0], engine.haversine(*ORIGINS[i], *DESTINATIONS[j]))
+            else:
+                assert route == (i * 1000 + j, i * 1000 + j, "osrm")
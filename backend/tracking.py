@@ -0,0 +1,90 @@
+import os
+import time
+from typing import Optional
+
+import engine
+from live import LiveTrip
+
+# An ambulance's GPS fixes only reach the router when it has moved
+# REROUTE_DISTANCE_M since the last route (or REROUTE_MAX_INTERVAL_S has
+# passed), and never more often than REROUTE_MIN_INTERVAL_S per trip. Fixes in
+# between are dead-reckoned from the last route.
+REROUTE_DISTANCE_M = float(os.getenv("REROUTE_DISTANCE_M", "500"))
+REROUTE_MIN_INTERVAL_S = float(os.getenv("REROUTE_MIN_INTERVAL_S", "15"))
+REROUTE_MAX_INTERVAL_S = float(os.getenv("REROUTE_MAX_INTERVAL_S", "120"))
+# A green corridor clears signals along the way; same factor the endpoint applies
+GREEN_CORRIDOR_ETA_FACTOR = 0.8
+
+class RouteFix:
+    """The last routed position of a trip and what the router said from there."""
+
+    __slots__ = ("lat", "lng", "at", "distance_km", "duration_min", "straight_km", "source")
+
+    def __init__(self, lat: float, lng: float, at: float, distance_km: float, duration_min: float, straight_km: float, source: str):
+        self.lat = lat
+        self.lng = lng
+        self.at = at
+        self.distance_km = distance_km
+        self.duration_min = duration_min
+        self.straight_km = straight_km
+        self.source = source
+
+class EtaTracker:
+    """
+    Turns ambulance position fixes into ETAs. Routes come from engine.get_route
+    (pooled client, cached per destination); between re-routes the remaining
+    time is the last route's duration scaled by how much of the straight-line
+    distance to the hospital is left, which keeps its detour and speed.
+    """
+
+    def __init__(self, hospitals):
+        self.hospitals = hospitals
+        self._routing = set()
+        self.reroutes = 0
+        self.dead_reckoned = 0
+
+    def _needs_reroute(self, fix: Optional[RouteFix], lat: float, lng: float, now: float) -> bool:
+        if fix is None:
+            return True
+        elapsed = now - fix.at
+        if elapsed < REROUTE_MIN_INTERVAL_S:
+            return False
+        moved_m = engine.haversine(fix.lat, fix.lng, lat, lng) * 1000.0
+        return moved_m >= REROUTE_DISTANCE_M or elapsed >= REROUTE_MAX_INTERVAL_S
+
+    async def on_position(self, live: LiveTrip, lat: float, lng: float, now: Optional[float] = None) -> Optional[tuple]:
+        """
+        Records the fix on the live trip and returns (eta_minutes, source), or
+        None when the trip's hospital is unknown. Only one router call per trip
+        is in flight; fixes arriving meanwhile are dead-reckoned.
+        """
+        hospital = self.hospitals.get(live.hospital_id)
+        if hospital is None:
+            return None
+        now = time.monotonic() if now is None else now
+        straight_km = engine.haversine(lat, lng, hospital.lat, hospital.lng)
+        fix = live.route
+
+        if live.trip_id not in self._routing and self._needs_reroute(fix, lat, lng, now):
+            self._routing.add(live.trip_id)
+            try:
+                distance_km, duration_min, source = await engine.get_route(lat, lng, hospital.lat, hospital.lng, dest_id=hospital.id)
+            finally:
+                self._routing.discard(live.trip_id)
+            fix = RouteFix(lat, lng, now, distance_km, duration_min, straight_km, source)
+            live.route = fix
+            self.reroutes += 1
+            eta = duration_min
+        elif fix is not None:
+            # Dead reckoning: the share of the trip still to go, by straight-line distance
+            remaining = min(1.0, straight_km / fix.straight_km) if fix.straight_km > 0 else 0.0
+            eta = fix.duration_min * remaining
+            source = "dead_reckoning"
+            self.dead_reckoned += 1
+        else:
+            # First fix while another socket of this trip is still routing it
+            _, eta, source = engine.haversine_route(lat, lng, hospital.lat, hospital.lng)
+
+        if live.signal_priority:
+            eta *= GREEN_CORRIDOR_ETA_FACTOR
+        return round(eta, 2), source
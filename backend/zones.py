@@ -0,0 +1,312 @@
+import asyncio
+import json
+import math
+import os
+import time
+from dataclasses import asdict, dataclass
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+import engine
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-worker build lock
+    fcntl = None
+
+# Precomputed zone -> hospital travel times. The service area is cut into
+# square ZONE_CELL_DEG cells (geohash-style); a background job routes every
+# zone centre to every hospital and stores the result as a (2, zones,
+# hospitals) float32 array of [distance_km, duration_min] in ZONE_MATRIX_PATH
+# (plus a .json sidecar), memory-mapped by every worker. Pairs whose /table
+# request failed are NaN and get routed again on the next refresh. Unset
+# disables it.
+ZONE_MATRIX_PATH = os.getenv("ZONE_MATRIX_PATH", "")
+ZONE_CELL_DEG = float(os.getenv("ZONE_CELL_DEG", "0.01"))
+# "lat_min,lng_min,lat_max,lng_max"; defaults to the hospitals' bounding box
+# plus ZONE_MARGIN_DEG, fixed at the first build
+ZONE_BOUNDS = os.getenv("ZONE_BOUNDS", "")
+ZONE_MARGIN_DEG = float(os.getenv("ZONE_MARGIN_DEG", "0.05"))
+# Zones routed per batch while building, to bound memory and router load
+ZONE_BUILD_BATCH = int(os.getenv("ZONE_BUILD_BATCH", "50"))
+ZONE_REFRESH_S = float(os.getenv("ZONE_REFRESH_S", "30"))
+# Matching scores every hospital from the matrix, then re-routes only this
+# many best candidates live; 0 answers from the matrix alone
+ZONE_REFINE_TOP = int(os.getenv("ZONE_REFINE_TOP", "5"))
+# Time-of-day duration multipliers, "start-end:factor" in local hours, e.g.
+# "8-11:1.4,17-21:1.3" for rush hours. OSRM durations don't vary by time.
+ZONE_PROFILES = os.getenv("ZONE_PROFILES", "")
+
+def parse_profiles(spec: str) -> List[Tuple[int, int, float]]:
+    profiles = []
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        hours, factor = part.split(":")
+        start, end = hours.split("-")
+        profiles.append((int(start), int(end), float(factor)))
+    return profiles
+
+PROFILES = parse_profiles(ZONE_PROFILES)
+
+def profile_factor(hour: Optional[int] = None) -> float:
+    hour = time.localtime().tm_hour if hour is None else hour
+    for start, end, factor in PROFILES:
+        if start <= hour < end:
+            return factor
+    return 1.0
+
+@dataclass(frozen=True)
+class ZoneGrid:
+    lat0: float
+    lng0: float
+    cell_deg: float
+    rows: int
+    cols: int
+
+    @classmethod
+    def covering(cls, points: List[Tuple[float, float]], cell_deg: float = ZONE_CELL_DEG, margin_deg: float = ZONE_MARGIN_DEG) -> "ZoneGrid":
+        if ZONE_BOUNDS:
+            lat_min, lng_min, lat_max, lng_max = (float(v) for v in ZONE_BOUNDS.split(","))
+        else:
+            lats, lngs = [p[0] for p in points], [p[1] for p in points]
+            lat_min, lat_max = min(lats) - margin_deg, max(lats) + margin_deg
+            lng_min, lng_max = min(lngs) - margin_deg, max(lngs) + margin_deg
+        rows = max(1, math.ceil((lat_max - lat_min) / cell_deg))
+        cols = max(1, math.ceil((lng_max - lng_min) / cell_deg))
+        return cls(lat_min, lng_min, cell_deg, rows, cols)
+
+    def __len__(self):
+        return self.rows * self.cols
+
+    def zone(self, lat: float, lng: float) -> Optional[int]:
+        row = math.floor((lat - self.lat0) / self.cell_deg)
+        col = math.floor((lng - self.lng0) / self.cell_deg)
+        if 0 <= row < self.rows and 0 <= col < self.cols:
+            return row * self.cols + col
+        return None
+
+    def centers(self, start: int = 0, stop: Optional[int] = None) -> List[Tuple[float, float]]:
+        stop = len(self) if stop is None else stop
+        return [
+            (self.lat0 + (z // self.cols + 0.5) * self.cell_deg, self.lng0 + (z % self.cols + 0.5) * self.cell_deg)
+            for z in range(start, stop)
+        ]
+
+class ZoneMatrix:
+    """
+    The memory-mapped matrix and the hospitals its columns belong to. A
+    refresh routes only hospitals that are new or moved since the last build
+    and swaps in a new file; readers keep whichever mapping they started with.
+    """
+
+    def __init__(self, path: str = ZONE_MATRIX_PATH):
+        self.path = path
+        self.meta_path = os.path.splitext(path)[0] + ".json"
+        self.grid: Optional[ZoneGrid] = None
+        self.data: Optional[np.ndarray] = None
+        self.coords: Dict[int, Tuple[float, float]] = {}
+        self.columns: Dict[int, int] = {}
+        # Hospitals with NaN (failed) pairs in their column
+        self.unrouted: Set[int] = set()
+        self.loaded_mtime = 0.0
+        # (HospitalColumns.ids, matrix column per row or -1) of the last lookup;
+        # keyed on the ids array, which bed-count changes leave in place
+        self._order: Tuple[object, Optional[np.ndarray]] = (None, None)
+        self.builds = 0
+
+    @property
+    def ready(self) -> bool:
+        return self.data is not None
+
+    def load(self) -> bool:
+        """Maps the file if it is newer than the one in use; False if there is none."""
+        if not self.path or not os.path.exists(self.path) or not os.path.exists(self.meta_path):
+            return False
+        mtime = os.path.getmtime(self.path)
+        if mtime == self.loaded_mtime:
+            return True
+        with open(self.meta_path) as f:
+            meta = json.load(f)
+        data = np.load(self.path, mmap_mode="r")
+        ids = meta["hospital_ids"]
+        if data.shape != (2, meta["grid"]["rows"] * meta["grid"]["cols"], len(ids)):
+            return False  # sidecar from another build; the next refresh rewrites both
+        self.grid = ZoneGrid(**meta["grid"])
+        self.coords = {hospital_id: tuple(coord) for hospital_id, coord in zip(ids, meta["coords"])}
+        self.columns = {hospital_id: i for i, hospital_id in enumerate(ids)}
+        self.unrouted = {ids[i] for i in np.flatnonzero(np.isnan(data[1]).any(axis=0))}
+        self.data = data
+        self._order = (None, None)
+        self.loaded_mtime = mtime
+        return True
+
+    def estimate(self, lat: float, lng: float, cols: engine.HospitalColumns) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """(distance_km, duration_min) arrays from the incident's zone to every hospital in `cols`; NaN where routing failed."""
+        data, grid = self.data, self.grid
+        zone = grid.zone(lat, lng) if grid is not None else None
+        if zone is None or not self.columns:
+            return None
+        cached_ids, order = self._order
+        if cached_ids is not cols.ids:
+            order = np.fromiter((self.columns.get(i, -1) for i in cols.ids.tolist()), dtype=np.int64, count=len(cols))
+            self._order = (cols.ids, order)
+        dist_km = data[0, zone, :][order].astype(np.float64)
+        duration_min = data[1, zone, :][order].astype(np.float64)
+        missing = order < 0
+        if missing.any():
+            # Hospitals added since the last build: straight-line estimate until the next refresh
+            dist_km[missing] = engine.haversine_np(lat, lng, cols.lat[missing], cols.lng[missing])
+            duration_min[missing] = dist_km[missing] / 0.66
+        return dist_km, duration_min
+
+    def stale(self, records) -> Tuple[List[Tuple[int, int]], List]:
+        """((hospital id, column) still valid, records that need routing: new, moved or with failed pairs)."""
+        keep, todo = [], []
+        for record in records:
+            if self.coords.get(record.id) == (record.lat, record.lng) and record.id not in self.unrouted:
+                keep.append((record.id, self.columns[record.id]))
+            else:
+                todo.append(record)
+        return keep, todo
+
+    async def refresh(self, records) -> int:
+        """Routes new or moved hospitals into a new file; returns how many were routed."""
+        if not records:
+            return 0
+        self.load()
+        grid = self.grid or ZoneGrid.covering([(r.lat, r.lng) for r in records])
+        keep, todo = self.stale(records) if self.grid is not None else ([], list(records))
+        if not todo and len(keep) == len(self.columns):
+            return 0
+        fresh = await route_zones(grid, [(r.lat, r.lng) for r in todo])
+        columns = [column for _, column in keep]
+        kept = np.asarray(self.data[:, :, columns]) if keep else np.empty((2, len(grid), 0), dtype=np.float32)
+        ids = [hospital_id for hospital_id, _ in keep] + [r.id for r in todo]
+        coords = {**self.coords, **{r.id: (r.lat, r.lng) for r in todo}}
+        await asyncio.to_thread(self._write, np.concatenate([kept, fresh], axis=2), grid, ids, coords)
+        self.load()
+        self.builds += 1
+        return len(todo)
+
+    def _write(self, data: np.ndarray, grid: ZoneGrid, ids: List[int], coords: Dict[int, Tuple[float, float]]):
+        # Write aside and rename, so workers never map a half-written file
+        tmp_path, tmp_meta = f"{self.path}.tmp.npy", f"{self.meta_path}.tmp"
+        np.save(tmp_path, data.astype(np.float32, copy=False))
+        with open(tmp_meta, "w") as f:
+            json.dump({"grid": asdict(grid), "hospital_ids": ids, "coords": [coords[i] for i in ids], "built_at": time.time()}, f)
+        os.replace(tmp_meta, self.meta_path)
+        os.replace(tmp_path, self.path)
+
+async def route_zones(grid: ZoneGrid, destinations: List[Tuple[float, float]]) -> np.ndarray:
+    """
+    [distance_km, duration_min] from every zone centre to each destination, a
+    batch of zones at a time. Pairs OSRM has no route for get the straight-line
+    estimate; pairs whose /table request failed are NaN.
+    """
+    out = np.empty((2, len(grid), len(destinations)), dtype=np.float32)
+    if not destinations:
+        return out
+    dest_lat = np.array([d[0] for d in destinations])
+    dest_lng = np.array([d[1] for d in destinations])
+    for start in range(0, len(grid), ZONE_BUILD_BATCH):
+        origins = grid.centers(start, min(len(grid), start + ZONE_BUILD_BATCH))
+        table = await engine.get_route_matrix(origins, destinations)
+        for offset, ((lat, lng), row) in enumerate(zip(origins, table)):
+            straight = engine.haversine_np(lat, lng, dest_lat, dest_lng)
+            out[0, start + offset] = [_cell(route, 0, straight[j]) for j, route in enumerate(row)]
+            out[1, start + offset] = [_cell(route, 1, straight[j] / 0.66) for j, route in enumerate(row)]
+    return out
+
+def _cell(route, field: int, straight: float) -> float:
+    if route is None:
+        return straight
+    # get_route_matrix estimates a failed chunk with haversine; don't store that as routed
+    return route[field] if route[2] == "osrm" else np.nan
+
+matrix = ZoneMatrix()
+
+async def match_hospitals(
+    incident_lat: float,
+    incident_lng: float,
+    emergency_type: str,
+    affordability_pref: int,
+    cols: engine.HospitalColumns,
+    refine: int = ZONE_REFINE_TOP
+) -> Optional[List[Dict]]:
+    """
+    Scores every hospital in `cols` from the matrix, then live-routes only
+    the `refine` best and ranks those. None when the matrix can't answer
+    (disabled, not built yet, or the incident is outside the grid).
+    """
+    start = time.perf_counter()
+    estimate = matrix.estimate(incident_lat, incident_lng, cols) if matrix.ready else None
+    if estimate is None:
+        return None
+    dist_km, duration_min = estimate
+    routed = ~np.isnan(duration_min)
+    if not routed.any():
+        return None
+    factor = profile_factor()
+    score, _, _ = engine.score_columns(cols, duration_min * factor, emergency_type, affordability_pref)
+    # Hospitals whose pair failed to route are left out until the next refresh fills them in
+    score = np.where(routed, score, -np.inf)
+    shortlist_idx = engine.top_k_indices(score, max(refine, engine.TOP_K))
+    shortlist_idx = shortlist_idx[routed[shortlist_idx]]
+    shortlist = cols.take(shortlist_idx)
+    if refine > 0:
+        routes = await engine.route_to_hospitals(incident_lat, incident_lng, shortlist.hospitals)
+    else:
+        routes = [(float(dist_km[i]), float(duration_min[i]), "zone") for i in shortlist_idx]
+    routes = [(distance, duration * factor, route_type) for distance, duration, route_type in routes]
+    results = engine.rank_hospitals(emergency_type, affordability_pref, shortlist, routes)
+    engine.MATCH_SECONDS.observe(time.perf_counter() - start, "zone")
+    return results
+
+def _try_lock(path: str):
+    """Non-blocking exclusive lock so only one worker builds at a time; None if another holds it."""
+    handle = open(path, "a")
+    if fcntl is None:
+        return handle
+    try:
+        fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return handle
+    except OSError:
+        handle.close()
+        return None
+
+async def refresh_periodically(snapshot, interval_s: float = ZONE_REFRESH_S):
+    """Keeps the matrix in step with the hospital snapshot; only hospitals added or moved are routed."""
+    built_for = None
+    while True:
+        try:
+            matrix.load()
+            if snapshot.version != built_for or matrix.unrouted:
+                lock = _try_lock(matrix.path + ".lock")
+                if lock is not None:
+                    try:
+                        routed = await matrix.refresh(snapshot.all())
+                        if routed:
+                            print(f"Zone matrix: routed {routed} hospitals over {len(matrix.grid)} zones")
+                    finally:
+                        lock.close()
+                    built_for = snapshot.version
+        except Exception as e:
+            print(f"Zone matrix refresh failed: {str(e)}")
+        await asyncio.sleep(interval_s)
+
+async def _build_once():
+    import database, snapshot
+    db = database.SessionLocal()
+    try:
+        snapshot.hospitals.load(db)
+    finally:
+        db.close()
+    routed = await matrix.refresh(snapshot.hospitals.all())
+    await engine.close_router()
+    print(f"Routed {routed} hospitals over {len(matrix.grid)} zones into {matrix.path}")
+
+if __name__ == "__main__":
+    # Build or update the matrix ahead of time: ZONE_MATRIX_PATH=zones.npy python zones.py
+    if not matrix.path:
+        raise SystemExit("Set ZONE_MATRIX_PATH")
+    asyncio.run(_build_once())
@@ -61,8 +61,38 @@ const AmbulancePortal = () => {
             const newWs = new WebSocket(`ws://localhost:8000/ws/trip/${activeTrip.id}`);
             setWs(newWs);
 
-            // Setup mock eta countdown interval
+            newWs.onmessage = (event) => {
+                try {
+                    const data = JSON.parse(event.data);
+                    if (data.type === 'ping') {
+                        // Answer the server heartbeat so the socket isn't treated as half-open
+                        newWs.send(JSON.stringify({ type: 'pong' }));
+                    } else if (data.type === 'eta_update') {
+                        // Server-side ETA recomputed from our position fixes
+                        setActiveTrip(prev => prev ? { ...prev, eta_minutes: data.eta } : prev);
+                    }
+                } catch (e) {
+                    console.error("WS parse error", e);
+                }
+            };
+
+            // With GPS available the server recomputes ETA from our position fixes
+            let watchId = null;
+            if (navigator.geolocation) {
+                watchId = navigator.geolocation.watchPosition((pos) => {
+                    if (newWs.readyState === WebSocket.OPEN) {
+                        newWs.send(JSON.stringify({ type: 'position_update', lat: pos.coords.latitude, lng: pos.coords.longitude }));
+                    }
+                }, () => {
+                    // No permission or no fix: stop watching and let the countdown run
+                    navigator.geolocation.clearWatch(watchId);
+                    watchId = null;
+                }, { enableHighAccuracy: true });
+            }
+
+            // Without GPS fall back to the mock eta countdown
             const interval = setInterval(() => {
+                if (watchId !== null) return;
                 setActiveTrip(prev => {
                     if (!prev || prev.status === 'ARRIVED') return prev;
                     const newEta = Math.max(0, prev.eta_minutes - 0.5); // countdown by 30s
@@ -78,6 +108,7 @@ const AmbulancePortal = () => {
 
             return () => {
                 clearInterval(interval);
+                if (watchId !== null) navigator.geolocation.clearWatch(watchId);
                 newWs.close();
                 setWs(null);
             };
@@ -87,7 +118,7 @@ const AmbulancePortal = () => {
     const fetchActiveTrip = async () => {
         try {
             const res = await api.get('/trips/driver');
-            const active = res.data.find(t => t.status !== 'ARRIVED');
+            const active = res.data.find(t => t.status !== 'ARRIVED' && t.status !== 'CANCELLED');
             if (active) setActiveTrip(active);
         } catch (err) {
             console.error(err);
@@ -1,4 +1,4 @@
-import React, { useState, useEffect, useContext } from 'react';
+import React, { useState, useEffect, useContext, useRef } from 'react';
 import { AuthContext } from '../context/AuthContext';
 import api from '../api';
 import { ShieldPlus, Activity, CheckCircle, AlertTriangle, Clock } from 'lucide-react';
@@ -7,74 +7,91 @@ const HospitalPortal = () => {
     const { user, logout } = useContext(AuthContext);
     const [incomingCases, setIncomingCases] = useState([]);
     const [hospitalInfo, setHospitalInfo] = useState(null);
-    const [ws, setWs] = useState(null);
+    // Sequence number of the last snapshot/delta applied; sent back as ?since= on reconnect
+    const seqRef = useRef(null);
 
     // Edit Form State
     const [isEditing, setIsEditing] = useState(false);
     const [editForm, setEditForm] = useState(null);
+    // Bed counts when editing started; saving sends the difference, so holds and
+    // admissions recorded meanwhile are kept
+    const [editBase, setEditBase] = useState(null);
 
     useEffect(() => {
-        fetchInitialData();
-    }, []);
+        if (!isEditing) setEditForm(hospitalInfo);
+    }, [hospitalInfo]);
 
     useEffect(() => {
-        if (user?.hospital_id && !ws) {
-            const newWs = new WebSocket(`ws://localhost:8000/ws/hospital/${user.hospital_id}`);
-            setWs(newWs);
+        if (!user?.hospital_id) return;
+        let socket = null;
+        let retry = null;
+        let stopped = false;
+
+        const applyDelta = (delta) => {
+            if (delta.kind === 'hospital') {
+                setHospitalInfo(delta.hospital);
+            } else if (delta.kind === 'trip') {
+                setIncomingCases(cases => {
+                    const rest = cases.filter(c => c.id !== delta.trip.id);
+                    // Show only active/dispatched cases
+                    if (delta.trip.status === 'ARRIVED' || delta.trip.status === 'CANCELLED') return rest;
+                    return [...rest, delta.trip].sort((a, b) => a.id - b.id);
+                });
+            }
+        };
 
-            newWs.onmessage = (event) => {
+        const connect = () => {
+            // The server answers with the deltas we missed, or a fresh snapshot if it no longer has them
+            const params = new URLSearchParams({ token: localStorage.getItem('token') || '' });
+            if (seqRef.current !== null) params.set('since', seqRef.current);
+            socket = new WebSocket(`ws://localhost:8000/ws/hospital/${user.hospital_id}?${params}`);
+
+            socket.onmessage = (event) => {
                 try {
                     const data = JSON.parse(event.data);
-                    if (data.type === 'eta_update') {
-                        // Refresh cases to get new ETA
-                        fetchCases();
+                    if (data.type === 'ping') {
+                        // Answer the server heartbeat so the socket isn't treated as half-open
+                        socket.send(JSON.stringify({ type: 'pong' }));
+                    } else if (data.type === 'snapshot') {
+                        seqRef.current = data.seq;
+                        setHospitalInfo(data.hospital);
+                        setIncomingCases(data.trips);
+                    } else if (data.type === 'delta') {
+                        if (seqRef.current === null || data.seq <= seqRef.current) return;
+                        if (data.seq > seqRef.current + 1) {
+                            // Missed a delta: reconnect and resume from the last one applied
+                            socket.close();
+                            return;
+                        }
+                        seqRef.current = data.seq;
+                        applyDelta(data);
+                    } else if (data.type === 'eta_update') {
+                        setIncomingCases(cases => cases.map(c => c.id === data.trip_id ? { ...c, eta_minutes: data.eta } : c));
                     }
                 } catch (e) {
                     console.error("WS parse error", e);
                 }
             };
 
-            return () => {
-                newWs.close();
-                setWs(null);
+            socket.onclose = (event) => {
+                // 4401/4403: not logged in as this hospital's staff; retrying won't help
+                if (event.code === 4401 || event.code === 4403) return;
+                if (!stopped) retry = setTimeout(connect, 1000);
             };
-        }
-    }, [user, ws]);
-
-    const fetchInitialData = async () => {
-        try {
-            const hRes = await api.get('/hospitals');
-            const hInfo = hRes.data.find(h => h.id === user.hospital_id);
-            setHospitalInfo(hInfo);
-            setEditForm(hInfo);
-            await fetchCases();
-        } catch (err) {
-            console.error(err);
-        }
-    };
+        };
 
-    const fetchCases = async () => {
-        if (!user?.hospital_id) return;
-        try {
-            const cRes = await api.get(`/trips/hospital/${user.hospital_id}`);
-            // Fetch incident details for each trip
-            const tripsWithIncidents = await Promise.all(cRes.data.map(async (trip) => {
-                // In a real app we'd have a joined endpoint, but for demo we can mock incident details 
-                // or assume we have the ID to display
-                return trip;
-            }));
-
-            // Show only active/dispatched cases
-            setIncomingCases(tripsWithIncidents.filter(c => c.status !== 'ARRIVED'));
-        } catch (err) {
-            console.error(err);
-        }
-    };
+        connect();
+        return () => {
+            stopped = true;
+            clearTimeout(retry);
+            socket.close();
+        };
+    }, [user]);
 
     const handleAction = async (tripId, actionType) => {
         try {
+            // The case updates itself from the delta the server pushes
             await api.post(`/trips/${tripId}/action?action=${actionType}&message=Hospital%20Staff%20acknowledged`);
-            fetchCases();
         } catch (err) {
             console.error(err);
         }
@@ -82,11 +99,23 @@ const HospitalPortal = () => {
 
     const handleSaveResources = async () => {
         try {
-            const res = await api.put(`/hospitals/${user.hospital_id}`, editForm);
+            const capacity = {};
+            for (const type of ['icu', 'general']) {
+                const delta = editForm[`${type}_beds`] - editBase[`${type}_beds`];
+                if (delta) capacity[`${type}_delta`] = delta;
+            }
+            if (Object.keys(capacity).length) {
+                await api.patch(`/hospitals/${user.hospital_id}/capacity`, capacity);
+            }
+            const { name, lat, lng, affordability_tier, rating, has_cardiology, has_trauma, has_neurology, has_pulmonology } = editForm;
+            const res = await api.put(`/hospitals/${user.hospital_id}`, {
+                name, lat, lng, affordability_tier, rating, has_cardiology, has_trauma, has_neurology, has_pulmonology,
+            });
             setHospitalInfo(res.data);
             setIsEditing(false);
         } catch (err) {
             console.error("Failed to update resources", err);
+            if (err.response?.status === 409) alert(err.response.data.detail);
         }
     };
 
@@ -116,7 +145,7 @@ const HospitalPortal = () => {
                                     {isEditing ? (
                                         <input type="number" className="form-input" style={{ width: '80px', padding: '0.2rem' }} value={editForm.icu_beds} onChange={e => setEditForm({ ...editForm, icu_beds: parseInt(e.target.value) || 0 })} />
                                     ) : (
-                                        <span style={{ fontWeight: 'bold' }}>{hospitalInfo.icu_beds} Available</span>
+                                        <span style={{ fontWeight: 'bold' }}>{hospitalInfo.icu_beds - hospitalInfo.icu_reserved} Available{hospitalInfo.icu_reserved > 0 && ` (+${hospitalInfo.icu_reserved} held)`}</span>
                                     )}
                                 </div>
                                 <div style={{ display: 'flex', justifyContent: 'space-between', paddingBottom: '0.5rem', borderBottom: '1px solid var(--border-color)', alignItems: 'center' }}>
@@ -124,7 +153,7 @@ const HospitalPortal = () => {
                                     {isEditing ? (
                                         <input type="number" className="form-input" style={{ width: '80px', padding: '0.2rem' }} value={editForm.general_beds} onChange={e => setEditForm({ ...editForm, general_beds: parseInt(e.target.value) || 0 })} />
                                     ) : (
-                                        <span style={{ fontWeight: 'bold' }}>{hospitalInfo.general_beds} Available</span>
+                                        <span style={{ fontWeight: 'bold' }}>{hospitalInfo.general_beds - hospitalInfo.general_reserved} Available{hospitalInfo.general_reserved > 0 && ` (+${hospitalInfo.general_reserved} held)`}</span>
                                     )}
                                 </div>
 
@@ -150,7 +179,7 @@ const HospitalPortal = () => {
                                         <button className="btn btn-outline" style={{ flex: 1 }} onClick={() => { setIsEditing(false); setEditForm(hospitalInfo); }}>Cancel</button>
                                     </div>
                                 ) : (
-                                    <button className="btn btn-outline" style={{ marginTop: '1rem' }} onClick={() => setIsEditing(true)}>Update Resources</button>
+                                    <button className="btn btn-outline" style={{ marginTop: '1rem' }} onClick={() => { setEditBase(hospitalInfo); setIsEditing(true); }}>Update Resources</button>
                                 )}
                             </div>
                         )}